@@ -0,0 +1,85 @@
+# Generates synthetic plua programs whose size grows with a single parameter
+#   python bench/generate.py KIND SIZE [OUTPUT_PATH]
+import sys
+
+def generate_defs(size: int) -> str:
+    # `size` variables, each defined then reassigned from the previous one
+    lines = ["def v0 : int => 0"]
+    for i in range(1, size):
+        lines.append(f"def v{i} : int => ( v{i - 1} + {i} )")
+        lines.append(f"v{i} => ( v{i} * 2 - v{i - 1} )")
+    lines.append(f"print v{size - 1}")
+    return "\n".join(lines) + "\n"
+
+def generate_nested(size: int) -> str:
+    # 100 statements whose parens are nested `size` levels deep
+    lines = ["def x : int => 1"]
+    for i in range(100):
+        lines.append("print " + "( x + " * size + str(i) + " )" * size)
+    return "\n".join(lines) + "\n"
+
+def generate_chain(size: int) -> str:
+    # 100 statements adding and multiplying `size` operands without parens
+    operands = " + ".join(f"x * {i % 7 + 1}" for i in range(size))
+    lines = ["def x : int => 3"]
+    for i in range(100):
+        lines.append(f"print ( {operands} - {i} )")
+    return "\n".join(lines) + "\n"
+
+def generate_calls(size: int) -> str:
+    # `size` functions called from the main program, every odd function also calls the even one before it
+    lines = ["def total : int => 0"]
+    for i in range(size):
+        lines.append(f"func f{i} <- ( a b )")
+        if i % 2 == 1:
+            lines.append(f"  f{i - 1} ( a 1 )")
+        lines.append(f"  total => ( total + a * b )")
+        lines.append(f"  return ( a + b )")
+        lines.append("end")
+    for i in range(size):
+        lines.append(f"print ( f{i} ( {i} 2 ) )")
+    lines.append("print total")
+    return "\n".join(lines) + "\n"
+
+def generate_prints(size: int) -> str:
+    # `size` prints of strings with escapes and of numbers, like a script writing a log
+    lines = ["def n : int => 0"]
+    for i in range(size):
+        if i % 2 == 0:
+            lines.append(f'print "step\\t{i}\\t\\"ok\\""')
+        else:
+            lines.append(f"print ( n + {i} )")
+    return "\n".join(lines) + "\n"
+
+GENERATORS = {
+        "defs"  : generate_defs,
+        "nested": generate_nested,
+        "chain" : generate_chain,
+        "calls" : generate_calls,
+        "prints": generate_prints
+    }
+
+# Sizes of each kind used for the scaling curves, they double so a quadratic phase shows up
+# as its time growing four times from one size to the next
+SIZES = {
+        "defs"  : [1000, 2000, 4000, 8000, 16000],
+        "nested": [25, 50, 100, 200, 400],
+        "chain" : [25, 50, 100, 200, 400],
+        "calls" : [100, 200, 400, 800, 1600],
+        "prints": [1000, 2000, 4000, 8000, 16000]
+    }
+assert GENERATORS.keys() == SIZES.keys(), "Every generator needs its sizes"
+
+def generate(kind: str, size: int) -> str:
+    return GENERATORS[kind](size)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in GENERATORS:
+        print(f"USAGE: {sys.argv[0]} <{'|'.join(GENERATORS)}> SIZE [OUTPUT_PATH]")
+        exit(1)
+    source = generate(sys.argv[1], int(sys.argv[2]))
+    if len(sys.argv) > 3:
+        with open(sys.argv[3], "w") as file:
+            file.write(source)
+    else:
+        sys.stdout.write(source)
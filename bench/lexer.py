@@ -0,0 +1,32 @@
+# Measures how many tokens per second the lexer produces on a generated source file
+#   python bench/lexer.py [LINES]
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import plua
+
+LINES = [
+    'def number{i} : int => ( {i} + 35 * 2 )',
+    'number{i} => ( number{i} - 1 )',
+    'print ( float number{i} / 3.5 )',
+    'print "Hello \\"{i}\\" World\\n"',
+    'print ( number{i} >= 10 )',
+]
+
+def generate(path: str, lines: int):
+    with open(path, "w") as file:
+        for i in range(lines):
+            file.write(LINES[i % len(LINES)].format(i=i // len(LINES)) + "\n")
+
+if __name__ == "__main__":
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "lexer.plua")
+        generate(path, lines)
+        start = time.perf_counter()
+        tokens = plua.lex_file(path)
+        elapsed = time.perf_counter() - start
+    print(f"{len(tokens)} tokens in {elapsed:.3f}s: {len(tokens) / elapsed:,.0f} tokens/s")
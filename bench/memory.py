@@ -0,0 +1,43 @@
+# Measures the memory kept by the tokens and by the syntax tree of a generated source file
+#   python bench/memory.py [LINES]
+import os
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import plua
+from lexer import generate
+
+def count_nodes(program: plua.Program) -> int:
+    nodes = 0
+    stack = list(program)
+    while stack:
+        node = stack.pop()
+        nodes += 1
+        for field in ("value", "lhs", "rhs"):
+            child = getattr(node, field, None)
+            if child is not None and not isinstance(child, (str, int, float, bool)):
+                stack.append(child)
+        stack.extend(getattr(node, "args", ()))
+        stack.extend(getattr(node, "body", ()))
+    return nodes
+
+if __name__ == "__main__":
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "memory.plua")
+        generate(path, lines)
+
+        tracemalloc.start()
+        tokens = plua.lex_file(path)
+        token_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        program = plua.parse_program(iter(tokens))
+        tree_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    nodes = count_nodes(program)
+    print(f"{len(tokens)} tokens: {token_bytes / len(tokens):.1f} bytes per token")
+    print(f"{nodes} nodes: {tree_bytes / nodes:.1f} bytes per node")
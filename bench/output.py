@@ -0,0 +1,31 @@
+# Measures how many lines per second a print heavy program writes to a pipe with each buffering
+#   python bench/output.py [PRINTS]
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from generate import generate
+
+BENCH_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PLUA = os.path.join(BENCH_DIRECTORY, "..", "plua.py")
+
+def run(path: str, buffering: str, prints: int) -> float:
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, PLUA, path, f"--buffering={buffering}"], stdout=subprocess.PIPE, check=True)
+    elapsed = time.perf_counter() - start
+    assert process.stdout.count(b"\n") >= prints, "The program did not print every line"
+    return elapsed
+
+if __name__ == "__main__":
+    prints = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "output.plua")
+        with open(path, "w") as file:
+            file.write(generate("prints", prints))
+        os.environ.setdefault("PLUA_CACHE_DIR", directory)
+        # The first run fills the cache so the runs below mostly time the output
+        run(path, "block", prints)
+        for buffering in ["line", "block"]:
+            elapsed = min(run(path, buffering, prints) for _ in range(3))
+            print(f"{buffering:5}: {prints} lines in {elapsed:.3f}s: {prints / elapsed:,.0f} lines/s")
@@ -0,0 +1,187 @@
+# Times the lexer, the parser and every engine separately, on tests/*.plua and on generated
+# programs of growing size, and writes the results as JSON
+#   python bench/suite.py [--output=PATH] [--repeat=N] [--kinds=defs,nested,...] [--engines=vm,tree,py]
+import contextlib
+import glob
+import io
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+from typing import *
+
+BENCH_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIRECTORY, ".."))
+import plua
+from generate import GENERATORS, SIZES, generate
+
+# Deeply nested programs go through the recursive parser and evaluator
+sys.setrecursionlimit(20000)
+
+def run_vm(program: plua.Program):
+    start = time.perf_counter()
+    compiled = plua.compile_program(plua.optimize_program(program, 0))
+    compiled_at = time.perf_counter()
+    with contextlib.closing(plua.TaskPool(plua.compiled_functions(compiled))) as tasks:
+        plua.execute(compiled, sys.stdout, tasks=tasks)
+    return compiled_at - start, time.perf_counter() - compiled_at
+
+def run_tree(program: plua.Program):
+    start = time.perf_counter()
+    plua.resolve_names(program)
+    program = plua.link_program(program)
+    functions = plua.program_functions(program)
+    resolved_at = time.perf_counter()
+    with contextlib.closing(plua.TaskPool(functions)) as tasks:
+        plua.simulate(program, plua.Context(functions, sys.stdout, tasks=tasks))
+    return resolved_at - start, time.perf_counter() - resolved_at
+
+def run_py(program: plua.Program, filepath: str):
+    start = time.perf_counter()
+    linked = plua.link_program(plua.optimize_program(program, 0))
+    code = plua.transpile_program(linked, filepath)
+    transpiled_at = time.perf_counter()
+    with contextlib.closing(plua.TaskPool(plua.program_functions(linked), engine="py")) as tasks:
+        plua.execute_python(code, sys.stdout, tasks=tasks)
+    return transpiled_at - start, time.perf_counter() - transpiled_at
+
+ENGINES = ["vm", "tree", "py"]
+
+def measure_once(filepath: str, engines: List[str]) -> dict:
+    """
+    Times each phase of running the program once. A program exiting with an error is
+    reported with the phase it stopped in.
+    """
+    result = {}
+    phase = "lex"
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            start = time.perf_counter()
+            tokens = plua.lex_file(filepath)
+            result["lex"] = time.perf_counter() - start
+
+            phase = "parse"
+            start = time.perf_counter()
+            program = plua.parse_program(tokens)
+            result["parse"] = time.perf_counter() - start
+
+            for engine in engines:
+                phase = engine
+                if engine == "vm":
+                    result["vm_compile"], result["vm_run"] = run_vm(program)
+                elif engine == "tree":
+                    result["tree_resolve"], result["tree_run"] = run_tree(program)
+                elif engine == "py":
+                    result["py_compile"], result["py_run"] = run_py(program, filepath)
+    except plua.PluaError as error:
+        result["error"] = f"{phase}: {error}"
+    except RecursionError:
+        result["error"] = f"{phase}: maximum recursion depth exceeded"
+    except plua.TranspileError as error:
+        result["error"] = f"{phase}: {error}"
+    result["tokens"] = len(tokens) if phase != "lex" else 0
+    return result
+
+def measure(filepath: str, engines: List[str], repeat: int) -> dict:
+    # The best of the runs is the least disturbed by the rest of the machine
+    runs = [measure_once(filepath, engines) for _ in range(repeat)]
+    best = dict(runs[0])
+    for run in runs[1:]:
+        for key, value in run.items():
+            if isinstance(value, float):
+                best[key] = min(best.get(key, value), value)
+    return best
+
+def scaling_exponent(sizes: List[int], times: List[float]) -> Optional[float]:
+    """
+    Slope of the least squares fit of log(time) over log(size): about 1 for a linear
+    phase and 2 for a quadratic one.
+    """
+    points = [(math.log(size), math.log(time)) for size, time in zip(sizes, times) if time > 0]
+    if len(points) < 2: return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    covariance = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    return round(covariance / variance, 3)
+
+def scaling_curve(kind: str, engines: List[str], repeat: int, directory: str) -> dict:
+    points = []
+    for size in SIZES[kind]:
+        path = os.path.join(directory, f"{kind}-{size}.plua")
+        with open(path, "w") as file:
+            file.write(generate(kind, size))
+        point = measure(path, engines, repeat)
+        point["size"] = size
+        points.append(point)
+        print(f"  {kind:6} {size:6}: " + "  ".join(f"{key} {value:.4f}s" for key, value in point.items() if isinstance(value, float)), file=sys.stderr)
+
+    phases = sorted({ key for point in points for key, value in point.items() if isinstance(value, float) })
+    exponents = {}
+    for phase in phases:
+        measured = [point for point in points if phase in point]
+        exponents[phase] = scaling_exponent([point["size"] for point in measured], [point[phase] for point in measured])
+    return { "points": points, "exponents": exponents }
+
+def usage(program_name: str):
+    print(f"USAGE: {program_name} [OPTIONS]")
+    print(f"    OPTIONS: ")
+    print(f"        --output=<path>        Write the JSON results to this file instead of stdout")
+    print(f"        --repeat=<n>           Keep the best of n runs of every program (default 3)")
+    print(f"        --kinds=<kinds>        Comma separated generators for the scaling curves: {','.join(GENERATORS)}")
+    print(f"        --engines=<engines>    Comma separated engines to time: {','.join(ENGINES)}")
+
+if __name__ == "__main__":
+    program_name, *argv = sys.argv
+    output_path = None
+    repeat = 3
+    kinds = list(GENERATORS)
+    engines = list(ENGINES)
+    for arg in argv:
+        if arg.startswith("--output="):
+            output_path = arg[len("--output="):]
+        elif arg.startswith("--repeat="):
+            repeat = int(arg[len("--repeat="):])
+        elif arg.startswith("--kinds="):
+            kinds = arg[len("--kinds="):].split(",")
+        elif arg.startswith("--engines="):
+            engines = arg[len("--engines="):].split(",")
+        else:
+            usage(program_name)
+            print(f"ERROR: unknown argument `{arg}`")
+            exit(1)
+    for kind in kinds:
+        if kind not in GENERATORS:
+            usage(program_name)
+            print(f"ERROR: unknown generator `{kind}`")
+            exit(1)
+    for engine in engines:
+        if engine not in ENGINES:
+            usage(program_name)
+            print(f"ERROR: unknown engine `{engine}`")
+            exit(1)
+
+    results = {
+        "python": platform.python_version(),
+        "interpreter": plua.interpreter_version(),
+        "repeat": repeat,
+        "tests": {},
+        "scaling": {}
+    }
+    for path in sorted(glob.glob(os.path.join(BENCH_DIRECTORY, "..", "tests", "*.plua"))):
+        results["tests"][os.path.basename(path)] = measure(path, engines, repeat)
+    with tempfile.TemporaryDirectory() as directory:
+        for kind in kinds:
+            results["scaling"][kind] = scaling_curve(kind, engines, repeat, directory)
+            print(f"  {kind:6} exponents: {results['scaling'][kind]['exponents']}", file=sys.stderr)
+
+    if output_path is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(output_path, "w") as file:
+            json.dump(results, file, indent=2)
@@ -1,9 +1,58 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import *
 from enum import Enum, auto
+import array
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import glob
+import hashlib
+import io
+import itertools
+import json
+import marshal
+import math
+import mmap
+import operator
+import os
+import re
+import socket
+import struct
 import sys
+import time
+import traceback
+import types
 
 Loc = Tuple[str, int, int]
+
+class PluaError(Exception):
+    """
+    Error of a plua program, from lexing to execution. Printed as `file:row:col: ERROR: message`
+    followed by a NOTE line for every note.
+    """
+    def __init__(self, loc: Loc, message: str, *notes: str):
+        super().__init__(loc, message, *notes)
+        self.loc = loc
+        self.message = message
+        self.notes = notes
+
+    def __str__(self) -> str:
+        return "\n".join(["%s:%d:%d: ERROR: %s" % (*self.loc, self.message)] +
+                         ["%s:%d:%d: NOTE: %s" % (*self.loc, note) for note in self.notes])
+
+class PluaErrors(PluaError):
+    """
+    Several errors reported at once, like the type errors found before a program runs.
+    Its loc and message are the ones of the first error.
+    """
+    def __init__(self, errors: List[PluaError]):
+        super().__init__(errors[0].loc, errors[0].message, *errors[0].notes)
+        self.args = (errors,)
+        self.errors = errors
+
+    def __str__(self) -> str:
+        return "\n".join(map(str, self.errors))
  
 class OpType(Enum):
     PRINT=auto()
@@ -25,14 +74,24 @@ class OpType(Enum):
     FUNC=auto()
     END=auto()
     ARG_ARROW=auto()
+    RETURN=auto()
+    WHILE=auto()
+    ARROW=auto()
+    PURE=auto()
+    SUM=auto()
+    MIN=auto()
+    MAX=auto()
+    IF=auto()
+    ELSE=auto()
+    IMPORT=auto()
+    SPAWN=auto()
+    JOIN=auto()
     #LBRACKET=auto()
     #RBRACKET=auto()
 
-OpTypes = [ x for x in OpType if x ]
-
-SEPARATORS = ['(', ')']
-KEYWORDS_SIGNS = ['+', '*', '/', '-', '>', '<', '>=', '<=', '==', ':', '=>', '<-']
-KEYWORDS = [ str(typ).split('.')[1].lower() for typ in OpType]
+SEPARATORS = frozenset(['(', ')'])
+KEYWORDS_SIGNS = frozenset(['+', '*', '/', '-', '>', '<', '>=', '<=', '==', ':', '=>', '<-', '->'])
+KEYWORDS = frozenset(typ.name.lower() for typ in OpType)
 KEYWORDS_BY_NAME = {
         "print": OpType.PRINT,
         "("    : OpType.LPAREN,
@@ -52,17 +111,36 @@ KEYWORDS_BY_NAME = {
         "=>"   : OpType.EQUAL_ARROW,
         "func" : OpType.FUNC,
         "end"  : OpType.END,
-        "<-"   : OpType.ARG_ARROW
+        "<-"   : OpType.ARG_ARROW,
+        "return": OpType.RETURN,
+        "while": OpType.WHILE,
+        "->"   : OpType.ARROW,
+        "pure" : OpType.PURE,
+        "sum"  : OpType.SUM,
+        "min"  : OpType.MIN,
+        "max"  : OpType.MAX,
+        "if"   : OpType.IF,
+        "else" : OpType.ELSE,
+        "import": OpType.IMPORT,
+        "spawn": OpType.SPAWN,
+        "join" : OpType.JOIN
     }
 assert len(KEYWORDS_BY_NAME) == len(OpType), "Exhaustive handling of ops type in KEYWORDS_BY_NAME"
-assert len(KEYWORDS_SIGNS) == len(OpType) - 7, "Exhaustive handling of keywords signs"
-assert len(SEPARATORS) == len(OpType) - 17, "Exhaustive handling of SEPARATORS"
-
-@dataclass
-class Op:
-    typ: OpType
-    loc: Loc
-    value: Union[str, int, list]
+assert len(KEYWORDS_SIGNS) == len(OpType) - 18, "Exhaustive handling of keywords signs"
+assert len(SEPARATORS) == len(OpType) - 29, "Exhaustive handling of SEPARATORS"
+
+# Binding power of the binary operators, higher binds tighter
+BINARY_PRECEDENCE = {
+        OpType.EQUAL  : 1,
+        OpType.GT     : 1,
+        OpType.LT     : 1,
+        OpType.GE     : 1,
+        OpType.LE     : 1,
+        OpType.PLUS   : 2,
+        OpType.SUB    : 2,
+        OpType.MUL    : 3,
+        OpType.TRUEDIV: 3
+    }
 
 class TokenType(Enum):
     KEYWORD=auto()
@@ -73,1062 +151,3559 @@ class TokenType(Enum):
     INT=auto()
     FLOAT=auto()
     BOOL=auto()
+    ARRAY=auto()
+    TASK=auto()
 
-TokenTypes = [ x for x in TokenType if x ]
-
-@dataclass
+@dataclass(slots=True)
 class Token:
     typ: TokenType
     loc: Loc
     value: Union[str, int]
 
-@dataclass
-class Parens:
-    # Loc of left paren
-    loc: Loc
-    ops: Union[Token, Op]
-
-    def __len__(self):
-        length = 0
-        ip = 0
-        op = None
-        while ip < len(self.ops):
-            if op and isinstance(op, Parens): 
-                length += len(Parens)
-                ip += 1
-            op = self.ops[ip]
-            if op.typ == OpType.PRINT: 
-                length += calculate_length_ops(op.value)
-                ip += 1
-            elif op.typ in TokenTypes or op.typ in OpTypes: 
-                ip += 1
-                length += 1
-        return length
-
-@dataclass
+@dataclass(slots=True)
 class Variable:
     typ: Union[TokenType.INT, TokenType.FLOAT, TokenType.BOOL, TokenType.STR]
     value: Token
 
-Program = List[Union[Token, Op, Parens]]
-
-Variables = {}
-# List because assignation is just first, second etc. No names are required
-Context_Variables = []
-Functions = {}
-
-
-def simulate(program: Program, was_arg: bool=False, track_usage: bool=False, in_function: bool=False):
-    global Context_Variables
-
-    in_parens = False
-    if isinstance(program, Parens):
-        program = program.ops
-        in_parens = True
-
-    if in_function and len(Context_Variables) > 0:
-        assigned = {}
-        ip = 0
-        if len(program) > 0:
-            for idx, token in enumerate(program):
-                if isinstance(token, Parens):
-                    for jdx, op in enumerate(token.ops):
-                        if op.typ == TokenType.WORD:
-                            if op.value in assigned:
-                                token.ops[jdx] = assigned[op]
-                            elif op.value not in Variables and op.value not in Functions:
-                                assigned = {op.value: Context_Variables[ip]}
-                                token.ops[jdx] = Context_Variables[ip]
-                                ip += 1
-                elif token.typ == TokenType.WORD:
-                    if token.value in assigned:
-                        program[idx] = assigned[token]
-                    elif token.value not in Variables and token.value not in Functions:
-                        assigned = {token.value: Context_Variables[ip]}
-                        program[idx] = Context_Variables[ip]
-                        ip += 1
- 
-    used = 0
-    ip = 0
-    while ip < len(program):
-    #for op in range(len(program)):
-        if len(program) == 0: break
-        if ip < 0: ip = 0
-        if isinstance(program, Parens): program = program.ops
-        token = program[ip]
-        #print("Executing: ", token.typ, " Program is now: ", program, " Ip is :", ip)
-        if token.typ in OpType:
-            assert len(OpType) == 19, "Exhaustive handling of ops in simulate()"
-            if token.typ == OpType.PRINT:
-                value = program[ip+1]
-
-                program.pop(ip)
-                program.pop(ip)
-
-                if isinstance(value, Parens):
-                    value = simulate(value, track_usage=False)
-                    if len(value) > 1:
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: too many arguments for print operator: ", value)
-                        exit(1)
-                    # Doesn't crash ?
-                    value = value[0].value 
-
-                elif (hasattr(value, 'typ') and value.typ == TokenType.WORD):
-                    value = simulate([value], was_arg=True, track_usage=False, in_function=in_function).value
-
-                elif (hasattr(value, 'typ')):
-                    value = value.value
-                if isinstance(value, str):
-                    print(value.encode('latin-1', 'backslashreplace').decode('unicode-escape'))
-                else:
-                    print(value)
-                used += 1
-                if was_arg: return None, 0
-                continue
-            elif token.typ == OpType.FLOAT:
-                _ = program.pop(ip)
-                arg = program.pop(ip)
-                used += 2
-                
-                if arg.typ != TokenType.INT:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: expected an integer but found: ", arg.typ)
-                    exit(1)
-
-                if ip == 0 or ip == 1:
-                    eff_ip = 2
-                else: eff_ip = ip
-                program.insert(eff_ip-2, Token(TokenType.FLOAT, arg.loc, float(arg.value)))
-                continue
-            elif token.typ == OpType.PLUS:
-                if ip == 0:
-                    assert False, f"This could be a bug in either the parser or the inserts placed in the simulation, Current program is: {program}"
-                if ip == 1 or ip == 2:
-                    placing_ip = 0
-                else: placing_ip = ip - 3
-                arg1 = program.pop(ip-1)
-                _    = program.pop(ip-1)
-                arg2 = program.pop(ip-1)
-                used += 3
-                if arg2 == token: 
-                    assert False, "ERROR?"
-
-                if isinstance(arg1, Parens):
-                    arg1 = simulate(arg1, track_usage=False)
-                    if len(value) > 1:
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: too many arguments for mul operator: ", arg1)
-                        exit(1)
-                    arg1 = arg1[0]
-
-                if isinstance(arg2, Parens):
-                    arg2 = simulate(arg2, track_usage=False)
-                    if len(arg2) > 1:
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: too many arguments for mul operator: ", arg2)
-                        exit(1)
-                    arg2 = arg2[0]
-
-                if arg2.typ in OpType:
-                    program.insert(ip-1, arg2)
-                    result = simulate(program[placing_ip:], was_arg=True, track_usage=True)
-
-                    arg2, usedd = result
-                    for i in range(used): 
-                        if program: program.pop(ip-1)
-                    if not was_arg: used += usedd
- 
-                if isinstance(arg2, tuple): arg2 = arg2[0]
-                if arg1.typ != arg2.typ:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: `+` operator can only add two arguments of the same type but found `{arg1.typ}` and `{arg2.typ}`")
-                    exit(1)
-                if arg1.typ == TokenType.KEYWORD:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: `+` operator can only add strings or numbers.")
-                    exit(1)
-                new_value = arg1.value + arg2.value
-
-                ip -= 2
-                if not was_arg: program.insert(placing_ip, Token(arg1.typ, arg2.loc, new_value))
-                else: return Token(arg1.typ, arg2.loc, new_value), used
-            elif token.typ == OpType.MUL:
-                if ip == 0:
-                    assert False, f"This could be a bug in either the parser or the inserts placed in the simulation, Current program is: {program}"
-                if ip == 1 or ip == 2:
-                    placing_ip = 0
-                else: placing_ip = ip - 3
-                arg1 = program.pop(ip-1)
-                _    = program.pop(ip-1)
-                arg2 = program.pop(ip-1)
-                used += 3
-                if arg2 == token: 
-                    assert False, "ERROR?"
-
-                if isinstance(arg1, Parens):
-                    arg1 = simulate(arg1, track_usage=False)
-                    if len(value) > 1:
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: too many arguments for mul operator: ", arg1)
-                        exit(1)
-                    arg1 = arg1[0].value
-
-                if isinstance(arg2, Parens):
-                    arg2 = simulate(arg2, track_usage=False)
-                    if len(value) > 1:
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: too many arguments for mul operator: ", arg2)
-                        exit(1)
-                    arg2 = arg2[0].value
-
-
-                if arg2.typ in OpType:
-                    program.insert(ip-1, arg2)
-                    result = simulate(program[placing_ip:], was_arg=True, track_usage=True)
-
-                    arg2, usedd = result
-                    for i in range(used): 
-                        if program: program.pop(ip-1)
-                    if not was_arg: used += usedd
-
-                if isinstance(arg2, tuple): arg2 = arg2[0]
-                if arg1.typ != arg2.typ:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: `*` operator can only multiply two arguments of the same type but found `{arg1.typ}` and `{arg2.typ}`")
-                    exit(1)
-                if arg1.typ != TokenType.INT and arg1.typ != TokenType.FLOAT:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: `*` operator can only multiply numbers but found type: `{arg1.typ}`")
-                    exit(1)
-                new_value = arg1.value * arg2.value
-
-                ip -= 2
-                if not was_arg: program.insert(placing_ip, Token(arg1.typ, arg2.loc, new_value))
-                else: return Token(arg1.typ, arg2.loc, new_value), used
-            elif token.typ == OpType.TRUEDIV:
-                if ip == 0:
-                    assert False, f"This could be a bug in either the parser or the inserts placed in the simulation, Current program is: {program}"
-                if ip == 1 or ip == 2:
-                    placing_ip = 0
-                else: placing_ip = ip - 3
-                arg1 = program.pop(ip-1)
-                _    = program.pop(ip-1)
-                arg2 = program.pop(ip-1)
-                used += 3
-                if arg2 == token: 
-                    assert False, "ERROR?"
-
-                if isinstance(arg1, Parens):
-                    arg1 = simulate(arg1, track_usage=False)
-                    if len(value) > 1:
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: too many arguments for mul operator: ", arg1)
-                        exit(1)
-                    arg1 = arg1[0]
-
-                if isinstance(arg2, Parens):
-                    arg2 = simulate(arg2, track_usage=False)
-                    if len(arg2) > 1:
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: too many arguments for mul operator: ", arg2)
-                        exit(1)
-                    arg2 = arg2[0]
-
-                if arg2.typ in OpType:
-                    program.insert(ip-1, arg2)
-                    result = simulate(program[placing_ip:], was_arg=True, track_usage=True)
-
-                    arg2, usedd = result
-                    for i in range(used): 
-                        if program: program.pop(ip-1)
-                    if not was_arg: used += usedd
-
-                if isinstance(arg2, tuple): arg2 = arg2[0]
-                if arg1.typ != arg2.typ:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: `/` operator can only multiply two arguments of the same type but found `{arg1.typ}` and `{arg2.typ}`")
-                    exit(1)
-                if arg1.typ != TokenType.INT and arg1.typ != TokenType.FLOAT:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: `/` operator can only multiply numbers but found type: `{arg1.typ}`")
-                    exit(1)
-
-                if arg1.value == 0 or arg2.value == 0:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: `/` operator cannot divide by 0")
-                    exit(1)
-                new_value = arg1.value / arg2.value
-
-                ip -= 2
-                if not was_arg: program.insert(placing_ip, Token(TokenType.FLOAT, arg2.loc, new_value))
-                else: return Token(TokenType.FLOAT, arg2.loc, new_value), used
-            elif token.typ == OpType.SUB:
-                if ip == 0:
-                    assert False, f"This could be a bug in either the parser or the inserts placed in the simulation, Current program is: {program}"
-                if ip == 1 or ip == 2:
-                    placing_ip = 0
-                else: placing_ip = ip - 3
-                arg1 = program.pop(ip-1)
-                _    = program.pop(ip-1)
-                arg2 = program.pop(ip-1)
-                used += 3
-                if arg2 == token: 
-                    assert False, "ERROR?"
-
-                if isinstance(arg1, Parens):
-                    arg1 = simulate(arg1, track_usage=False)
-                    if len(value) > 1:
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: too many arguments for mul operator: ", arg1)
-                        exit(1)
-                    arg1 = arg1[0]
-
-                if isinstance(arg2, Parens):
-                    arg2 = simulate(arg2, track_usage=False)
-                    if len(arg2) > 1:
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: too many arguments for mul operator: ", arg2)
-                        exit(1)
-                    arg2 = arg2[0]
-
-                if arg2.typ in OpType:
-                    program.insert(ip-1, arg2)
-                    result = simulate(program[placing_ip:], was_arg=True, track_usage=True)
-
-                    arg2, usedd = result
-                    for i in range(used): 
-                        if program: program.pop(ip-1)
-                    if not was_arg: used += usedd
-
-                if isinstance(arg2, tuple): arg2 = arg2[0]
-                if arg1.typ != arg2.typ:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: `-` operator can only substract two arguments of the same type but found `{arg1.typ}` and `{arg2.typ}`")
-                    exit(1)
-                if arg1.typ != TokenType.INT and arg1.typ != TokenType.FLOAT:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: `-` operator can only substract numbers but found type: `{arg1.typ}`")
-                    exit(1)
-                new_value = arg1.value - arg2.value
-
-                ip -= 2
-                if not was_arg: program.insert(placing_ip, Token(arg1.typ, arg2.loc, new_value))
-                else: return Token(arg1.typ, arg2.loc, new_value), used
-            elif token.typ == OpType.GT:
-                if ip == 0:
-                    assert False, f"This could be a bug in either the parser or the inserts placed in the simulation, Current program is: {program}"
-                if ip == 1 or ip == 2:
-                    placing_ip = 0
-                else: placing_ip = ip - 3
-                arg1 = program.pop(ip-1)
-                _    = program.pop(ip-1)
-                arg2 = program.pop(ip-1)
-                used += 3
-                if arg2 == token: 
-                    assert False, "ERROR?"
-
-                if isinstance(arg1, Parens):
-                    arg1 = simulate(arg1, track_usage=False)
-                    if len(value) > 1:
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: too many arguments for mul operator: ", arg1)
-                        exit(1)
-                    arg1 = arg1[0]
-
-                if isinstance(arg2, Parens):
-                    arg2 = simulate(arg2, track_usage=False)
-                    if len(arg2) > 1:
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: too many arguments for mul operator: ", arg2)
-                        exit(1)
-                    arg2 = arg2[0]
-
-                if arg2.typ in OpType:
-                    program.insert(ip-1, arg2)
-                    result = simulate(program[placing_ip:], was_arg=True, track_usage=True)
-
-                    arg2, usedd = result
-                    for i in range(used): 
-                        if program: program.pop(ip-1)
-                    if not was_arg: used += usedd
-
-                if isinstance(arg2, tuple): arg2 = arg2[0]
-                if arg1.typ != arg2.typ:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: `>` operator can only return a boolean value if the arguments have the same type but found:  `{arg1.typ}` and `{arg2.typ}`")
-                    exit(1)
-                if arg1.typ != TokenType.INT and arg1.typ != TokenType.FLOAT:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: `>` operator can only checks for numbers but found type: `{arg1.typ}`")
-                    exit(1)
-
-                new_value = (arg1.value > arg2.value)
-
-                ip -= 2
-                if not was_arg: program.insert(placing_ip, Token(TokenType.BOOL, arg2.loc, new_value))
-                else: return Token(TokenType.BOOL, arg2.loc, new_value), used
-            elif token.typ == OpType.LT:
-                if ip == 0:
-                    assert False, f"This could be a bug in either the parser or the inserts placed in the simulation, Current program is: {program}"
-                if ip == 1 or ip == 2:
-                    placing_ip = 0
-                else: placing_ip = ip - 3
-                arg1 = program.pop(ip-1)
-                _    = program.pop(ip-1)
-                arg2 = program.pop(ip-1)
-                used += 3
-                if arg2 == token: 
-                    assert False, "ERROR?"
-
-                if isinstance(arg1, Parens):
-                    arg1 = simulate(arg1, track_usage=False)
-                    if len(value) > 1:
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: too many arguments for mul operator: ", arg1)
-                        exit(1)
-                    arg1 = arg1[0]
-
-                if isinstance(arg2, Parens):
-                    arg2 = simulate(arg2, track_usage=False)
-                    if len(arg2) > 1:
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: too many arguments for mul operator: ", arg2)
-                        exit(1)
-                    arg2 = arg2[0]
-
-                if arg2.typ in OpType:
-                    program.insert(ip-1, arg2)
-                    result = simulate(program[placing_ip:], was_arg=True, track_usage=True)
-
-                    arg2, usedd = result
-                    for i in range(used): 
-                        if program: program.pop(ip-1)
-                    if not was_arg: used += usedd
-
-                if isinstance(arg2, tuple): arg2 = arg2[0]
-                if arg1.typ != arg2.typ:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: `<` operator can only return a boolean value if the arguments have the same type but found:  `{arg1.typ}` and `{arg2.typ}`")
-                    exit(1)
-                if arg1.typ != TokenType.INT and arg1.typ != TokenType.FLOAT:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: `<` operator can only checks for numbers but found type: `{arg1.typ}`")
-                    exit(1)
-                new_value = True if arg1.value < arg2.value else False
-
-                ip -= 2
-                if not was_arg: program.insert(placing_ip, Token(TokenType.BOOL, arg2.loc, new_value))
-                else: return Token(TokenType.BOOL, arg2.loc, new_value), used
-            elif token.typ == OpType.GE:
-                if ip == 0:
-                    assert False, f"This could be a bug in either the parser or the inserts placed in the simulation, Current program is: {program}"
-                if ip == 1 or ip == 2:
-                    placing_ip = 0
-                else: placing_ip = ip - 3
-                arg1 = program.pop(ip-1)
-                _    = program.pop(ip-1)
-                arg2 = program.pop(ip-1)
-                used += 3
-                if arg2 == token: 
-                    assert False, "ERROR?"
-
-                if isinstance(arg1, Parens):
-                    arg1 = simulate(arg1, track_usage=False)
-                    if len(value) > 1:
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: too many arguments for mul operator: ", arg1)
-                        exit(1)
-                    arg1 = arg1[0]
-
-                if isinstance(arg2, Parens):
-                    arg2 = simulate(arg2, track_usage=False)
-                    if len(arg2) > 1:
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: too many arguments for mul operator: ", arg2)
-                        exit(1)
-                    arg2 = arg2[0]
-
-                if arg2.typ in OpType:
-                    program.insert(ip-1, arg2)
-                    result = simulate(program[placing_ip:], was_arg=True, track_usage=True)
-
-                    arg2, usedd = result
-                    for i in range(used): 
-                        if program: program.pop(ip-1)
-                    if not was_arg: used += usedd
-
-                if isinstance(arg2, tuple): arg2 = arg2[0]
-                if arg1.typ != arg2.typ:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: `>=` operator can only return a boolean value if the arguments have the same type but found:  `{arg1.typ}` and `{arg2.typ}`")
-                    exit(1)
-                if arg1.typ != TokenType.INT and arg1.typ != TokenType.FLOAT:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: `>=` operator can only checks for numbers but found type: `{arg1.typ}`")
-                    exit(1)
-                new_value = True if arg1.value >= arg2.value else False
-
-                ip -= 2
-                if not was_arg: program.insert(placing_ip, Token(TokenType.BOOL, arg2.loc, new_value))
-                else: return Token(TokenType.BOOL, arg2.loc, new_value), used
-            elif token.typ == OpType.LE:
-                if ip == 0:
-                    assert False, f"This could be a bug in either the parser or the inserts placed in the simulation, Current program is: {program}"
-                if ip == 1 or ip == 2:
-                    placing_ip = 0
-                else: placing_ip = ip - 3
-                arg1 = program.pop(ip-1)
-                _    = program.pop(ip-1)
-                arg2 = program.pop(ip-1)
-                used += 3
-                if arg2 == token: 
-                    assert False, "ERROR?"
-    
-                if isinstance(arg1, Parens):
-                    arg1 = simulate(arg1, track_usage=False)
-                    if len(value) > 1:
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: too many arguments for mul operator: ", arg1)
-                        exit(1)
-                    arg1 = arg1[0]
-
-                if isinstance(arg2, Parens):
-                    arg2 = simulate(arg2, track_usage=False)
-                    if len(arg2) > 1:
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: too many arguments for mul operator: ", arg2)
-                        exit(1)
-                    arg2 = arg2[0]
-
-                if arg2.typ in OpType:
-                    program.insert(ip-1, arg2)
-                    result = simulate(program[placing_ip:], was_arg=True, track_usage=True)
-
-                    arg2, usedd = result
-                    for i in range(used): 
-                        if program: program.pop(ip-1)
-                    if not was_arg: used += usedd
-
-                if isinstance(arg2, tuple): arg2 = arg2[0]
-                if arg1.typ != arg2.typ:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: `<=` operator can only return a boolean value if the arguments have the same type but found:  `{arg1.typ}` and `{arg2.typ}`")
-                    exit(1)
-                if arg1.typ != TokenType.INT and arg1.typ != TokenType.FLOAT:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: `<=` operator can only checks for numbers but found type: `{arg1.typ}`")
-                    exit(1)
-                new_value = True if arg1.value <= arg2.value else False
-
-                ip -= 2
-                if not was_arg: program.insert(placing_ip, Token(TokenType.BOOL, arg2.loc, new_value))
-                else: return Token(TokenType.BOOL, arg2.loc, new_value), used
-            elif token.typ == OpType.EQUAL:
-                if ip == 0:
-                    assert False, f"This could be a bug in either the parser or the inserts placed in the simulation, Current program is: {program}"
-                if ip == 1 or ip == 2:
-                    placing_ip = 0
-                else: placing_ip = ip - 3
-                arg1 = program.pop(ip-1)
-                _    = program.pop(ip-1)
-                arg2 = program.pop(ip-1)
-                used += 3
-                if arg2 == token: 
-                    assert False, "ERROR?"
-
-                if isinstance(arg1, Parens):
-                    arg1 = simulate(arg1, track_usage=False)
-                    if len(value) > 1:
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: too many arguments for mul operator: ", arg1)
-                        exit(1)
-                    arg1 = arg1[0]
-
-                if isinstance(arg2, Parens):
-                    arg2 = simulate(arg2, track_usage=False)
-                    if len(arg2) > 1:
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: too many arguments for mul operator: ", arg2)
-                        exit(1)
-                    arg2 = arg2[0]
-
-                if arg2.typ in OpType:
-                    program.insert(ip-1, arg2)
-                    result = simulate(program[placing_ip:], was_arg=True, track_usage=True)
-
-                    arg2, usedd = result
-                    for i in range(used): 
-                        if program: program.pop(ip-1)
-                    if not was_arg: used += usedd
-
-                if isinstance(arg2, tuple): arg2 = arg2[0]
-                if arg1.typ != arg2.typ:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: `==` operator can only return a boolean value if the arguments have the same type but found:  `{arg1.typ}` and `{arg2.typ}`")
-                    exit(1)
-                new_value = True if arg1.value == arg2.value else False
-
-                ip -= 2
-                if not was_arg: program.insert(placing_ip, Token(TokenType.BOOL, arg2.loc, new_value))
-                else: return Token(TokenType.BOOL, arg2.loc, new_value), used
-            elif token.typ == OpType.DEF:
-                _ = program.pop(ip)
-                name = program.pop(ip)
-                if name.typ != TokenType.WORD:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: trying to name a variable to either a keyword, a number or a boolean value.")
-                    exit(1)
-
-                type_equal = program.pop(ip)
-                if type_equal.typ != OpType.TYPE_EQUAL:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: expected `:` but found: ", type_equal.value)
-                    exit(1)
-                typ = program.pop(ip)
-                typ = simulate([type_equal, typ], was_arg=True, track_usage=False)
-
-                equal_arrow = program.pop(ip)
-                if equal_arrow.typ != OpType.EQUAL_ARROW:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: expected `=>` but found: ", type_equal.value)
-                    exit(1)
-                value = program.pop(ip)
-                value = simulate([equal_arrow, value], was_arg=True, track_usage=False)
-    
-                if typ != value.typ:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: mismatched type definition and type of value.")
-                    exit(1)
-                Variables[name.value] = value
-            elif token.typ == OpType.TYPE_EQUAL:
-                if len(program[ip:]) == 1:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: expected one argument but found nothing.")
-                    exit(1)
-                _ = program.pop(ip)
-                value = program.pop(ip).value
-                if value == 'int': return TokenType.INT
-                elif value == 'float': return TokenType.FLOAT
-                elif value == 'bool': return TokenType.BOOL
-                elif value == 'str': return TokenType.STR
-                print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: given type is not a correct type.")
-                exit(1)
-            elif token.typ == OpType.EQUAL_ARROW:
-                if isinstance(program[ip+1], Parens): return simulate(program[ip+1], was_arg=True, track_usage=False)
-                return simulate([program[ip+1]], was_arg=True, track_usage=False)
-            elif token.typ == OpType.FUNC:
-                assert False, "Parser error?"
-            elif token.typ == OpType.END:
-                assert False, "Parser error?"
-            elif token.typ == OpType.ARG_ARROW:
-                assert False, "Parser error?"
-        elif token.typ == TokenType.WORD:
-            if in_function:
-                print(program)
-                exit(1)
-            elif token.value in Variables:
-                if not was_arg and program[ip+1].typ == OpType.EQUAL_ARROW:
-                    if len(program[ip+1:]) == 1:
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: not enough arguments for variable reassignation.")
-                        exit(1)
-
-                    value = simulate(program[ip+1:ip+3])
-            
-                    program.pop(ip)
-                    program.pop(ip)
-                    program.pop(ip)
-
-                    if value.typ != Variables[token.value].typ:
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: variable reassignation cannot change variable type.")
-                        exit(1)
-                    Variables[token.value] = value
-                else: 
-                    program[ip] = Variables[token.value]
-            elif token.value in Functions:
-                func = Functions[token.value]
-                if func["args"]:
-                    args_len = len(func["args_name"])
-                    if len(program[ip:]) == 1:
-                        print("%s:%d:%d: ERROR: expected arg for function call but found nothing" % token.loc)
-                        exit(1)
-                    
-                    arg = program[ip+1]
-                    if not isinstance(arg, Parens):
-                        print("%s:%d:%d: ERROR: arguments need to be passed in parentheses for function call" % token.loc)
-                        exit(1)
-
-                    if args_len < len(arg):
-                        print("%s:%d:%d: ERROR: too many arguments for function call" % token.loc)
-                        exit(1)
-                    elif args_len > len(arg):
-                        print("%s:%d:%d: ERROR: not enough arguments for function call" % token.loc)
-                        exit(1)
-
-                    for v in arg.ops:
-                        Context_Variables.append(v)
-                    simulate(Functions[token.value]["ops"], in_function=True)
-                    Context_Variables = []
-                    program.pop(ip)
-                else: simulate(Functions[token.value]["ops"])
-                program.pop(ip)
+TYPES_BY_NAME = {
+        "int"  : TokenType.INT,
+        "float": TokenType.FLOAT,
+        "bool" : TokenType.BOOL,
+        "str"  : TokenType.STR,
+        "array": TokenType.ARRAY,
+        "task" : TokenType.TASK
+    }
+
+class Array(array.array):
+    """
+    Value of the `array` type: numbers stored contiguously, `q` for ints and `d` for floats,
+    or the booleans (`b`) of an element-wise comparison. Operators never modify an array,
+    they build a new one, so arrays can be shared like the other values.
+    """
+    __slots__ = ()
+
+    def __str__(self) -> str:
+        if self.typecode == 'b':
+            return "[ " + " ".join("True" if value else "False" for value in self) + " ]"
+        return "[ " + " ".join(map(str, self)) + " ]"
+
+class Rope:
+    """
+    Value of a long `str` built by `+`. The string is kept as chunks of at least ROPE_CHUNK_SIZE
+    characters and a short tail, appending copies at most the tail so building a string one piece
+    at a time is linear. The chunks are joined once, the first time the string is printed or compared.
+    Ropes appended to share their list of chunks, only the last one can push to it without copying it.
+    """
+    __slots__ = ("chunks", "count", "tail", "value")
+
+    def __init__(self, chunks: List[str], count: int, tail: str):
+        self.chunks = chunks
+        # The chunks of this rope are the first `count` ones of the shared list
+        self.count = count
+        self.tail = tail
+        self.value = None
+
+    def append(self, text: str) -> "Rope":
+        if len(self.tail) + len(text) <= ROPE_CHUNK_SIZE:
+            return Rope(self.chunks, self.count, self.tail + text)
+        chunks = self.chunks
+        if len(chunks) != self.count:
+            # An other rope already pushed its chunks after ours
+            chunks = chunks[:self.count]
+        chunks.append(self.tail)
+        return Rope(chunks, self.count + 1, text)
+
+    def __str__(self) -> str:
+        if self.value is None:
+            self.value = "".join(self.chunks[:self.count]) + self.tail
+        return self.value
+
+    def __repr__(self) -> str:
+        return repr(str(self))
+
+    def __eq__(self, other: Any) -> bool:
+        if type(other) is not str and type(other) is not Rope:
+            return NotImplemented
+        return str(self) == str(other)
+
+    def __hash__(self) -> int:
+        return hash(str(self))
+
+# Strings shorter than this are concatenated by copying them, longer ones become ropes
+ROPE_CHUNK_SIZE = 1024
+
+def concat(arg1: Union[str, Rope], arg2: Union[str, Rope]) -> Union[str, Rope]:
+    if type(arg1) is Rope:
+        return arg1.append(str(arg2))
+    arg2 = str(arg2)
+    if len(arg1) + len(arg2) < ROPE_CHUNK_SIZE:
+        return arg1 + arg2
+    return Rope([], 0, arg1).append(arg2)
+
+class Task:
+    """
+    Value of the `task` type given by `spawn`: a call of a pure function running in a worker
+    process of the TaskPool, `join` waits for its result.
+    """
+    __slots__ = ("name", "future")
+
+    def __init__(self, name: str, future: concurrent.futures.Future):
+        self.name = name
+        self.future = future
+
+    def __str__(self) -> str:
+        return f"<task {self.name}>"
+
+# Python type of the elements of each kind of array
+ARRAY_ELEMENT_TYPES = {
+        'q': int,
+        'd': float,
+        'b': bool
+    }
+
+# Programs work on plain python values, this gives back the plua type of a value
+VALUE_TYPES = {
+        int  : TokenType.INT,
+        float: TokenType.FLOAT,
+        bool : TokenType.BOOL,
+        str  : TokenType.STR,
+        Rope : TokenType.STR,
+        Array: TokenType.ARRAY,
+        Task : TokenType.TASK
+    }
+
+def same_type(value: Any, other: Any) -> bool:
+    # A rope and a str are both strings
+    return VALUE_TYPES.get(type(value)) is VALUE_TYPES.get(type(other))
+
+LITERAL_TYPES = [TokenType.STR, TokenType.INT, TokenType.FLOAT, TokenType.BOOL, TokenType.ARRAY]
+
+# Nodes of the syntax tree built by the Parser, they are slotted since large scripts keep
+# hundreds of thousands of them alive
+
+@dataclass(slots=True)
+class Const:
+    loc: Loc
+    typ: TokenType
+    value: Union[str, int, float, bool]
+
+@dataclass(slots=True)
+class Name:
+    loc: Loc
+    name: str
+
+@dataclass(slots=True)
+class BinOp:
+    # Loc of the operator
+    loc: Loc
+    op: OpType
+    lhs: "Expr"
+    rhs: "Expr"
+    # Type of both operands when the type checker proves it, the operator then skips its checks
+    typ: Optional[TokenType] = None
+
+@dataclass(slots=True)
+class FloatCast:
+    loc: Loc
+    value: "Expr"
+
+@dataclass(slots=True)
+class Reduce:
+    # `sum`, `min` or `max` of an array
+    loc: Loc
+    op: OpType
+    value: "Expr"
+
+@dataclass(slots=True)
+class Call:
+    loc: Loc
+    name: str
+    args: List["Expr"]
+
+@dataclass(slots=True)
+class Spawn:
+    # Call of a pure function run by a worker process, its value is the task
+    loc: Loc
+    call: Call
+
+@dataclass(slots=True)
+class Join:
+    loc: Loc
+    value: "Expr"
+
+@dataclass(slots=True)
+class Print:
+    loc: Loc
+    value: "Expr"
+
+@dataclass(slots=True)
+class Def:
+    loc: Loc
+    name: str
+    typ: TokenType
+    value: "Expr"
+
+@dataclass(slots=True)
+class Assign:
+    loc: Loc
+    name: str
+    value: "Expr"
+
+@dataclass(slots=True)
+class FuncDef:
+    loc: Loc
+    name: str
+    params: List[str]
+    body: List["Stmt"]
+    # Declared with `pure`, its results are memoized by its arguments
+    pure: bool = False
+
+@dataclass(slots=True)
+class Return:
+    loc: Loc
+    value: "Expr"
+
+@dataclass(slots=True)
+class While:
+    loc: Loc
+    condition: "Expr"
+    body: List["Stmt"]
+
+@dataclass(slots=True)
+class Arm:
+    # Loc of the condition
+    loc: Loc
+    condition: "Expr"
+    body: List["Stmt"]
+
+@dataclass(slots=True)
+class If:
+    # Only the body of the first arm whose condition is true runs, or `orelse` when none is
+    loc: Loc
+    arms: List[Arm]
+    orelse: List["Stmt"]
+
+@dataclass(slots=True)
+class Import:
+    loc: Loc
+    module: "Module"
+    # Optimization level of the program importing the module, set by optimize_program()
+    level: int = 0
+
+Expr = Union[Const, Name, BinOp, FloatCast, Reduce, Call, Spawn, Join]
+Stmt = Union[Print, Def, Assign, Call, FuncDef, Return, While, If, Import]
+Program = List[Stmt]
+
+def program_functions(program: Program) -> Dict[str, "FuncDef"]:
+    # Functions can only be defined at the top level, a later definition replaces an earlier one
+    return { stmt.name: stmt for stmt in program if isinstance(stmt, FuncDef) }
+
+def visible_functions(program: Program) -> Dict[str, "FuncDef"]:
+    # Functions the program can call: its own and the ones of the modules it imports
+    functions = {}
+    for stmt in program:
+        if isinstance(stmt, Import):
+            functions.update(stmt.module.functions)
+    functions.update(program_functions(program))
+    return functions
+
+def program_modules(program: Program) -> List[Tuple["Module", int]]:
+    """
+    Modules imported by the program, directly or not, with their optimization level in the order they
+    run: a module runs once, before the modules and the program importing it.
+    """
+    modules = {}
+    def visit(program: Program):
+        for stmt in program:
+            if isinstance(stmt, Import) and stmt.module.path not in modules:
+                visit(stmt.module.optimized(stmt.level))
+                modules[stmt.module.path] = (stmt.module, stmt.level)
+    visit(program)
+    return list(modules.values())
+
+def link_program(program: Program) -> Program:
+    # Statements of the modules imported by the program followed by its own, for simulate() and the Transpiler
+    linked = []
+    for module, level in program_modules(program):
+        linked += module.optimized(level)
+    return linked + program
+
+@dataclass(slots=True)
+class TailCall:
+    """
+    Returned by simulate() for `return f ( args )`, call_function() then runs f in place of the
+    function returning it so tail calls do not grow the python stack.
+    """
+    call: Call
+    args: List[Any]
+
+MAX_DEPTH = 1_000_000
+# Python frames used by the parser for a level of nesting, and by simulate() for a plua call whose
+# body nests an `if` or a `while` and a few operators. Calls nesting more run out of python frames
+# before the maximum depth, call_function() reports it as the same error
+PYTHON_FRAMES_PER_LEVEL = 8
+
+def max_depth_error(max_depth: int, loc: Loc):
+    raise PluaError(loc, f"maximum call depth of {max_depth} exceeded", "the depth is set with --max-depth")
+
+def stack_depth() -> int:
+    frame = sys._getframe(1)
+    depth = 0
+    while frame is not None:
+        depth += 1
+        frame = frame.f_back
+    return depth
+
+@contextlib.contextmanager
+def recursion_limit(limit: int):
+    # Python functions calling python functions do not use the C stack since python 3.11, so the
+    # limit only bounds the memory of their frames. Code recursing in C, like copy.deepcopy() or
+    # compile(), overflows the C stack before reaching a raised limit and must not run under it
+    previous = sys.getrecursionlimit()
+    sys.setrecursionlimit(limit)
+    try:
+        yield
+    finally:
+        sys.setrecursionlimit(previous)
+
+MEMO_SIZE = 4096
+# Returned by Memo.lookup() for arguments without a result, None is the result of a function without `return`
+MEMO_MISS = object()
+
+class Memo:
+    """
+    Results of a pure function by arguments, the least recently used result is evicted
+    once `size` results are kept.
+    """
+    __slots__ = ("size", "results", "hits", "misses")
+
+    def __init__(self, size: int):
+        self.size = size
+        self.results = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key: tuple) -> Any:
+        value = self.results.get(key, MEMO_MISS)
+        if value is MEMO_MISS:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.results.move_to_end(key)
+        return value
+
+    def store(self, key: tuple, value: Any):
+        if self.size == 0: return
+        if key in self.results:
+            self.results.move_to_end(key)
+        elif len(self.results) >= self.size:
+            # Only a new result takes the place of the least recently used one
+            self.results.popitem(last=False)
+        self.results[key] = value
+
+def memo_key(args: Sequence[Any]) -> tuple:
+    # 1, 1.0 and True are equal in python but not in plua, and 0.0 and -0.0 print differently
+    return tuple(arg if type(arg) is int or type(arg) is str or type(arg) is Task else
+                 str(arg) if type(arg) is Rope else
+                 (Array, arg.typecode, arg.tobytes()) if type(arg) is Array else
+                 (type(arg), arg, math.copysign(1.0, arg)) for arg in args)
+
+def program_memos(functions: Dict[str, Union[FuncDef, "Code"]], size: int=MEMO_SIZE) -> Dict[str, Memo]:
+    return { name: Memo(size) for name, func in functions.items() if func.pure }
+
+def print_memo_stats(memos: Dict[str, Memo], file: TextIO):
+    print(f"{'function':<16} {'hits':>12} {'misses':>12} {'results':>8}", file=file)
+    for name, memo in memos.items():
+        print(f"{name:<16} {memo.hits:>12} {memo.misses:>12} {len(memo.results):>8}", file=file)
+
+class Context:
+    """
+    Globals of a program run by simulate(): its variables, its functions, the results of
+    its pure functions, the stream print writes to and the pool running its tasks.
+    """
+    __slots__ = ("variables", "functions", "memos", "output", "depth", "max_depth", "tasks")
+
+    def __init__(self, functions: Dict[str, FuncDef], output: TextIO, memos: Optional[Dict[str, Memo]]=None,
+                 max_depth: int=MAX_DEPTH, tasks: Optional["TaskPool"]=None):
+        self.variables = {}
+        self.functions = functions
+        self.memos = memos if memos is not None else program_memos(functions)
+        self.output = output
+        # Number of function calls in progress
+        self.depth = 0
+        self.max_depth = max_depth
+        self.tasks = tasks if tasks is not None else TaskPool(functions, max_depth=max_depth)
+
+class Frame:
+    """
+    State of one function call. The code it runs (a FuncDef for simulate(), a Code for the vm)
+    is shared by every call and never modified, so a call only allocates its frame.
+    """
+    __slots__ = ("code", "local_variables", "pc", "needs_value", "memo_key", "tail_loc")
+
+    def __init__(self, code: Union[FuncDef, "Code", None], local_variables: Optional[dict], needs_value: bool=False):
+        self.code = code
+        self.local_variables = local_variables
+        # Where the vm resumes once the function called from this frame returns
+        self.pc = 0
+        # The caller uses the returned value in an expression
+        self.needs_value = needs_value
+        # Arguments of a call to a pure function, the vm memoizes its result when it returns
+        self.memo_key = None
+        # Loc of the `return` that called this function in place of its caller, which then needed a value
+        self.tail_loc = None
+
+BINARY_FUNCTIONS = {
+        OpType.PLUS   : operator.add,
+        OpType.SUB    : operator.sub,
+        OpType.MUL    : operator.mul,
+        OpType.TRUEDIV: operator.truediv,
+        OpType.GT     : operator.gt,
+        OpType.LT     : operator.lt,
+        OpType.GE     : operator.ge,
+        OpType.LE     : operator.le,
+        OpType.EQUAL  : operator.eq
+    }
+
+
+# Python types each binary operator accepts, both arguments must have the same type
+BINARY_OPERAND_TYPES = {
+        OpType.PLUS   : (int, float, str),
+        OpType.SUB    : (int, float),
+        OpType.MUL    : (int, float),
+        OpType.TRUEDIV: (int, float),
+        OpType.GT     : (int, float),
+        OpType.LT     : (int, float),
+        OpType.GE     : (int, float),
+        OpType.LE     : (int, float),
+        OpType.EQUAL  : (int, float, str, bool)
+    }
+
+def binary_type_error(op: OpType, typ1: TokenType, typ2: TokenType, loc: Loc):
+    assert len(BINARY_FUNCTIONS) == 9, "Exhaustive handling of binary operators in binary_type_error()"
+    if typ1 != typ2:
+        if op == OpType.PLUS:
+            raise PluaError(loc, f"`+` operator can only add two arguments of the same type but found `{typ1}` and `{typ2}`")
+        elif op == OpType.MUL:
+            raise PluaError(loc, f"`*` operator can only multiply two arguments of the same type but found `{typ1}` and `{typ2}`")
+        elif op == OpType.TRUEDIV:
+            raise PluaError(loc, f"`/` operator can only divide two arguments of the same type but found `{typ1}` and `{typ2}`")
+        elif op == OpType.SUB:
+            raise PluaError(loc, f"`-` operator can only substract two arguments of the same type but found `{typ1}` and `{typ2}`")
+        else:
+            sign = [sign for sign, typ in KEYWORDS_BY_NAME.items() if typ == op][0]
+            raise PluaError(loc, f"`{sign}` operator can only return a boolean value if the arguments have the same type but found:  `{typ1}` and `{typ2}`")
+    else:
+        if op == OpType.PLUS:
+            raise PluaError(loc, "`+` operator can only add strings or numbers.")
+        elif op == OpType.MUL:
+            raise PluaError(loc, f"`*` operator can only multiply numbers but found type: `{typ1}`")
+        elif op == OpType.TRUEDIV:
+            raise PluaError(loc, f"`/` operator can only divide numbers but found type: `{typ1}`")
+        elif op == OpType.SUB:
+            raise PluaError(loc, f"`-` operator can only substract numbers but found type: `{typ1}`")
+        else:
+            sign = [sign for sign, typ in KEYWORDS_BY_NAME.items() if typ == op][0]
+            raise PluaError(loc, f"`{sign}` operator can only checks for numbers but found type: `{typ1}`")
+
+def binary_op_error(op: OpType, arg1: Any, arg2: Any, loc: Loc):
+    if type(arg1) is not type(arg2) or type(arg1) not in BINARY_OPERAND_TYPES[op]:
+        binary_type_error(op, VALUE_TYPES[type(arg1)], VALUE_TYPES[type(arg2)], loc)
+    elif op == OpType.TRUEDIV and arg2 == 0:
+        raise PluaError(loc, "`/` operator cannot divide by 0")
+    else:
+        assert False, "binary_op_error() called on valid arguments"
+
+def array_op(op: OpType, arg1: Any, arg2: Any, loc: Loc) -> Array:
+    """
+    Applies the operator element by element when an argument is an array, the other argument is an
+    array of the same length or a single value, with the same type of elements. The loop over the
+    elements runs in C. Other arguments are the errors of binary_op_error().
+    """
+    if type(arg1) is not Array and type(arg2) is not Array:
+        binary_op_error(op, arg1, arg2, loc)
+    sign = [sign for sign, typ in KEYWORDS_BY_NAME.items() if typ == op][0]
+    typ1 = ARRAY_ELEMENT_TYPES[arg1.typecode] if type(arg1) is Array else type(arg1)
+    typ2 = ARRAY_ELEMENT_TYPES[arg2.typecode] if type(arg2) is Array else type(arg2)
+    if typ1 is not typ2:
+        raise PluaError(loc, f"`{sign}` operator can only apply to elements of the same type but found `{VALUE_TYPES[typ1]}` and `{VALUE_TYPES[typ2]}`")
+    if typ1 not in BINARY_OPERAND_TYPES[op]:
+        raise PluaError(loc, f"`{sign}` operator cannot apply to elements of type `{VALUE_TYPES[typ1]}`")
+    if type(arg1) is Array and type(arg2) is Array and len(arg1) != len(arg2):
+        raise PluaError(loc, f"`{sign}` operator needs arrays of the same length but found {len(arg1)} and {len(arg2)}")
+    if op == OpType.TRUEDIV and (0 in arg2 if type(arg2) is Array else arg2 == 0):
+        raise PluaError(loc, "`/` operator cannot divide by 0")
+
+    function = BINARY_FUNCTIONS[op]
+    if type(arg2) is not Array:
+        values = map(function, arg1, itertools.repeat(arg2))
+    elif type(arg1) is not Array:
+        values = map(function, itertools.repeat(arg1), arg2)
+    else:
+        values = map(function, arg1, arg2)
+    if op in (OpType.PLUS, OpType.SUB, OpType.MUL):
+        typecode = arg1.typecode if type(arg1) is Array else arg2.typecode
+    else:
+        typecode = 'd' if op == OpType.TRUEDIV else 'b'
+    try:
+        return Array(typecode, values)
+    except OverflowError:
+        raise PluaError(loc, f"`{sign}` operator gives an element out of the range of 64 bit integers") from None
+
+def rope_op(op: OpType, arg1: Any, arg2: Any, loc: Loc) -> Any:
+    if VALUE_TYPES[type(arg1)] == TokenType.STR and VALUE_TYPES[type(arg2)] == TokenType.STR:
+        if op == OpType.PLUS:
+            return concat(arg1, arg2)
+        elif op == OpType.EQUAL:
+            return str(arg1) == str(arg2)
+    return array_op(op, arg1, arg2, loc)
+
+def binary_op(op: OpType, arg1: Any, arg2: Any, loc: Loc) -> Any:
+    """
+    Applies the operator on arguments of any type, this is also the slow path of the engines
+    for the arguments their inline checks do not handle: ropes, arrays and the type errors.
+    """
+    if type(arg1) is not type(arg2) or type(arg1) not in BINARY_OPERAND_TYPES[op] or (op == OpType.TRUEDIV and arg2 == 0):
+        if type(arg1) is Rope or type(arg2) is Rope:
+            return rope_op(op, arg1, arg2, loc)
+        return array_op(op, arg1, arg2, loc)
+    if op == OpType.PLUS and type(arg1) is str:
+        return concat(arg1, arg2)
+    try:
+        return BINARY_FUNCTIONS[op](arg1, arg2)
+    except OverflowError:
+        # Only the division of ints too large for a float
+        raise PluaError(loc, "`/` operator gives a result out of the range of floats") from None
+
+# Functions of the operators whose operand types are proven by the type checker
+TYPED_FUNCTIONS = { (op, VALUE_TYPES[value_type]): BINARY_FUNCTIONS[op] for op, value_types in BINARY_OPERAND_TYPES.items() for value_type in value_types }
+TYPED_FUNCTIONS[OpType.PLUS, TokenType.STR] = concat
+# Key of each typed function, to store them in the cache
+TYPED_FUNCTION_KEYS = { function: key for key, function in TYPED_FUNCTIONS.items() }
+
+def float_cast(value: Any, loc: Loc) -> Union[float, Array]:
+    if type(value) is Array and value.typecode == 'q':
+        return Array('d', value)
+    if type(value) is not int:
+        float_cast_error(VALUE_TYPES[type(value)], loc)
+    try:
+        return float(value)
+    except OverflowError:
+        raise PluaError(loc, "int is out of the range of floats") from None
+
+def float_cast_error(typ: TokenType, loc: Loc):
+    raise PluaError(loc, f"expected an integer but found:  {typ}")
+
+REDUCE_FUNCTIONS = {
+        OpType.SUM: sum,
+        OpType.MIN: min,
+        OpType.MAX: max
+    }
+
+def reduce_error(op: OpType, typ: str, loc: Loc):
+    raise PluaError(loc, f"`{op.name.lower()}` expects an array of numbers but found type: `{typ}`")
+
+def reduce_array(op: OpType, value: Any, loc: Loc) -> Union[int, float]:
+    if type(value) is not Array or value.typecode == 'b':
+        reduce_error(op, f"array of {VALUE_TYPES[bool]}" if type(value) is Array else str(VALUE_TYPES[type(value)]), loc)
+    # Arrays always have elements, literals cannot be empty and operators keep the length
+    return REDUCE_FUNCTIONS[op](value)
+
+def spawn_error(name: str, loc: Loc):
+    raise PluaError(loc, f"`spawn` can only run a pure function but `{name}` is not pure",
+                    "the function runs in another process where it can only use its arguments")
+
+def join_error(typ: TokenType, loc: Loc):
+    raise PluaError(loc, f"`join` expects a task but found type: `{typ}`")
+
+def join_task(value: Any, loc: Loc) -> Any:
+    # Errors of the function are raised again here, with their loc in the function
+    if type(value) is not Task:
+        join_error(VALUE_TYPES[type(value)], loc)
+    try:
+        return value.future.result()
+    except concurrent.futures.BrokenExecutor:
+        raise PluaError(loc, f"the process running `{value.name}` stopped") from None
+
+def condition_error(keyword: str, value: Any, loc: Loc):
+    condition_type_error(keyword, VALUE_TYPES[type(value)], loc)
+
+def condition_type_error(keyword: str, typ: TokenType, loc: Loc):
+    raise PluaError(loc, f"`{keyword}` condition must be a boolean but found type: `{typ}`")
+
+def print_value(value: Any, output: TextIO):
+    # String escapes are decoded by the lexer
+    output.write(f"{value}\n")
+
+OUTPUT_BUFFER_SIZE = 1 << 16
+BUFFERINGS = ["line", "block"]
+
+def open_output(buffering: str) -> TextIO:
+    """
+    Writer on the file descriptor of stdout with a large buffer. Line buffering flushes
+    after every print, block buffering only once the buffer is full and at exit.
+    """
+    try:
+        fileno = sys.stdout.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        # stdout is not a file, like the stream of a request to `serve`, it is already buffered
+        return sys.stdout
+    stream = io.FileIO(fileno, "w", closefd=False)
+    return io.TextIOWrapper(io.BufferedWriter(stream, OUTPUT_BUFFER_SIZE), encoding=sys.stdout.encoding,
+                            errors=sys.stdout.errors, line_buffering=buffering == "line")
+
+def call_function(call: Call, frame: Frame, context: Context, needs_value: bool) -> Any:
+    func = context.functions[call.name]
+    args = [evaluate(arg, frame, context) for arg in call.args]
+    if context.depth >= context.max_depth:
+        max_depth_error(context.max_depth, call.loc)
+    context.depth += 1
+    try:
+        if func.pure:
+            memo = context.memos[call.name]
+            key = memo_key(args)
+            value = memo.lookup(key)
+            if value is MEMO_MISS:
+                value = simulate(func.body, context, Frame(func, dict(zip(func.params, args)), needs_value))
+                memo.store(key, value)
+        else:
+            value = simulate(func.body, context, Frame(func, dict(zip(func.params, args)), needs_value))
+            while type(value) is TailCall:
+                # A function called by a `return` must give back a value, whatever its caller needs
+                call = value.call
+                func = context.functions[call.name]
+                needs_value = True
+                value = simulate(func.body, context, Frame(func, dict(zip(func.params, value.args)), needs_value))
+    except RecursionError:
+        # The calls in progress use more python frames than PYTHON_FRAMES_PER_LEVEL
+        max_depth_error(context.max_depth, call.loc)
+    finally:
+        # Also on an error, the context can be used again after it
+        context.depth -= 1
+    if needs_value and value is None:
+        raise PluaError(call.loc, f"function `{call.name}` did not return a value")
+    return value
+
+def evaluate(expr: Expr, frame: Frame, context: Context) -> Any:
+    if isinstance(expr, Const):
+        return expr.value
+    elif isinstance(expr, Name):
+        if frame.local_variables is not None and expr.name in frame.local_variables:
+            return frame.local_variables[expr.name]
+        elif expr.name in context.variables:
+            return context.variables[expr.name]
+        raise PluaError(expr.loc, f"variable `{expr.name}` is used before its definition")
+    elif isinstance(expr, BinOp):
+        lhs = evaluate(expr.lhs, frame, context)
+        rhs = evaluate(expr.rhs, frame, context)
+        if expr.typ is not None and (expr.op is not OpType.TRUEDIV or rhs != 0):
+            try:
+                return TYPED_FUNCTIONS[expr.op, expr.typ](lhs, rhs)
+            except OverflowError:
+                # Ints too large to divide as floats, binary_op() reports it
+                pass
+        return binary_op(expr.op, lhs, rhs, expr.loc)
+    elif isinstance(expr, FloatCast):
+        return float_cast(evaluate(expr.value, frame, context), expr.loc)
+    elif isinstance(expr, Reduce):
+        return reduce_array(expr.op, evaluate(expr.value, frame, context), expr.loc)
+    elif isinstance(expr, Call):
+        return call_function(expr, frame, context, True)
+    elif isinstance(expr, Spawn):
+        return context.tasks.spawn(expr.call.name, [evaluate(arg, frame, context) for arg in expr.call.args], expr.loc)
+    elif isinstance(expr, Join):
+        return join_task(evaluate(expr.value, frame, context), expr.loc)
+    assert False, f"Unreachable expression in evaluate(): {expr}"
+
+# Returns the value of the `return` statement that stopped the program, None if it ran until its end
+def simulate(program: Program, context: Context, frame: Optional[Frame]=None) -> Any:
+    if frame is None:
+        frame = Frame(None, None)
+    for stmt in program:
+        if isinstance(stmt, Print):
+            print_value(evaluate(stmt.value, frame, context), context.output)
+        elif isinstance(stmt, Def):
+            value = evaluate(stmt.value, frame, context)
+            if VALUE_TYPES[type(value)] != stmt.typ:
+                raise PluaError(stmt.loc, "mismatched type definition and type of value.")
+            context.variables[stmt.name] = value
+        elif isinstance(stmt, Assign):
+            value = evaluate(stmt.value, frame, context)
+            if frame.local_variables is not None and stmt.name in frame.local_variables:
+                scope = frame.local_variables
+            elif stmt.name in context.variables:
+                scope = context.variables
             else:
-                print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: unknown word: `{token.value}`")
-                exit(1)
-        elif token.typ in TokenType:
-            ip += 1 
-
-    if len(program) != 0:
-        if in_parens: 
-            if track_usage: return program, used
-            return program
-        if was_arg:
-            if len(program) == 1: 
-                if track_usage: return program[0], used
-                return program[0]
-            if track_usage: return program, used
-            return program
-        token = program.pop()
-        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: unhandled argument in program: `{token.value}` with type: `{token.typ}`")
-        exit(1)
+                raise PluaError(stmt.loc, f"variable `{stmt.name}` is used before its definition")
+            if type(value) is not type(scope[stmt.name]) and not same_type(value, scope[stmt.name]):
+                raise PluaError(stmt.loc, "variable reassignation cannot change variable type.")
+            scope[stmt.name] = value
+        elif isinstance(stmt, Call):
+            call_function(stmt, frame, context, False)
+        elif isinstance(stmt, Return):
+            call = stmt.value
+            if isinstance(call, Call) and not context.functions[call.name].pure:
+                return TailCall(call, [evaluate(arg, frame, context) for arg in call.args])
+            return evaluate(stmt.value, frame, context)
+        elif isinstance(stmt, While):
+            while True:
+                condition = evaluate(stmt.condition, frame, context)
+                if condition is False: break
+                if condition is not True:
+                    condition_error("while", condition, stmt.loc)
+                # The body is the same list of statements on every iteration, a `return` in it stops the loop
+                value = simulate(stmt.body, context, frame)
+                if value is not None:
+                    return value
+        elif isinstance(stmt, If):
+            body = stmt.orelse
+            for arm in stmt.arms:
+                condition = evaluate(arm.condition, frame, context)
+                if condition is True:
+                    body = arm.body
+                    break
+                if condition is not False:
+                    condition_error("if", condition, arm.loc)
+            value = simulate(body, context, frame)
+            if value is not None:
+                return value
+        elif isinstance(stmt, FuncDef):
+            # Functions are in the context from the start
+            pass
+        elif isinstance(stmt, Import):
+            # The statements of the module run before, see link_program()
+            pass
+        else:
+            assert False, f"Unreachable statement in simulate(): {stmt}"
+    return None
+
+class OpCode(Enum):
+    LOAD_CONST=auto()
+    LOAD_FAST=auto()
+    STORE_FAST=auto()
+    LOAD_GLOBAL=auto()
+    STORE_GLOBAL=auto()
+    DEF_GLOBAL=auto()
+    BINARY_ADD=auto()
+    BINARY_SUB=auto()
+    BINARY_MUL=auto()
+    BINARY_TRUEDIV=auto()
+    COMPARE_GT=auto()
+    COMPARE_LT=auto()
+    COMPARE_GE=auto()
+    COMPARE_LE=auto()
+    COMPARE_EQ=auto()
+    # Operator whose operand types are proven by the type checker, arg is its python function
+    BINARY_TYPED=auto()
+    CAST_FLOAT=auto()
+    # arg is the OpType of the reduction
+    REDUCE=auto()
+    PRINT=auto()
+    CALL=auto()
+    # CALL of a pure function, runs it only when its memo has no result for the arguments
+    CALL_PURE=auto()
+    # CALL from a `return`, the callee takes the frame of the function returning its value
+    TAIL_CALL=auto()
+    RETURN=auto()
+    RETURN_VALUE=auto()
+    # arg is the pc of the next instruction to run
+    JUMP=auto()
+    # Pops a boolean and jumps to arg when it is true
+    POP_JUMP_IF_TRUE=auto()
+    # Pops a boolean and jumps to arg when it is false
+    POP_JUMP_IF_FALSE=auto()
+    # arg is the name of the function and its number of arguments, pushes the task running the call
+    SPAWN=auto()
+    # Replaces the task on top of the stack by its result
+    JOIN=auto()
+    # Only found in programs instrumented by profile_program(), arg is the opcode that follows
+    PROFILE=auto()
+
+Instruction = Tuple[OpCode, Any]
+
+@dataclass(frozen=True)
+class Code:
+    name: str
+    # Arguments are the local variables, LOAD_FAST n reads params[n]
+    params: Tuple[str, ...]
+    # Both tuples have the same length, locs[pc] is the loc of instructions[pc]
+    instructions: Tuple[Instruction, ...]
+    locs: Sequence[Loc]
+    pure: bool = False
+
+@dataclass(frozen=True)
+class CompiledProgram:
+    main: Code
+    functions: Dict[str, Code]
+    # LOAD_GLOBAL n reads the variable global_names[n]
+    global_names: Tuple[str, ...]
+    # Modules imported by the program, directly or not, by absolute path in the order they run
+    modules: Dict[str, "CompiledProgram"] = field(default_factory=dict)
+
+BINARY_OPCODES = {
+        OpType.PLUS   : OpCode.BINARY_ADD,
+        OpType.SUB    : OpCode.BINARY_SUB,
+        OpType.MUL    : OpCode.BINARY_MUL,
+        OpType.TRUEDIV: OpCode.BINARY_TRUEDIV,
+        OpType.GT     : OpCode.COMPARE_GT,
+        OpType.LT     : OpCode.COMPARE_LT,
+        OpType.GE     : OpCode.COMPARE_GE,
+        OpType.LE     : OpCode.COMPARE_LE,
+        OpType.EQUAL  : OpCode.COMPARE_EQ
+    }
 
-# Implement the brackets
-def find_last_separator(program: Program) -> int:
-    if len(program) == 0:
-        print("ERROR: find_last_separator had an empty list")
-        exit(1)
-    if program[0].typ == TokenType.RPAREN: return 0
-    if program[0].typ != TokenType.LPAREN:
-        print("ERROR: first argument in find_last_separator need to be a separator")
-        exit(1)
-    needed = 1
-    ip = 1
-    for op in program[1:]:
-        if op.typ == TokenType.LPAREN: needed += 1
-        elif op.typ == TokenType.RPAREN:
-            needed -= 1
-            if needed == 0:
-                return ip + 1 
-        ip += 1
-    # Find a way to get token's loc
-    print(f"ERROR: parentheses not closed, missing: {needed} parentheses")
-    exit(1)
-
-
-# Token can pass solo as args
-def calculate_length_ops(ops: Program) -> int:
-    if isinstance(ops, Parens): return len(ops)
-    elif isinstance(ops, Token): return 1
-    elif isinstance(ops, Op): return 1
-    length = 0
-    ip = 0
-    op = None
-    while ip < len(ops):
-        if op and isinstance(op, Parens): 
-            length += len(Parens)
-            ip += 1
-        op = ops[ip]
-        if op.typ == OpType.PRINT: 
-            length += calculate_length_ops(op.value) + 1
-            ip += 1
-        elif op.typ in TokenTypes or op.value in KEYWORDS or op.value in KEYWORDS_SIGNS or op.value in SEPARATORS: 
-            ip += 1
-            length += 1
-    return length
-
-def parse_token_as_op(tokens: List[Token], func: bool=False) -> Program:
-    ip = 0
-    end_tokens = []
-    for op in range(len(tokens)):
-        if len(tokens) == 0: return end_tokens
-        if ip > len(tokens) - 1: return end_tokens
-        token = tokens[ip]
-        for separator in SEPARATORS:
-            if token.value == separator:
-                loc = token.loc
-                closing_index = find_last_separator(tokens[ip:])
-                value = parse_token_as_op(tokens[ip+1:ip+closing_index])
-                if len(value) == 0: 
-                    ip += 1
+class CodeBuilder:
+    def __init__(self, name: str, global_slots: Dict[str, int], functions: Dict[str, FuncDef], params: Tuple[str, ...]=(), pure: bool=False):
+        self.name = name
+        self.params = params
+        self.pure = pure
+        self.global_slots = global_slots
+        self.functions = functions
+        self.local_slots = { param: slot for slot, param in enumerate(params) }
+        self.instructions = []
+        self.locs = []
+
+    def emit(self, opcode: OpCode, arg: Any, loc: Loc):
+        self.instructions.append((opcode, arg))
+        self.locs.append(loc)
+
+    def build(self) -> Code:
+        self.emit(OpCode.RETURN, None, self.locs[-1] if self.locs else (self.name, 0, 0))
+        return Code(self.name, self.params, tuple(self.instructions), tuple(self.locs), self.pure)
+
+    def emit_call(self, call: Call, needs_value: bool):
+        opcode = OpCode.CALL_PURE if self.functions[call.name].pure else OpCode.CALL
+        self.emit(opcode, (call.name, len(call.args), needs_value), call.loc)
+
+def compile_expression(expr: Expr, builder: CodeBuilder):
+    if isinstance(expr, Const):
+        builder.emit(OpCode.LOAD_CONST, expr.value, expr.loc)
+    elif isinstance(expr, Name):
+        if expr.name in builder.local_slots:
+            builder.emit(OpCode.LOAD_FAST, builder.local_slots[expr.name], expr.loc)
+        else:
+            builder.emit(OpCode.LOAD_GLOBAL, builder.global_slots[expr.name], expr.loc)
+    elif isinstance(expr, BinOp):
+        compile_expression(expr.lhs, builder)
+        compile_expression(expr.rhs, builder)
+        if expr.typ is not None:
+            builder.emit(OpCode.BINARY_TYPED, TYPED_FUNCTIONS[expr.op, expr.typ], expr.loc)
+        else:
+            builder.emit(BINARY_OPCODES[expr.op], None, expr.loc)
+    elif isinstance(expr, FloatCast):
+        compile_expression(expr.value, builder)
+        builder.emit(OpCode.CAST_FLOAT, None, expr.loc)
+    elif isinstance(expr, Reduce):
+        compile_expression(expr.value, builder)
+        builder.emit(OpCode.REDUCE, expr.op, expr.loc)
+    elif isinstance(expr, Call):
+        for arg in expr.args:
+            compile_expression(arg, builder)
+        builder.emit_call(expr, True)
+    elif isinstance(expr, Spawn):
+        for arg in expr.call.args:
+            compile_expression(arg, builder)
+        builder.emit(OpCode.SPAWN, (expr.call.name, len(expr.call.args)), expr.loc)
+    elif isinstance(expr, Join):
+        compile_expression(expr.value, builder)
+        builder.emit(OpCode.JOIN, None, expr.loc)
+    else:
+        assert False, f"Unreachable expression in compile_expression(): {expr}"
+
+def compile_block(program: Program, builder: CodeBuilder) -> CodeBuilder:
+    for stmt in program:
+        if isinstance(stmt, Print):
+            compile_expression(stmt.value, builder)
+            builder.emit(OpCode.PRINT, None, stmt.loc)
+        elif isinstance(stmt, Def):
+            compile_expression(stmt.value, builder)
+            builder.emit(OpCode.DEF_GLOBAL, (builder.global_slots[stmt.name], stmt.typ), stmt.loc)
+        elif isinstance(stmt, Assign):
+            compile_expression(stmt.value, builder)
+            if stmt.name in builder.local_slots:
+                builder.emit(OpCode.STORE_FAST, builder.local_slots[stmt.name], stmt.loc)
+            else:
+                builder.emit(OpCode.STORE_GLOBAL, builder.global_slots[stmt.name], stmt.loc)
+        elif isinstance(stmt, Call):
+            for arg in stmt.args:
+                compile_expression(arg, builder)
+            builder.emit_call(stmt, False)
+        elif isinstance(stmt, Return):
+            call = stmt.value
+            if isinstance(call, Call) and not builder.functions[call.name].pure:
+                # Pure functions keep their frame until their result is memoized
+                for arg in call.args:
+                    compile_expression(arg, builder)
+                builder.emit(OpCode.TAIL_CALL, (call.name, len(call.args)), call.loc)
+            else:
+                compile_expression(stmt.value, builder)
+                builder.emit(OpCode.RETURN_VALUE, None, stmt.loc)
+        elif isinstance(stmt, While):
+            # The condition is compiled after the body so an iteration only runs one jump
+            jump = len(builder.instructions)
+            builder.emit(OpCode.JUMP, None, stmt.loc)
+            body = len(builder.instructions)
+            compile_block(stmt.body, builder)
+            builder.instructions[jump] = (OpCode.JUMP, len(builder.instructions))
+            compile_expression(stmt.condition, builder)
+            builder.emit(OpCode.POP_JUMP_IF_TRUE, body, stmt.loc)
+        elif isinstance(stmt, If):
+            # Every arm jumps to the end once its body ran, a false condition jumps to the next arm
+            jumps = []
+            for arm in stmt.arms:
+                compile_expression(arm.condition, builder)
+                branch = len(builder.instructions)
+                builder.emit(OpCode.POP_JUMP_IF_FALSE, None, arm.loc)
+                compile_block(arm.body, builder)
+                if arm is not stmt.arms[-1] or stmt.orelse:
+                    jumps.append(len(builder.instructions))
+                    builder.emit(OpCode.JUMP, None, arm.loc)
+                builder.instructions[branch] = (OpCode.POP_JUMP_IF_FALSE, len(builder.instructions))
+            compile_block(stmt.orelse, builder)
+            for jump in jumps:
+                builder.instructions[jump] = (OpCode.JUMP, len(builder.instructions))
+        elif isinstance(stmt, FuncDef):
+            # Compiled on their own by compile_program()
+            pass
+        elif isinstance(stmt, Import):
+            # The main of the module runs before, see link_modules()
+            pass
+        else:
+            assert False, f"Unreachable statement in compile_block(): {stmt}"
+    return builder
+
+def compile_program(program: Program, name: str="<main>") -> CompiledProgram:
+    # The program comes from optimize_program(), which checked its types as written
+    global_slots = resolve_names(program, check_types=False)
+    funcs = visible_functions(program)
+    functions = {}
+    for func_name, func in program_functions(program).items():
+        functions[func_name] = compile_block(func.body, CodeBuilder(func_name, global_slots, funcs, tuple(func.params), func.pure)).build()
+    main = compile_block(program, CodeBuilder(name, global_slots, funcs)).build()
+    # Compiled once for every program importing them, they are linked to the program when it runs
+    modules = { module.path: module.compile(level) for module, level in program_modules(program) }
+    return CompiledProgram(main, functions, tuple(global_slots), modules)
+
+def relocate(code: Code, base: int) -> Code:
+    # Copy of the code of a module whose globals start at the slot `base` of the program running it
+    instructions = []
+    for op, arg in code.instructions:
+        if op is OpCode.LOAD_GLOBAL or op is OpCode.STORE_GLOBAL:
+            arg += base
+        elif op is OpCode.DEF_GLOBAL:
+            arg = (arg[0] + base, arg[1])
+        instructions.append((op, arg))
+    return Code(code.name, code.params, tuple(instructions), code.locs, code.pure)
+
+class LinkedFunctions(dict):
+    """
+    Functions of a program importing modules. The function of a module is relocated the first time
+    it is called, so the functions of a large module that are never called cost nothing.
+    """
+    def __init__(self, functions: Dict[str, Code], modules: Dict[str, Tuple[CompiledProgram, int]]):
+        super().__init__(functions)
+        # Module and slot of its first global, by name of module
+        self.modules = modules
+
+    def __missing__(self, name: str) -> Code:
+        module, base = self.modules[name.partition(".")[0]]
+        code = self[name] = relocate(module.functions[name], base)
+        return code
+
+def link_modules(program: CompiledProgram) -> Tuple[List[Code], Dict[str, Code], Tuple[str, ...]]:
+    """
+    Gives the globals of the modules of the program the slots after its own. Returns the mains to run,
+    the modules' in order then the program's, the functions and the names of every global.
+    """
+    if not program.modules:
+        return [program.main], program.functions, program.global_names
+    mains = []
+    modules = {}
+    global_names = program.global_names
+    for path, module in program.modules.items():
+        base = len(global_names)
+        modules[module_name(path)] = (module, base)
+        mains.append(relocate(module.main, base))
+        global_names += module.global_names
+    mains.append(program.main)
+    return mains, LinkedFunctions(program.functions, modules), global_names
+
+def compiled_functions(program: CompiledProgram) -> Mapping[str, Code]:
+    # Functions of the program and of its modules, as compiled. The functions of a module loaded
+    # from the cache are only decoded when they are looked up
+    return collections.ChainMap(program.functions, *(module.functions for module in reversed(program.modules.values())))
+
+def compiled_memos(program: CompiledProgram, size: int=MEMO_SIZE) -> Dict[str, Memo]:
+    # Memos of the pure functions of the program and of its modules, like program_memos(compiled_functions())
+    memos = {}
+    for compiled in (*program.modules.values(), program):
+        if isinstance(compiled.functions, CachedFunctions):
+            memos.update((name, Memo(size)) for name in compiled.functions.pure)
+        else:
+            memos.update(program_memos(compiled.functions, size))
+    return memos
+
+def execute(program: CompiledProgram, output: TextIO, profiler: Optional["Profiler"]=None,
+            memos: Optional[Dict[str, Memo]]=None, max_depth: int=MAX_DEPTH, tasks: Optional["TaskPool"]=None) -> List[Any]:
+    """
+    Runs the program and gives back the value of its globals, None for the ones never defined,
+    followed by the globals of its modules. A main returning a value, the call run by a task, gives it last.
+    Calls push a Frame on a list instead of the python stack, so the depth is only bounded by `max_depth`.
+    """
+    assert len(OpCode) == 30, "Exhaustive handling of opcodes in execute()"
+    # Aliases so the dispatch loop only compares locals
+    LOAD_CONST     = OpCode.LOAD_CONST
+    LOAD_FAST      = OpCode.LOAD_FAST
+    STORE_FAST     = OpCode.STORE_FAST
+    LOAD_GLOBAL    = OpCode.LOAD_GLOBAL
+    STORE_GLOBAL   = OpCode.STORE_GLOBAL
+    DEF_GLOBAL     = OpCode.DEF_GLOBAL
+    BINARY_ADD     = OpCode.BINARY_ADD
+    BINARY_SUB     = OpCode.BINARY_SUB
+    BINARY_MUL     = OpCode.BINARY_MUL
+    BINARY_TRUEDIV = OpCode.BINARY_TRUEDIV
+    COMPARE_GT     = OpCode.COMPARE_GT
+    COMPARE_LT     = OpCode.COMPARE_LT
+    COMPARE_GE     = OpCode.COMPARE_GE
+    COMPARE_LE     = OpCode.COMPARE_LE
+    COMPARE_EQ     = OpCode.COMPARE_EQ
+    BINARY_TYPED   = OpCode.BINARY_TYPED
+    CAST_FLOAT     = OpCode.CAST_FLOAT
+    REDUCE         = OpCode.REDUCE
+    PRINT          = OpCode.PRINT
+    CALL           = OpCode.CALL
+    CALL_PURE      = OpCode.CALL_PURE
+    TAIL_CALL      = OpCode.TAIL_CALL
+    RETURN         = OpCode.RETURN
+    RETURN_VALUE   = OpCode.RETURN_VALUE
+    JUMP           = OpCode.JUMP
+    POP_JUMP_IF_TRUE = OpCode.POP_JUMP_IF_TRUE
+    POP_JUMP_IF_FALSE = OpCode.POP_JUMP_IF_FALSE
+    SPAWN          = OpCode.SPAWN
+    JOIN           = OpCode.JOIN
+    PROFILE        = OpCode.PROFILE
+
+    ARRAY = Array
+    TASK = Task
+
+    mains, functions, global_names = link_modules(program)
+    if memos is None:
+        memos = compiled_memos(program)
+    if tasks is None:
+        tasks = TaskPool(compiled_functions(program), max_depth=max_depth)
+    write = output.write
+    # None until the `def` of the variable is executed
+    variables = [None] * len(global_names)
+    # Frames of the callers, the current frame lives in the locals below. The mains of the
+    # modules are waiting frames, each one returns to the next and the program's ends the run
+    frames = [Frame(code, None) for code in reversed(mains)]
+    frame = frames.pop()
+    stack = []
+    instructions = frame.code.instructions
+    locs = frame.code.locs
+    local_variables = None
+    pc = 0
+    while True:
+        op, arg = instructions[pc]
+        pc += 1
+        if op is LOAD_GLOBAL:
+            value = variables[arg]
+            if value is None:
+                raise PluaError(locs[pc-1], f"variable `{global_names[arg]}` is used before its definition")
+            stack.append(value)
+        elif op is LOAD_FAST:
+            stack.append(local_variables[arg])
+        elif op is LOAD_CONST:
+            stack.append(arg)
+        elif op is BINARY_TYPED:
+            b = stack.pop()
+            try:
+                stack[-1] = arg(stack[-1], b)
+            except ZeroDivisionError:
+                binary_op_error(OpType.TRUEDIV, stack[-1], b, locs[pc-1])
+            except OverflowError:
+                binary_op(OpType.TRUEDIV, stack[-1], b, locs[pc-1])
+        elif op is BINARY_ADD:
+            b = stack.pop()
+            a = stack[-1]
+            if type(a) is not type(b) or (type(a) is not int and type(a) is not float):
+                stack[-1] = binary_op(OpType.PLUS, a, b, locs[pc-1])
+            else:
+                stack[-1] = a + b
+        elif op is BINARY_SUB:
+            b = stack.pop()
+            a = stack[-1]
+            if type(a) is not type(b) or (type(a) is not int and type(a) is not float):
+                stack[-1] = array_op(OpType.SUB, a, b, locs[pc-1])
+            else:
+                stack[-1] = a - b
+        elif op is BINARY_MUL:
+            b = stack.pop()
+            a = stack[-1]
+            if type(a) is not type(b) or (type(a) is not int and type(a) is not float):
+                stack[-1] = array_op(OpType.MUL, a, b, locs[pc-1])
+            else:
+                stack[-1] = a * b
+        elif op is BINARY_TRUEDIV:
+            b = stack.pop()
+            a = stack[-1]
+            if type(a) is not type(b) or (type(a) is not int and type(a) is not float) or b == 0:
+                stack[-1] = array_op(OpType.TRUEDIV, a, b, locs[pc-1])
+            else:
+                try:
+                    stack[-1] = a / b
+                except OverflowError:
+                    stack[-1] = binary_op(OpType.TRUEDIV, a, b, locs[pc-1])
+        elif op is COMPARE_GT:
+            b = stack.pop()
+            a = stack[-1]
+            if type(a) is not type(b) or (type(a) is not int and type(a) is not float):
+                stack[-1] = array_op(OpType.GT, a, b, locs[pc-1])
+            else:
+                stack[-1] = a > b
+        elif op is COMPARE_LT:
+            b = stack.pop()
+            a = stack[-1]
+            if type(a) is not type(b) or (type(a) is not int and type(a) is not float):
+                stack[-1] = array_op(OpType.LT, a, b, locs[pc-1])
+            else:
+                stack[-1] = a < b
+        elif op is COMPARE_GE:
+            b = stack.pop()
+            a = stack[-1]
+            if type(a) is not type(b) or (type(a) is not int and type(a) is not float):
+                stack[-1] = array_op(OpType.GE, a, b, locs[pc-1])
+            else:
+                stack[-1] = a >= b
+        elif op is COMPARE_LE:
+            b = stack.pop()
+            a = stack[-1]
+            if type(a) is not type(b) or (type(a) is not int and type(a) is not float):
+                stack[-1] = array_op(OpType.LE, a, b, locs[pc-1])
+            else:
+                stack[-1] = a <= b
+        elif op is COMPARE_EQ:
+            b = stack.pop()
+            a = stack[-1]
+            if type(a) is not type(b) or type(a) is ARRAY or type(a) is Rope or type(a) is TASK:
+                stack[-1] = binary_op(OpType.EQUAL, a, b, locs[pc-1])
+            else:
+                stack[-1] = a == b
+        elif op is POP_JUMP_IF_TRUE:
+            value = stack.pop()
+            if value is True:
+                pc = arg
+            elif value is not False:
+                condition_error("while", value, locs[pc-1])
+        elif op is POP_JUMP_IF_FALSE:
+            value = stack.pop()
+            if value is False:
+                pc = arg
+            elif value is not True:
+                condition_error("if", value, locs[pc-1])
+        elif op is JUMP:
+            pc = arg
+        elif op is PRINT:
+            write(f"{stack.pop()}\n")
+        elif op is CAST_FLOAT:
+            stack[-1] = float_cast(stack[-1], locs[pc-1])
+        elif op is REDUCE:
+            stack[-1] = reduce_array(arg, stack[-1], locs[pc-1])
+        elif op is DEF_GLOBAL:
+            slot, typ = arg
+            value = stack.pop()
+            if VALUE_TYPES[type(value)] != typ:
+                raise PluaError(locs[pc-1], "mismatched type definition and type of value.")
+            variables[slot] = value
+        elif op is STORE_GLOBAL:
+            value = stack.pop()
+            if variables[arg] is None:
+                raise PluaError(locs[pc-1], f"variable `{global_names[arg]}` is used before its definition")
+            if type(value) is not type(variables[arg]) and not same_type(value, variables[arg]):
+                raise PluaError(locs[pc-1], "variable reassignation cannot change variable type.")
+            variables[arg] = value
+        elif op is STORE_FAST:
+            value = stack.pop()
+            if type(value) is not type(local_variables[arg]) and not same_type(value, local_variables[arg]):
+                raise PluaError(locs[pc-1], "variable reassignation cannot change variable type.")
+            local_variables[arg] = value
+        elif op is CALL or op is CALL_PURE:
+            name, args_len, needs_value = arg
+            if op is CALL_PURE:
+                key = memo_key(stack[-args_len:]) if args_len else ()
+                value = memos[name].lookup(key)
+                if value is not MEMO_MISS:
+                    if args_len:
+                        del stack[-args_len:]
+                    if needs_value:
+                        if value is None:
+                            raise PluaError(locs[pc-1], f"function `{name}` did not return a value")
+                        stack.append(value)
                     continue
-                if tokens[ip:] == 1:
-                    return Parens(loc, value)
-                end_tokens.insert(ip, Parens(loc, value))
-                closing_index = find_last_separator(tokens[ip:])
-                ip += closing_index      
-        if token.value in KEYWORDS or token.value in KEYWORDS_SIGNS:
-            typ = KEYWORDS_BY_NAME[token.value]
-            assert len(OpType) == 19, "Exhaustive handling of ops in parse_token_as_op()"
+            if len(frames) >= max_depth:
+                max_depth_error(max_depth, locs[pc-1])
+            callee = functions[name]
+            frame.pc = pc
+            frames.append(frame)
+            if args_len:
+                local_variables = stack[-args_len:]
+                del stack[-args_len:]
+            else:
+                local_variables = None
+            frame = Frame(callee, local_variables, needs_value)
+            if op is CALL_PURE:
+                frame.memo_key = key
+            instructions = callee.instructions
+            locs = callee.locs
+            pc = 0
+        elif op is TAIL_CALL:
+            name, args_len = arg
+            callee = functions[name]
+            if args_len:
+                local_variables = stack[-args_len:]
+                del stack[-args_len:]
+            else:
+                local_variables = None
+            tail_loc = locs[pc-1]
+            frame = Frame(callee, local_variables, frame.needs_value)
+            frame.tail_loc = tail_loc
+            instructions = callee.instructions
+            locs = callee.locs
+            pc = 0
+        elif op is RETURN or op is RETURN_VALUE:
+            if not frames:
+                if op is RETURN_VALUE:
+                    variables.append(stack.pop())
+                break
+            if op is RETURN_VALUE:
+                value = stack.pop()
+                if frame.needs_value:
+                    stack.append(value)
+            elif frame.tail_loc is not None:
+                raise PluaError(frame.tail_loc, f"function `{frame.code.name}` did not return a value")
+            elif frame.needs_value:
+                caller = frames[-1]
+                raise PluaError(caller.code.locs[caller.pc-1], f"function `{frame.code.name}` did not return a value")
+            else:
+                value = None
+            if frame.memo_key is not None:
+                memos[frame.code.name].store(frame.memo_key, value)
+            frame = frames.pop()
+            instructions = frame.code.instructions
+            locs = frame.code.locs
+            local_variables = frame.local_variables
+            pc = frame.pc
+        elif op is SPAWN:
+            name, args_len = arg
+            args = stack[-args_len:] if args_len else []
+            if args_len:
+                del stack[-args_len:]
+            stack.append(tasks.spawn(name, args, locs[pc-1]))
+        elif op is JOIN:
+            stack[-1] = join_task(stack[-1], locs[pc-1])
+        elif op is PROFILE:
+            # Last of the chain so programs that are not profiled never pay for it
+            profiler.record(arg, frame.code.name, locs[pc-1], len(frames))
+        else:
+            assert False, "Unreachable opcode in execute()"
+    if profiler is not None:
+        profiler.finish()
+    return variables
+
+class TaskPool:
+    """
+    Runs the calls given to `spawn` in a pool of `workers` processes, started by the first `spawn`.
+    The pure functions of the program are compiled and sent to every worker once, when it starts,
+    a task then only sends the name of its function and its arguments. They are translated to python
+    for the python engine, like the program, and run on the vm otherwise.
+    """
+    def __init__(self, functions: Dict[str, Union[FuncDef, Code]], workers: Optional[int]=None,
+                 memo_size: int=MEMO_SIZE, max_depth: int=MAX_DEPTH, output: Optional[TextIO]=None, engine: str="vm"):
+        self.functions = functions
+        self.workers = workers or os.cpu_count() or 1
+        self.memo_size = memo_size
+        self.max_depth = max_depth
+        self.output = output
+        self.engine = engine
+        self.executor = None
+
+    def worker_functions(self) -> Tuple[str, Any]:
+        pure = { name: func for name, func in self.functions.items() if func.pure }
+        if self.engine == "py" and all(isinstance(func, FuncDef) for func in pure.values()):
+            try:
+                code, names = transpile_functions(pure)
+                return "py", (marshal.dumps(code), names)
+            except TranspileError:
+                pass
+        functions = {}
+        for name, func in pure.items():
+            if isinstance(func, FuncDef):
+                # Pure functions use no globals, they are compiled on their own
+                func = compile_block(func.body, CodeBuilder(name, {}, self.functions, tuple(func.params), True)).build()
+            functions[name] = encode_code(func)
+        return "vm", functions
+
+    def start(self):
+        engine, functions = self.worker_functions()
+        # Forked workers get a copy of the buffered output, it would be written again when they exit
+        for stream in (self.output, sys.stdout, sys.stderr):
+            if stream is not None:
+                stream.flush()
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.workers, initializer=init_task_worker,
+                                                               initargs=(engine, functions, self.memo_size, self.max_depth))
+
+    def spawn(self, name: str, args: List[Any], loc: Loc) -> Task:
+        if self.executor is None:
+            self.start()
+        if any(type(arg) is Task for arg in args):
+            raise PluaError(loc, f"a task cannot be given to `{name}` by `spawn`", "only its result can be, with `join`")
+        args = [str(arg) if type(arg) is Rope else arg for arg in args]
+        return Task(name, self.executor.submit(run_task, name, args, loc))
+
+    def close(self):
+        # The tasks that were never joined are cancelled when they did not start yet
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+# State of a task worker process, kept for all its tasks: its functions (Code for the vm, python
+# functions for the python engine) and the results of its pure functions
+Task_Engine = "vm"
+Task_Functions: Dict[str, Union[Code, Callable]] = {}
+Task_Memos: Dict[str, Memo] = {}
+Task_Namespace: Dict[str, Any] = {}
+Task_Max_Depth = MAX_DEPTH
+
+def init_task_worker(engine: str, functions: Any, memo_size: int, max_depth: int):
+    global Task_Engine, Task_Functions, Task_Memos, Task_Namespace, Task_Max_Depth
+    Task_Engine = engine
+    Task_Max_Depth = max_depth
+    if engine == "py":
+        code, names = functions
+        Task_Memos = { name: Memo(memo_size) for name in names }
+        Task_Namespace = execute_python(marshal.loads(code), sys.stdout, Task_Memos, max_depth)
+        Task_Functions = { name: Task_Namespace[python_name] for name, python_name in names.items() }
+    else:
+        Task_Functions = { name: decode_code(code) for name, code in functions.items() }
+        Task_Memos = program_memos(Task_Functions, memo_size)
+
+def run_task(name: str, args: List[Any], loc: Loc) -> Any:
+    if Task_Engine == "py":
+        function = Task_Functions[name]
+        value = run_python(lambda: function(*args), Task_Namespace, Task_Max_Depth)
+        if value is None:
+            no_value_error(name, loc)
+    else:
+        # The main of a task only returns the value of the call
+        instructions = tuple((OpCode.LOAD_CONST, arg) for arg in args) + ((OpCode.CALL_PURE, (name, len(args), True)), (OpCode.RETURN_VALUE, None))
+        main = Code("<spawn>", (), instructions, (loc,) * len(instructions))
+        value = execute(CompiledProgram(main, Task_Functions, ()), sys.stdout, memos=Task_Memos, max_depth=Task_Max_Depth)[-1]
+    return str(value) if type(value) is Rope else value
+
+def profile_program(program: CompiledProgram) -> CompiledProgram:
+    """
+    Copy of the program with a PROFILE instruction before every instruction.
+    """
+    def instrument(code: Code) -> Code:
+        instructions = []
+        locs = []
+        for (op, arg), loc in zip(code.instructions, code.locs):
+            if op is OpCode.JUMP or op is OpCode.POP_JUMP_IF_TRUE or op is OpCode.POP_JUMP_IF_FALSE:
+                # Jumps land on the PROFILE of their target
+                arg = 2 * arg
+            instructions += [(OpCode.PROFILE, op), (op, arg)]
+            locs += [loc, loc]
+        return Code(code.name, code.params, tuple(instructions), tuple(locs), code.pure)
+    def instrument_program(program: CompiledProgram, modules: Dict[str, CompiledProgram]) -> CompiledProgram:
+        functions = { name: instrument(code) for name, code in program.functions.items() }
+        return CompiledProgram(instrument(program.main), functions, program.global_names, modules)
+    modules = { path: instrument_program(module, {}) for path, module in program.modules.items() }
+    return instrument_program(program, modules)
+
+class Profiler:
+    """
+    Counts and times the instructions run by execute(), grouped by opcode, by function and by loc.
+    An instruction lasts until the next one is recorded, the time spent in the profiler is left out.
+    The time of a function includes the functions it calls.
+    """
+    def __init__(self):
+        # [count, seconds]
+        self.opcodes = {}
+        self.locs = {}
+        # [calls, seconds running its own instructions, seconds including its callees]
+        self.functions = {}
+        # [name, start] of every frame of the plua call stack
+        self.calls = []
+        self.last = None
+        self.last_time = 0.0
+
+    def record(self, op: Optional[OpCode], name: str, loc: Loc, depth: int):
+        now = time.perf_counter()
+        if self.last is not None:
+            elapsed = now - self.last_time
+            last_op, last_name, last_loc = self.last
+            opcode = self.opcodes.setdefault(last_op, [0, 0.0])
+            opcode[0] += 1
+            opcode[1] += elapsed
+            source = self.locs.setdefault(last_loc, [0, 0.0])
+            source[0] += 1
+            source[1] += elapsed
+            self.functions[last_name][1] += elapsed
+        # Calls and returns are seen as a change of depth of the frame stack, a tail call as
+        # another function at the same depth
+        while len(self.calls) > depth + 1 or (len(self.calls) == depth + 1 and self.calls[-1][0] != name):
+            self.leave(now)
+        if len(self.calls) < depth + 1:
+            self.functions.setdefault(name, [0, 0.0, 0.0])[0] += 1
+            self.calls.append((name, now))
+        self.last = (op, name, loc)
+        self.last_time = time.perf_counter()
+
+    def leave(self, now: float):
+        name, start = self.calls.pop()
+        # A recursive call is already timed by its outermost call
+        if all(caller != name for caller, _ in self.calls):
+            self.functions[name][2] += now - start
+
+    def finish(self):
+        if self.last is None: return
+        self.record(None, self.last[1], self.last[2], len(self.calls) - 1)
+        now = time.perf_counter()
+        while self.calls:
+            self.leave(now)
+        self.last = None
+
+    def report(self) -> dict:
+        by_time = lambda item: -item[1][-1]
+        return {
+            "opcodes": [ { "opcode": op.name, "count": count, "seconds": seconds }
+                         for op, (count, seconds) in sorted(self.opcodes.items(), key=by_time) ],
+            "functions": [ { "function": name, "calls": calls, "self_seconds": own, "seconds": seconds }
+                           for name, (calls, own, seconds) in sorted(self.functions.items(), key=by_time) ],
+            "locs": [ { "loc": "%s:%d:%d" % loc, "count": count, "seconds": seconds }
+                      for loc, (count, seconds) in sorted(self.locs.items(), key=by_time) ],
+        }
+
+    def print_report(self, file: TextIO, limit: int=20):
+        report = self.report()
+        total = sum(opcode["seconds"] for opcode in report["opcodes"]) or 1.0
+        print(f"{'opcode':<18} {'count':>12} {'seconds':>10} {'%':>6}", file=file)
+        for opcode in report["opcodes"]:
+            print(f"{opcode['opcode']:<18} {opcode['count']:>12} {opcode['seconds']:>10.6f} {100 * opcode['seconds'] / total:>6.1f}", file=file)
+        print(file=file)
+        print(f"{'function':<16} {'calls':>12} {'self':>10} {'total':>10}", file=file)
+        for function in report["functions"][:limit]:
+            print(f"{function['function']:<16} {function['calls']:>12} {function['self_seconds']:>10.6f} {function['seconds']:>10.6f}", file=file)
+        print(file=file)
+        print(f"{'loc':<40} {'count':>12} {'seconds':>10} {'%':>6}", file=file)
+        for source in report["locs"][:limit]:
+            print(f"{source['loc']:<40} {source['count']:>12} {source['seconds']:>10.6f} {100 * source['seconds'] / total:>6.1f}", file=file)
+
+class TranspileError(Exception):
+    """
+    Raised for programs the python engine cannot translate, they run on the vm instead.
+    """
+
+PYTHON_OPERATORS = {
+        OpType.PLUS   : "+",
+        OpType.SUB    : "-",
+        OpType.MUL    : "*",
+        OpType.TRUEDIV: "/",
+        OpType.GT     : ">",
+        OpType.LT     : "<",
+        OpType.GE     : ">=",
+        OpType.LE     : "<=",
+        OpType.EQUAL  : "=="
+    }
+
+PYTHON_VALUE_TYPES = { typ: value_type for value_type, typ in VALUE_TYPES.items() if value_type is not Rope }
+
+PYTHON_TYPES = {
+        TokenType.INT  : "int",
+        TokenType.FLOAT: "float",
+        TokenType.BOOL : "bool",
+        TokenType.STR  : "str",
+        TokenType.ARRAY: "_Array",
+        TokenType.TASK : "_Task"
+    }
+
+def undefined_variable_error(name: str, loc: Loc):
+    raise PluaError(loc, f"variable `{name}` is used before its definition")
+
+def definition_error(loc: Loc):
+    raise PluaError(loc, "mismatched type definition and type of value.")
+
+def reassignation_error(name: str, current: Any, loc: Loc):
+    if current is None: undefined_variable_error(name, loc)
+    raise PluaError(loc, "variable reassignation cannot change variable type.")
+
+def no_value_error(name: str, loc: Loc):
+    raise PluaError(loc, f"function `{name}` did not return a value")
+
+@dataclass(slots=True)
+class PythonTailCall:
+    """
+    Returned by a translated function for `return f ( args )`, run_tail_calls() then runs f in place of
+    the function returning it so tail calls do not grow the python stack.
+    """
+    function: Callable
+    args: tuple
+    name: str
+    loc: Loc
+
+def run_tail_calls(value: Any) -> Any:
+    while type(value) is PythonTailCall:
+        call = value
+        value = call.function(*call.args)
+        # A function called by a `return` must give back a value, whatever its caller needs
+        if value is None: no_value_error(call.name, call.loc)
+    return value
+
+TRANSPILE_CHUNK_SIZE = 256
+
+PYTHON_IDENTIFIER = re.compile(r"[A-Za-z_]\w*")
+
+# Mark put before a call while translating, with the index of its loc, see Transpiler.source()
+CALL_MARK = re.compile(r"\x00(\d+)\x00")
+
+def contains_call(expr: Expr) -> bool:
+    if isinstance(expr, Call):
+        return True
+    elif isinstance(expr, BinOp):
+        return contains_call(expr.lhs) or contains_call(expr.rhs)
+    elif isinstance(expr, (FloatCast, Reduce, Join)):
+        return contains_call(expr.value)
+    elif isinstance(expr, Spawn):
+        return any(contains_call(arg) for arg in expr.call.args)
+    return False
+
+def collect_calls(node: Union[Expr, Stmt], calls: Set[str]):
+    if isinstance(node, Call):
+        calls.add(node.name)
+        for arg in node.args:
+            collect_calls(arg, calls)
+    elif isinstance(node, BinOp):
+        collect_calls(node.lhs, calls)
+        collect_calls(node.rhs, calls)
+    elif isinstance(node, (FloatCast, Reduce, Join, Print, Def, Assign, Return)):
+        collect_calls(node.value, calls)
+    elif isinstance(node, Spawn):
+        # The function itself runs in a worker process
+        for arg in node.call.args:
+            collect_calls(arg, calls)
+    elif isinstance(node, While):
+        collect_calls(node.condition, calls)
+        for stmt in node.body:
+            collect_calls(stmt, calls)
+    elif isinstance(node, If):
+        for arm in node.arms:
+            collect_calls(arm.condition, calls)
+            for stmt in arm.body:
+                collect_calls(stmt, calls)
+        for stmt in node.orelse:
+            collect_calls(stmt, calls)
+
+def called_functions(program: Program) -> Dict[str, FuncDef]:
+    # Functions called by the statements of the program or by the functions they call
+    functions = program_functions(program)
+    calls = set()
+    for stmt in program:
+        if not isinstance(stmt, FuncDef):
+            collect_calls(stmt, calls)
+    called = set()
+    while calls:
+        name = calls.pop()
+        if name not in called:
+            called.add(name)
+            for stmt in functions[name].body:
+                collect_calls(stmt, calls)
+    return { name: func for name, func in functions.items() if name in called }
+
+class Transpiler:
+    """
+    Translates a program into python source where every plua variable is a python variable and
+    every plua function a python function. The type rules of plua are kept by guards around each
+    operator whose operand types are not known while translating, the error path of a guard
+    raises the same PluaError as the other engines. Functions that are never called, like most of the
+    functions of an imported module, are not translated.
+    """
+    def __init__(self, program: Program, global_slots: Dict[str, int], functions: Optional[Dict[str, FuncDef]]=None):
+        self.global_slots = global_slots
+        self.global_types = { name: PYTHON_VALUE_TYPES.get(typ) for name, typ in collect_global_types(program).items() }
+        # The functions the program calls, unless given
+        self.functions = functions if functions is not None else called_functions(program)
+        self.function_names = { name: f"f{index}" for index, name in enumerate(self.functions) }
+        # Functions giving back tail calls, their callers run them with _run_tail_calls()
+        self.tail_callers = { name for name, func in self.functions.items() if returns_tail_call(func.body, func, self.functions) }
+        self.temporaries = 0
+        self.lines = []
+        self.params = []
+        # Globals assigned by the current function, they need a `global` declaration
+        self.assigned = set()
+        # Globals that are always defined when the current statement runs
+        self.defined = set()
+        # Whether the current statement calls a function, which may reassign any global
+        self.has_call = False
+        self.in_main = False
+        # A `def` in a loop or in an `if` may never run, so it does not define its global for the statements after
+        self.in_loop = False
+        self.in_branch = False
+        # Function being translated, and whether its body is in a loop started again by its tail calls
+        self.current = None
+        self.tail_loop = False
+        # Module level lines building the array literals, too large to write as python literals
+        self.constants = []
+        # Locs of the calls, by the index in their mark
+        self.call_locs = []
+
+    def temporary(self) -> str:
+        self.temporaries += 1
+        return f"_t{self.temporaries}"
+
+    def emit(self, line: str, indent: int):
+        self.lines.append("    " * indent + line)
+
+    def variable(self, name: str) -> str:
+        if name in self.params:
+            return f"l{self.params.index(name)}"
+        return f"g{self.global_slots[name]}"
+
+    def materialize(self, value: str, indent: int) -> str:
+        """
+        Returns an operand that can be read several times without evaluating `value` again.
+        """
+        if PYTHON_IDENTIFIER.fullmatch(value) or value[0].isdigit() or value[0] in "'\"":
+            return value
+        temporary = self.temporary()
+        self.emit(f"{temporary} = {value}", indent)
+        return temporary
+
+    def ordered(self, value: str, indent: int) -> str:
+        """
+        Takes the value of an operation that can raise now when a call comes later in the statement,
+        so its error is raised before the call runs, as on the other engines.
+        """
+        return self.materialize(value, indent) if self.has_call else value
+
+    def expression(self, expr: Expr, indent: int) -> Tuple[str, Optional[type]]:
+        """
+        Emits the statements guarding `expr` and returns the python expression of its value
+        along with its python type when it is known while translating.
+        """
+        if isinstance(expr, Const):
+            if isinstance(expr.value, Array):
+                constant = f"_c{len(self.constants)}"
+                self.constants.append(f"{constant} = _Array({expr.value.typecode!r}, bytes.fromhex('{expr.value.tobytes().hex()}'))")
+                return constant, Array
+            if isinstance(expr.value, float) and not math.isfinite(expr.value):
+                return f"float('{expr.value!r}')", float
+            return repr(expr.value), type(expr.value)
+        elif isinstance(expr, Name):
+            variable = self.variable(expr.name)
+            if expr.name in self.params:
+                return variable, None
+            typ = self.global_types.get(expr.name)
+            if expr.name in self.defined and not self.has_call:
+                return variable, typ
+            # A call later in the statement could reassign the global, so its value is taken now
+            value = self.temporary()
+            self.emit(f"{value} = {variable}", indent)
+            if expr.name not in self.defined:
+                self.emit(f"if {value} is None: _undefined_variable_error({expr.name!r}, {expr.loc!r})", indent)
+            return value, typ
+        elif isinstance(expr, BinOp):
+            a, typ_a = self.expression(expr.lhs, indent)
+            b, typ_b = self.expression(expr.rhs, indent)
+            if typ_a is Array or typ_b is Array:
+                return self.ordered(f"_array_op(OpType.{expr.op.name}, {a}, {b}, {expr.loc!r})", indent), Array
+            # An operand of unknown type may be an array, which gives an array
+            if typ_a is None or typ_b is None:
+                typ = None
+            elif expr.op == OpType.TRUEDIV:
+                typ = float
+            elif expr.op in PYTHON_OPERATORS and expr.op not in (OpType.PLUS, OpType.SUB, OpType.MUL):
+                typ = bool
+            else:
+                typ = typ_a
+            known = expr.typ is not None
+            if known and expr.op == OpType.PLUS and expr.typ == TokenType.STR:
+                return f"_concat({a}, {b})", typ
+            if known and expr.op == OpType.TRUEDIV and expr.typ == TokenType.INT:
+                # Ints too large to divide as floats are reported by _binary_op()
+                return self.ordered(f"_binary_op(OpType.TRUEDIV, {a}, {b}, {expr.loc!r})", indent), typ
+            if known and not (expr.op == OpType.TRUEDIV and not (b[0].isdigit() and float(b) != 0)):
+                return f"({a} {PYTHON_OPERATORS[expr.op]} {b})", typ
+            a = self.materialize(a, indent)
+            b = self.materialize(b, indent)
+            if known:
+                guard = f"{b} == 0"
+            else:
+                if expr.op == OpType.EQUAL:
+                    guard = f"type({a}) is not type({b}) or type({a}) is _Array or type({a}) is _Rope or type({a}) is _Task"
+                elif expr.op == OpType.TRUEDIV:
+                    # Ints are divided by _binary_op(), which reports the ones too large for a float
+                    guard = f"type({a}) is not type({b}) or type({a}) is not float or {b} == 0"
+                else:
+                    guard = f"type({a}) is not type({b}) or not (type({a}) is int or type({a}) is float)"
+                return self.ordered(f"(_binary_op(OpType.{expr.op.name}, {a}, {b}, {expr.loc!r}) if {guard} else {a} {PYTHON_OPERATORS[expr.op]} {b})", indent), typ
+            self.emit(f"if {guard}: _binary_op_error(OpType.{expr.op.name}, {a}, {b}, {expr.loc!r})", indent)
+            return f"({a} {PYTHON_OPERATORS[expr.op]} {b})", typ
+        elif isinstance(expr, FloatCast):
+            value, typ = self.expression(expr.value, indent)
+            if typ is not None and typ is not int and typ is not Array:
+                value = self.materialize(value, indent)
+                self.emit(f"if type({value}) is not int: _float_cast({value}, {expr.loc!r})", indent)
+                return f"float({value})", float
+            # Also reports the ints too large for a float
+            return self.ordered(f"_float_cast({value}, {expr.loc!r})", indent), float if typ is int else typ
+        elif isinstance(expr, Reduce):
+            value, _ = self.expression(expr.value, indent)
+            return self.ordered(f"_reduce_array(OpType.{expr.op.name}, {value}, {expr.loc!r})", indent), None
+        elif isinstance(expr, Call):
+            call = self.call(expr, indent)
+            if function_always_returns(self.functions[expr.name]) and not self.has_call:
+                return call, None
+            # Calls run in order with the global reads of the statement
+            value = self.temporary()
+            self.emit(f"{value} = {call}", indent)
+            if not function_always_returns(self.functions[expr.name]):
+                self.emit(f"if {value} is None: _no_value_error({expr.name!r}, {expr.loc!r})", indent)
+            return value, None
+        elif isinstance(expr, Spawn):
+            args = [self.expression(arg, indent)[0] for arg in expr.call.args]
+            return self.ordered(f"_spawn({expr.call.name!r}, [{', '.join(args)}], {expr.loc!r})", indent), Task
+        elif isinstance(expr, Join):
+            value, _ = self.expression(expr.value, indent)
+            return self.ordered(f"_join({value}, {expr.loc!r})", indent), None
+        raise TranspileError(f"unsupported expression {type(expr).__name__}")
+
+    def statement_expression(self, expr: Expr, indent: int, translate: Optional[Callable]=None) -> Tuple[str, Optional[type]]:
+        """
+        Translates the expression of a statement. Python evaluates an inline expression in the same
+        order as plua, but once a guard is emitted before it a call could run out of order, so
+        expressions with calls are translated again with their calls and global reads emitted in order.
+        """
+        translate = translate or self.expression
+        self.has_call = False
+        lines = len(self.lines)
+        value = translate(expr, indent)
+        if len(self.lines) > lines and contains_call(expr):
+            del self.lines[lines:]
+            self.temporaries = 0
+            self.has_call = True
+            value = translate(expr, indent)
+        return value
+
+    def call(self, call: Call, indent: int) -> str:
+        args = [self.expression(arg, indent)[0] for arg in call.args]
+        self.call_locs.append(call.loc)
+        mark = f"\x00{len(self.call_locs) - 1}\x00"
+        if call.name in self.tail_callers:
+            return f"{mark}_run_tail_calls({mark}{self.function_names[call.name]}({', '.join(args)}))"
+        return f"{mark}{self.function_names[call.name]}({', '.join(args)})"
+
+    def statement(self, stmt: Stmt, indent: int):
+        # Temporaries never outlive their statement, reusing their names keeps python's locals small
+        self.temporaries = 0
+        if isinstance(stmt, Print):
+            self.emit(f"_print({self.statement_expression(stmt.value, indent)[0]})", indent)
+        elif isinstance(stmt, Def):
+            value, typ = self.statement_expression(stmt.value, indent)
+            if typ is not PYTHON_VALUE_TYPES[stmt.typ]:
+                value = self.materialize(value, indent)
+                guard = f"type({value}) is not {PYTHON_TYPES[stmt.typ]}"
+                if stmt.typ == TokenType.STR:
+                    guard += f" and type({value}) is not _Rope"
+                self.emit(f"if {guard}: _definition_error({stmt.loc!r})", indent)
+            self.assign(stmt.name, value, indent)
+            if self.in_main and not self.in_loop and not self.in_branch:
+                self.defined.add(stmt.name)
+        elif isinstance(stmt, Assign):
+            value, typ = self.statement_expression(stmt.value, indent)
+            variable = self.variable(stmt.name)
+            if stmt.name not in self.defined or typ is None or typ is not self.global_types.get(stmt.name):
+                value = self.materialize(value, indent)
+                self.emit(f"if type({value}) is not type({variable}) and not _same_type({value}, {variable}): _reassignation_error({stmt.name!r}, {variable}, {stmt.loc!r})", indent)
+            self.assign(stmt.name, value, indent)
+        elif isinstance(stmt, Call):
+            call = lambda call, indent: (self.call(call, indent), None)
+            self.emit(self.statement_expression(stmt, indent, call)[0], indent)
+        elif isinstance(stmt, Return):
+            call = stmt.value
+            if self.current.pure:
+                self.emit(f"_value = {self.statement_expression(call, indent)[0]}", indent)
+                self.emit(f"_memos[{self.current.name!r}].store(_key, _value)", indent)
+                self.emit("return _value", indent)
+            elif self.tail_loop and not self.in_loop and is_tail_call(stmt, self.current):
+                # The arguments are all evaluated before the parameters are replaced
+                args = lambda call, indent: (", ".join(self.expression(arg, indent)[0] for arg in call.args), None)
+                args = self.statement_expression(call, indent, args)[0]
+                if call.args:
+                    self.emit(f"{', '.join(f'l{index}' for index in range(len(call.args)))} = {args}", indent)
+                self.emit("continue", indent)
+            elif isinstance(call, Call) and not self.functions[call.name].pure:
+                # Run by the caller in place of this function, so tail calls do not grow the python stack
+                args = lambda call, indent: (", ".join(self.expression(arg, indent)[0] for arg in call.args), None)
+                args = self.statement_expression(call, indent, args)[0]
+                self.emit(f"return _TailCall({self.function_names[call.name]}, ({args + ',' if call.args else ''}), {call.name!r}, {call.loc!r})", indent)
+            else:
+                self.emit(f"return {self.statement_expression(call, indent)[0]}", indent)
+        elif isinstance(stmt, While):
+            self.emit("while True:", indent)
+            lines = len(self.lines)
+            condition, typ = self.statement_expression(stmt.condition, indent + 1)
+            if typ is bool and len(self.lines) == lines:
+                # Nothing to run before the condition, it is checked by the loop itself
+                self.lines[-1] = "    " * indent + f"while {condition}:"
+            else:
+                condition = self.materialize(condition, indent + 1)
+                if typ is not bool:
+                    self.emit(f"if {condition} is not True and {condition} is not False: _condition_error('while', {condition}, {stmt.loc!r})", indent + 1)
+                self.emit(f"if not {condition}: break", indent + 1)
+            in_loop = self.in_loop
+            self.in_loop = True
+            for body_stmt in stmt.body:
+                self.statement(body_stmt, indent + 1)
+            self.in_loop = in_loop
+            self.emit("pass", indent + 1)
+        elif isinstance(stmt, If):
+            in_branch = self.in_branch
+            self.in_branch = True
+            depth = indent
+            for index, arm in enumerate(stmt.arms):
+                if index > 0:
+                    # The condition only runs when the arms before are not taken
+                    self.emit("else:", depth)
+                    depth += 1
+                lines = len(self.lines)
+                condition, typ = self.statement_expression(arm.condition, depth)
+                if index > 0 and typ is bool and len(self.lines) == lines:
+                    # Nothing to run before the condition, it is an `elif` of the arm before
+                    depth -= 1
+                    self.lines[-1] = "    " * depth + f"elif {condition}:"
+                else:
+                    if typ is not bool:
+                        condition = self.materialize(condition, depth)
+                        self.emit(f"if {condition} is not True and {condition} is not False: _condition_error('if', {condition}, {arm.loc!r})", depth)
+                    self.emit(f"if {condition}:", depth)
+                for body_stmt in arm.body:
+                    self.statement(body_stmt, depth + 1)
+                self.emit("pass", depth + 1)
+            if stmt.orelse:
+                if stmt.arms:
+                    self.emit("else:", depth)
+                    depth += 1
+                for body_stmt in stmt.orelse:
+                    self.statement(body_stmt, depth)
+                self.emit("pass", depth)
+            self.in_branch = in_branch
+        elif isinstance(stmt, FuncDef):
+            # Every function is defined before the main program runs
+            pass
+        elif isinstance(stmt, Import):
+            # The statements of the module are translated before, see link_program()
+            pass
+        else:
+            raise TranspileError(f"unsupported statement {type(stmt).__name__}")
+
+    def assign(self, name: str, value: str, indent: int):
+        variable = self.variable(name)
+        if name not in self.params:
+            self.assigned.add(variable)
+        self.emit(f"{variable} = {value}", indent)
+
+    def function(self, name: str, params: List[str], body: Program, func: Optional[FuncDef]=None):
+        self.params = params
+        self.assigned = set()
+        self.current = func
+        self.tail_loop = func is not None and not func.pure and has_tail_call(body, func)
+        self.emit(f"def {name}({', '.join(f'l{index}' for index in range(len(params)))}):", 0)
+        header = len(self.lines)
+        indent = 1
+        if func is not None and func.pure:
+            # The memo is used by the function itself so a call stays a single python frame
+            self.emit(f"_key = _memo_key(({''.join(f'l{index}, ' for index in range(len(params)))}))", 1)
+            self.emit(f"_value = _memos[{func.name!r}].lookup(_key)", 1)
+            self.emit("if _value is not _MEMO_MISS: return _value", 1)
+        elif self.tail_loop:
+            # A `return` calling the function itself starts the loop again with the new arguments
+            self.emit("while True:", 1)
+            indent = 2
+        for stmt in body:
+            self.statement(stmt, indent)
+        if func is not None and func.pure:
+            self.emit(f"_memos[{func.name!r}].store(_key, None)", indent)
+        elif self.tail_loop:
+            self.emit("return", indent)
+        else:
+            self.emit("pass", indent)
+        if self.assigned:
+            self.lines.insert(header, f"    global {', '.join(sorted(self.assigned))}")
+
+    def transpile(self, program: Program) -> str:
+        if self.global_slots:
+            self.emit(f"{' = '.join(f'g{slot}' for slot in self.global_slots.values())} = None", 0)
+        for name, func in self.functions.items():
+            self.function(self.function_names[name], func.params, func.body, func)
+        # The python compiler slows down badly on huge functions, so the main program is split
+        chunks = range(0, len(program), TRANSPILE_CHUNK_SIZE)
+        self.in_main = True
+        for index, start in enumerate(chunks):
+            self.function(f"_main{index}", [], program[start:start + TRANSPILE_CHUNK_SIZE])
+        for index in range(len(chunks)):
+            self.emit(f"_main{index}()", 0)
+        return self.source()
+
+    def source(self) -> str:
+        """
+        Joins the lines without the marks of the calls. The loc of each call is kept in `_call_locs` by its
+        line and the column of its first character, for the error of a call going beyond the maximum depth.
+        """
+        lines = []
+        call_locs = {}
+        # The first line defines `_call_locs`
+        for lineno, line in enumerate(self.constants + self.lines, 2):
+            if "\x00" in line:
+                parts = []
+                start = 0
+                column = 0
+                for mark in CALL_MARK.finditer(line):
+                    parts.append(line[start:mark.start()])
+                    # Python gives the columns in bytes of utf-8
+                    column += len(line[start:mark.start()].encode())
+                    call_locs.setdefault(lineno, []).append((column, self.call_locs[int(mark[1])]))
+                    start = mark.end()
+                parts.append(line[start:])
+                line = "".join(parts)
+            lines.append(line)
+        lines.insert(0, f"_call_locs = {{{', '.join(f'{lineno}: {tuple(calls)!r}' for lineno, calls in call_locs.items())}}}")
+        return "\n".join(lines) + "\n"
+
+def is_tail_call(stmt: Stmt, func: FuncDef) -> bool:
+    return isinstance(stmt, Return) and isinstance(stmt.value, Call) and stmt.value.name == func.name
+
+def has_tail_call(body: Program, func: FuncDef) -> bool:
+    # Tail calls in a loop are left out, they would start the loop again instead of the function
+    for stmt in body:
+        if is_tail_call(stmt, func):
+            return True
+        elif isinstance(stmt, If) and (any(has_tail_call(arm.body, func) for arm in stmt.arms) or has_tail_call(stmt.orelse, func)):
+            return True
+    return False
+
+def returns_tail_call(body: Program, func: FuncDef, functions: Dict[str, FuncDef], in_loop: bool=False) -> bool:
+    # Whether the translated function gives back a PythonTailCall, all its tail calls do except the
+    # ones to itself out of a loop, which start its loop again
+    if func.pure:
+        return False
+    for stmt in body:
+        if isinstance(stmt, Return) and isinstance(stmt.value, Call) and not functions[stmt.value.name].pure:
+            if in_loop or not is_tail_call(stmt, func):
+                return True
+        elif isinstance(stmt, While) and returns_tail_call(stmt.body, func, functions, True):
+            return True
+        elif isinstance(stmt, If) and (any(returns_tail_call(arm.body, func, functions, in_loop) for arm in stmt.arms) or
+                                       returns_tail_call(stmt.orelse, func, functions, in_loop)):
+            return True
+    return False
+
+def function_always_returns(func: FuncDef) -> bool:
+    return any(isinstance(stmt, Return) for stmt in func.body)
+
+def transpile_program(program: Program, filepath: str) -> types.CodeType:
+    # The program comes from optimize_program(), which checked its types as written
+    return compile_python(Transpiler(program, resolve_names(program, check_types=False)).transpile(program), filepath)
+
+def transpile_functions(functions: Dict[str, FuncDef]) -> Tuple[types.CodeType, Dict[str, str]]:
+    # Code defining the pure functions without running anything, for the workers of a TaskPool,
+    # and the python name of each function. Pure functions use no globals
+    transpiler = Transpiler([], {}, functions)
+    return compile_python(transpiler.transpile([]), "<spawn>"), transpiler.function_names
+
+def compile_python(source: str, filepath: str) -> types.CodeType:
+    try:
+        # The python compiler recurses in C as deep as the recursion limit allows, which the
+        # interpreter raises for deep plua programs
+        with recursion_limit(stack_depth() + 1000):
+            return compile(source, f"<plua {filepath}>", "exec")
+    except (SyntaxError, RecursionError, MemoryError) as error:
+        # Deeply nested plua expressions go beyond what the python compiler accepts
+        raise TranspileError(str(error))
+
+# Python frames of the calls made by a translated program besides its plua functions, like the error helpers
+PYTHON_DEPTH_MARGIN = 10
+
+def execute_python(code: types.CodeType, output: TextIO, memos: Optional[Dict[str, Memo]]=None,
+                   max_depth: int=MAX_DEPTH, tasks: Optional[TaskPool]=None) -> Dict[str, Any]:
+    """
+    Runs a program from transpile_program() and gives back its namespace, where the global of slot n is `g<n>`.
+    The memos of its pure functions are created on the first call when not given, the functions it spawns
+    must be in the functions of `tasks`. Every plua call is a python call, except tail calls, which loop in the
+    function calling itself or are run by the caller, so the depth is bounded through the recursion limit of python.
+    """
+    namespace = {
+        "_memos"                   : memos if memos is not None else collections.defaultdict(lambda: Memo(MEMO_SIZE)),
+        "_memo_key"                : memo_key,
+        "_MEMO_MISS"               : MEMO_MISS,
+        "OpType"                   : OpType,
+        "_print"                   : functools.partial(print_value, output=output),
+        "_binary_op_error"         : binary_op_error,
+        "_array_op"                : array_op,
+        "_binary_op"               : binary_op,
+        "_concat"                  : concat,
+        "_same_type"               : same_type,
+        "_Rope"                    : Rope,
+        "_reduce_array"            : reduce_array,
+        "_Array"                   : Array,
+        "_float_cast"              : float_cast,
+        "_undefined_variable_error": undefined_variable_error,
+        "_definition_error"        : definition_error,
+        "_reassignation_error"     : reassignation_error,
+        "_no_value_error"          : no_value_error,
+        "_TailCall"                : PythonTailCall,
+        "_run_tail_calls"          : run_tail_calls,
+        "_condition_error"         : condition_error,
+        "_spawn"                   : (tasks if tasks is not None else TaskPool({}, max_depth=max_depth)).spawn,
+        "_join"                    : join_task,
+        "_Task"                    : Task,
+    }
+    # The module and the chunk of the main program come before the first plua call
+    run_python(lambda: exec(code, namespace), namespace, max_depth)
+    return namespace
+
+def run_python(run: Callable[[], Any], namespace: Dict[str, Any], max_depth: int) -> Any:
+    # Calls `run` with the depth of the plua calls it makes bounded by `max_depth`
+    try:
+        with recursion_limit(stack_depth() + 3 + max_depth + PYTHON_DEPTH_MARGIN):
+            return run()
+    except RecursionError as error:
+        # Reported at the deepest plua call in progress, the one that went too deep
+        entry = error.__traceback__
+        loc = None
+        while entry is not None:
+            loc = call_loc(entry, namespace["_call_locs"]) or loc
+            entry = entry.tb_next
+        if loc is None: raise
+        max_depth_error(max_depth, loc)
+
+def call_loc(entry: types.TracebackType, call_locs: Dict[int, Tuple[Tuple[int, Loc], ...]]) -> Optional[Loc]:
+    # Loc of the plua call running at this entry of a traceback, None when it is not running one
+    calls = call_locs.get(entry.tb_lineno) if entry.tb_frame.f_code.co_filename.startswith("<plua ") else None
+    if not calls:
+        return None
+    if len(calls) == 1:
+        return calls[0][1]
+    # Several calls on the line, the running one starts at the column of its instruction
+    positions = list(entry.tb_frame.f_code.co_positions())
+    if 0 <= entry.tb_lasti // 2 < len(positions):
+        _, _, column, _ = positions[entry.tb_lasti // 2]
+        for call_column, loc in calls:
+            if call_column == column:
+                return loc
+    return None
+
+class Parser:
+    """
+    Single pass recursive descent parser, binary operators are parsed by precedence climbing.
+    Tokens are pulled from the iterable one at a time so it never needs to slice them.
+    """
+    def __init__(self, tokens: Iterable[Token], functions: dict, namespace: Optional[str]=None):
+        self.tokens = iter(tokens)
+        self.lookahead = []
+        self.functions = functions
+        self.last_loc = ("<unknown>", 0, 0)
+        self.in_function = False
+        # Arguments of the function being parsed
+        self.params = []
+        # Block of statements being parsed, functions cannot be defined in a loop or an `if`
+        self.block = None
+        # Name of the module being parsed, which qualifies its words
+        self.namespace = namespace
+        # Modules imported by the file, directly or not, by name
+        self.modules = {}
+        # Imports come before the other statements of the file
+        self.in_imports = True
+
+    def peek(self, offset: int=0) -> Optional[Token]:
+        while len(self.lookahead) <= offset:
+            token = next(self.tokens, None)
+            if token is None: return None
+            self.lookahead.append(token)
+        return self.lookahead[offset]
+
+    def next(self) -> Optional[Token]:
+        token = self.peek()
+        if token is not None:
+            self.lookahead.pop(0)
+            self.last_loc = token.loc
+        return token
+
+    def expect_token(self, what: str) -> Token:
+        token = self.next()
+        if token is None:
+            raise PluaError(self.last_loc, f"expected {what} but found nothing")
+        return token
+
+    def peek_keyword(self, offset: int=0) -> Optional[OpType]:
+        token = self.peek(offset)
+        if token is None or token.typ != TokenType.KEYWORD: return None
+        return KEYWORDS_BY_NAME.get(token.value)
+
+    def qualify(self, word: str) -> str:
+        """
+        Name of a word of the file: the globals and functions of a module are named `{module}.{word}`,
+        the arguments of its functions and the words of the modules it imports are left as written.
+        """
+        namespace, dot, _ = word.partition(".")
+        if self.namespace is None or word in self.params or (dot and namespace in self.modules):
+            return word
+        return f"{self.namespace}.{word}"
+
+    def check_word(self, token: Token):
+        # The globals of a module are only used by the module itself, the files importing it only call its functions
+        namespace, dot, _ = token.value.partition(".")
+        if dot and namespace in self.modules:
+            raise PluaError(token.loc, f"unknown word: `{token.value}`", f"only the functions of the module `{namespace}` can be used outside of it")
+
+    def parse_program(self) -> Program:
+        program = []
+        while self.peek() is not None:
+            stmt = self.parse_statement()
+            self.in_imports = self.in_imports and isinstance(stmt, Import)
+            program.append(stmt)
+        return program
+
+    def parse_statement(self) -> Stmt:
+        token = self.next()
+        assert len(OpType) == 31, "Exhaustive handling of ops in parse_statement()"
+        if token.typ == TokenType.KEYWORD:
+            typ = KEYWORDS_BY_NAME.get(token.value)
             if typ == OpType.PRINT:
-                if len(tokens[ip:]) == 1:
-                    print("%s:%d:%d: ERROR: expected argument but found nothing " % token.loc)
-                    exit(1)
-                #arg = tokens[ip+1]
-                #closing_index = 0
-                #if arg.typ == TokenType.LPAREN:
-                #    closing_index = find_last_separator(tokens[ip+1:])
-                #    arg = parse_token_as_op(tokens[ip+1:ip+closing_index+1])
-                #    ip += closing_index
-                #else: ip += 1
-
-                #if isinstance(arg, Parens): end_tokens.append(Op(OpType.PRINT, token.loc, arg))
-                #else:
-                #    if (hasattr(arg, 'typ') and arg.typ != TokenType.STR) and (hasattr(arg, 'typ') and arg.typ != TokenType.INT) and (hasattr(arg, 'typ') and arg.typ != TokenType.WORD):
-                #        print(f"{arg.loc[0]}:{arg.loc[1]}:{arg.loc[2]}: ERROR: expected string, number or variable name but found `{arg.typ}`")
-                #        exit(1)
-                # Indent this and change `None` to `arg`
-                end_tokens.append(Op(OpType.PRINT, token.loc, None))
-                ip += 1
-            elif typ == OpType.FLOAT:
-                if len(tokens[ip:]) == 1:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: expected one argument after the operator but found nothing.")
-                    exit(1)
-                end_tokens.append(Op(OpType.FLOAT, token.loc, None))
-                ip += 1
-            elif typ == OpType.PLUS:
-                if ip == 0:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: expected one argument before the operator but found nothing.")
-                    exit(1)
-                if len(tokens[ip:]) == 1:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: expected one argument after the operator but found nothing.")
-                    exit(1)
-                end_tokens.append(Op(OpType.PLUS, token.loc, None))
-                ip += 1
-            elif typ == OpType.MUL:
-                if ip == 0:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: expected one argument before the operator but found nothing.")
-                    exit(1)
-                if len(tokens[ip:]) == 1:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: expected one argument after the operator but found nothing.")
-                    exit(1)
-                end_tokens.append(Op(OpType.MUL, token.loc, None))
-                ip += 1
-            elif typ == OpType.TRUEDIV:
-                if ip == 0:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: expected one argument before the operator but found nothing.")
-                    exit(1)
-                if len(tokens[ip:]) == 1:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: expected one argument after the operator but found nothing.")
-                    exit(1)
-                end_tokens.append(Op(OpType.TRUEDIV, token.loc, None))
-                ip += 1
-            elif typ == OpType.SUB:
-                if ip == 0:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: expected one argument before the operator but found nothing.")
-                    exit(1)
-                if len(tokens[ip:]) == 1:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: expected one argument after the operator but found nothing.")
-                    exit(1)
-                end_tokens.append(Op(OpType.SUB, token.loc, None))
-                ip += 1 
-            elif typ == OpType.GT:
-                if ip == 0:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: expected one argument before the operator but found nothing.")
-                    exit(1)
-                if len(tokens[ip:]) == 1:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: expected one argument after the operator but found nothing.")
-                    exit(1)
-                end_tokens.append(Op(OpType.GT, token.loc, None))
-                ip += 1
-            elif typ == OpType.LT:
-                if ip == 0:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: expected one argument before the operator but found nothing.")
-                    exit(1)
-                if len(tokens[ip:]) == 1:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: expected one argument after the operator but found nothing.")
-                    exit(1)
-                end_tokens.append(Op(OpType.LT, token.loc, None))
-                ip += 1
-            elif typ == OpType.GE:
-                if ip == 0:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: expected one argument before the operator but found nothing.")
-                    exit(1)
-                if len(tokens[ip:]) == 1:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: expected one argument after the operator but found nothing.")
-                    exit(1)
-                end_tokens.append(Op(OpType.GE, token.loc, None))
-                ip += 1
-            elif typ == OpType.LE:
-                if ip == 0:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: expected one argument before the operator but found nothing.")
-                    exit(1)
-                if len(tokens[ip:]) == 1:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: expected one argument after the operator but found nothing.")
-                    exit(1)
-                end_tokens.append(Op(OpType.LE, token.loc, None))
-                ip += 1
-            elif typ == OpType.EQUAL:
-                if ip == 0:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: expected one argument before the operator but found nothing.")
-                    exit(1)
-                if len(tokens[ip:]) == 1:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: expected one argument after the operator but found nothing.")
-                    exit(1)
-                end_tokens.append(Op(OpType.EQUAL, token.loc, None))
-                ip += 1
+                return Print(token.loc, self.parse_expression())
             elif typ == OpType.DEF:
-                if len(tokens[ip:]) < 6:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: not enough arguments for the variable definition.")
-                    exit(1)
-                end_tokens.append(Op(OpType.DEF, token.loc, None))
-                ip += 1
-            elif typ == OpType.TYPE_EQUAL:
-                if len(tokens[ip:]) == 1:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: not enough arguments for the type equal operator.")
-                    exit(1)
-                end_tokens.append(Op(OpType.TYPE_EQUAL, token.loc, None))
-                ip += 1
-            elif typ == OpType.EQUAL_ARROW:
-                if len(tokens[ip:]) == 1:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: not enough arguments for the arrow operator.")
-                    exit(1)
-                end_tokens.append(Op(OpType.EQUAL_ARROW, token.loc, None))
-                ip += 1
+                return self.parse_def(token)
             elif typ == OpType.FUNC:
-                ops = []
-                i = ip
-                while i < len(tokens):
-                    if tokens[i].typ == TokenType.KEYWORD:
-                        if tokens[i].value == 'end': break
-                    i += 1
-                # Don't forget end keyword
-                i += 1
-
-                if i < 4:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: not enough arguments for the func operator.")
-                    exit(1)
-
-                ip += 1 # Skip func operator
-                i -= 1
-
-                name = tokens[ip]
-                if name.typ != TokenType.WORD:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: naming a function with either a keyword, a number or a string is not allowed.")
-                    exit(1)
-                ip += 1 # Skip name
-                i -= 1
-            
-                ops = parse_token_as_op(tokens[ip:ip+i], func=True)
-                length = calculate_length_ops(tokens[ip:ip+i])     
-
-                ip += length
-                i -= length
-                assert i == 0, f"Parser error? : {i}"
-
-                if isinstance(ops, Parens): 
-                    ops = ops.ops
-                    if tokens[ip-1].typ != OpType.END and tokens[ip-1].value != 'end':
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: function assignation not ended.")
-                        exit(1)
-                    # To bait the pop
-                    ops.append(None)
-                elif ops[-1].typ != OpType.END:
-                    print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: function assignation not ended.")
-                    exit(1)
-
-                argument = False
-                if ops[0].typ == OpType.ARG_ARROW:
-                    argument = True
-                    func_args = []
-                    if not isinstance(ops[1], Parens):
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: wrong argument type")
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: NOTE: functions arguments need to be passed in Parentheses.")
-                        exit(1)
-                    
-                    args = ops[1].ops
-                    if len(ops[1:]) == 1:
-                        print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: not enough arguments for the func operator.")
-                        exit(1)
-
-                    func_ops = ops[2:]
-                    for idx, arg in enumerate(args):
-                        if isinstance(arg, Parens):
-                            print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: wrong argument type")
-                            print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: NOTE: arguments can't be Parens, Keywords, Strings or numbers")
-                            exit(1)
-                        # Modify check to verify passed argument is not func name or variable
-                        elif arg.typ != TokenType.WORD:
-                            print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: wrong argument type")
-                            print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: NOTE: arguments can't be Parens, Keywords, Strings or numbers")
-                            exit(1)
-
-                        found = False
-                        for op in func_ops[:-1]:
-                            if isinstance(op, Parens):
-                                for oop in op.ops:
-                                    if oop.value == arg.value:
-                                        found = True
-                            elif op.value == arg.value:
-                                found = True
-                        if not found:
-                            print(f"{token.loc[0]}:{token.loc[1]}:{token.loc[2]}: ERROR: argument is defined in function but unused.")
-                            exit(1)
-                        func_args.append(arg)
-                        args.pop(idx)
-                    ops = ops[2:]
-                ops.pop()
-        
-                if argument:
-                    Functions[name.value] = { "args": True, "args_name": func_args, "ops": ops } 
-                else:
-                    Functions[name.value] = { "args": False, "ops": ops }
-            elif typ == OpType.END:
-                end_tokens.append(Op(OpType.END, token.loc, "func"))
-                ip += 1
-
-                if func: return end_tokens
-            elif typ == OpType.ARG_ARROW:
-                end_tokens.append(Op(OpType.ARG_ARROW, token.loc, "func"))
-                ip += 1
-        elif token.typ in [TokenType.STR, TokenType.INT, TokenType.FLOAT, TokenType.BOOL, TokenType.WORD]:
-            end_tokens.append(token)
-            ip += 1
-    return end_tokens
-
-def find_token_type(value: str):
-    if value in KEYWORDS or value in KEYWORDS_SIGNS:
-        return TokenType.KEYWORD
-    elif value in SEPARATORS:
-        # Change that later (When brackets come too)
-        return TokenType.PAREN
-    else:
-        try:
-            int(value)
-            return TokenType.INT
-        except ValueError:
+                return self.parse_func(token)
+            elif typ == OpType.WHILE:
+                return self.parse_while(token)
+            elif typ == OpType.IF:
+                return self.parse_if(token)
+            elif typ == OpType.IMPORT:
+                return self.parse_import(token)
+            elif typ == OpType.PURE:
+                if self.peek_keyword() != OpType.FUNC:
+                    raise PluaError(token.loc, "expected `func` after `pure`")
+                func = self.parse_func(self.next())
+                func.pure = True
+                return func
+            elif typ == OpType.RETURN:
+                if not self.in_function:
+                    raise PluaError(token.loc, "`return` outside of a function.")
+                return Return(token.loc, self.parse_expression())
+            raise PluaError(token.loc, f"unexpected keyword `{token.value}`")
+        elif token.typ == TokenType.WORD:
+            if self.peek_keyword() == OpType.EQUAL_ARROW:
+                arrow = self.next()
+                if self.peek() is None:
+                    raise PluaError(token.loc, "not enough arguments for variable reassignation.")
+                self.check_word(token)
+                return Assign(token.loc, self.qualify(token.value), self.parse_expression())
+            elif self.qualify(token.value) in self.functions:
+                return self.parse_call(token)
+            raise PluaError(token.loc, f"unknown word: `{token.value}`")
+        raise PluaError(token.loc, f"unhandled argument in program: `{token.value}` with type: `{token.typ}`")
+
+    def parse_def(self, token: Token) -> Def:
+        name = self.expect_token("a variable name")
+        if name.typ != TokenType.WORD:
+            raise PluaError(token.loc, "trying to name a variable to either a keyword, a number or a boolean value.")
+        type_equal = self.expect_token("`:`")
+        if type_equal.typ != TokenType.KEYWORD or KEYWORDS_BY_NAME.get(type_equal.value) != OpType.TYPE_EQUAL:
+            raise PluaError(token.loc, f"expected `:` but found:  {type_equal.value}")
+        typ = self.expect_token("a type")
+        if typ.value not in TYPES_BY_NAME:
+            raise PluaError(token.loc, "given type is not a correct type.")
+        equal_arrow = self.expect_token("`=>`")
+        if equal_arrow.typ != TokenType.KEYWORD or KEYWORDS_BY_NAME.get(equal_arrow.value) != OpType.EQUAL_ARROW:
+            raise PluaError(token.loc, f"expected `=>` but found:  {equal_arrow.value}")
+        self.check_word(name)
+        return Def(token.loc, self.qualify(name.value), TYPES_BY_NAME[typ.value], self.parse_expression())
+
+    def parse_func(self, token: Token) -> FuncDef:
+        if self.in_function:
+            raise PluaError(token.loc, "functions cannot be defined inside another function.")
+        if self.block is not None:
+            raise PluaError(token.loc, f"functions cannot be defined inside {self.block}.")
+        name = self.expect_token("a function name")
+        if name.typ != TokenType.WORD:
+            raise PluaError(token.loc, "naming a function with either a keyword, a number or a string is not allowed.")
+
+        params = []
+        if self.peek_keyword() == OpType.ARG_ARROW:
+            self.next()
+            arg = self.expect_token("function arguments")
+            if arg.typ == TokenType.LPAREN:
+                while self.peek() is not None and self.peek().typ != TokenType.RPAREN:
+                    arg = self.next()
+                    if arg.typ != TokenType.WORD:
+                        raise PluaError(token.loc, "wrong argument type", "arguments can't be Parens, Keywords, Strings or numbers")
+                    params.append(arg.value)
+                self.expect_token("`)`")
+                if len(params) == 0:
+                    raise PluaError(token.loc, "not enough arguments for the func operator.")
+            elif arg.typ == TokenType.WORD:
+                params.append(arg.value)
+            else:
+                raise PluaError(token.loc, "wrong argument type", "functions arguments need to be passed in Parentheses.")
+
+        self.check_word(name)
+        func = FuncDef(token.loc, self.qualify(name.value), params, [])
+        # Registered before the body is parsed so the function can call itself
+        self.functions[func.name] = func
+        self.in_function = True
+        self.params = params
+        while self.peek_keyword() != OpType.END:
+            if self.peek() is None:
+                raise PluaError(token.loc, "function assignation not ended.")
+            func.body.append(self.parse_statement())
+        self.next()
+        self.in_function = False
+        self.params = []
+        return func
+
+    def parse_while(self, token: Token) -> While:
+        if self.peek() is None or self.peek_keyword() == OpType.ARROW:
+            raise PluaError(token.loc, "expected a condition after `while` but found nothing")
+        condition = self.parse_expression()
+        loop = While(token.loc, condition, self.parse_block("a loop"))
+        if self.peek_keyword() != OpType.END:
+            raise PluaError(token.loc, "while loop not ended.")
+        self.next()
+        return loop
+
+    def parse_block(self, block: str) -> List[Stmt]:
+        """
+        Parses `-> ( {stmts} )`, the body of a loop or of an arm of an `if`.
+        """
+        arrow = self.expect_token("`->`")
+        if arrow.typ != TokenType.KEYWORD or KEYWORDS_BY_NAME.get(arrow.value) != OpType.ARROW:
+            raise PluaError(arrow.loc, f"expected `->` but found:  {arrow.value}")
+
+        lparen = self.expect_token("`(`")
+        if lparen.typ != TokenType.LPAREN:
+            raise PluaError(lparen.loc, f"expected `(` but found:  {lparen.value}", f"the body of {block} is written in parentheses.")
+
+        body = []
+        outer = self.block
+        self.block = block
+        while self.peek() is None or self.peek().typ != TokenType.RPAREN:
+            if self.peek() is None:
+                raise PluaError(lparen.loc, "parentheses not closed")
+            body.append(self.parse_statement())
+        self.next()
+        self.block = outer
+        return body
+
+    def parse_if(self, token: Token) -> If:
+        stmt = If(token.loc, [], [])
+        while self.peek_keyword() != OpType.END:
+            arm = self.peek()
+            if arm is None:
+                raise PluaError(token.loc, "if statement not ended.")
+            if self.peek_keyword() == OpType.ELSE:
+                self.next()
+                stmt.orelse = self.parse_block("an `if`")
+                if self.peek_keyword() != OpType.END:
+                    raise PluaError(arm.loc, "`else` must be the last arm of an `if`.")
+                break
+            if self.peek_keyword() == OpType.ARROW:
+                raise PluaError(arm.loc, "expected a condition before `->` but found nothing")
+            condition = self.parse_expression()
+            stmt.arms.append(Arm(arm.loc, condition, self.parse_block("an `if`")))
+        if not stmt.arms:
+            raise PluaError(token.loc, "expected a condition after `if` but found nothing")
+        self.next()
+        return stmt
+
+    def parse_import(self, token: Token) -> Import:
+        if not self.in_imports or self.in_function or self.block is not None:
+            raise PluaError(token.loc, "`import` must come before the other statements of the file.")
+        path = self.expect_token("the path of a module")
+        if path.typ != TokenType.STR:
+            raise PluaError(path.loc, f"expected the path of a module as a string but found:  {path.value}")
+        # Relative to the directory of the file importing it
+        module = load_module(os.path.normpath(os.path.join(os.path.dirname(token.loc[0]), path.value)), token.loc)
+        for imported, _ in program_modules([Import(token.loc, module)]):
+            known = self.modules.setdefault(imported.name, imported)
+            if known is not imported or imported.name == self.namespace:
+                raise PluaError(token.loc, f"two modules are named `{imported.name}`: `{imported.filepath}` and `{known.filepath if known is not imported else token.loc[0]}`")
+        self.functions.update(module.functions)
+        return Import(token.loc, module)
+
+    def parse_call(self, token: Token) -> Call:
+        name = self.qualify(token.value)
+        func = self.functions[name]
+        args = []
+        if func.params:
+            arg = self.peek()
+            if arg is None:
+                raise PluaError(token.loc, "expected arg for function call but found nothing")
+            if arg.typ == TokenType.LPAREN:
+                self.next()
+                while self.peek() is not None and self.peek().typ != TokenType.RPAREN:
+                    args.append(self.parse_expression())
+                self.expect_token("`)`")
+            elif len(func.params) == 1:
+                args.append(self.parse_unary())
+            else:
+                raise PluaError(token.loc, "arguments need to be passed in parentheses for function call")
+
+            if len(func.params) < len(args):
+                raise PluaError(token.loc, "too many arguments for function call")
+            elif len(func.params) > len(args):
+                raise PluaError(token.loc, "not enough arguments for function call")
+        return Call(token.loc, name, args)
+
+    def parse_expression(self, min_precedence: int=1) -> Expr:
+        lhs = self.parse_unary()
+        while True:
+            op = self.peek_keyword()
+            precedence = BINARY_PRECEDENCE.get(op)
+            if precedence is None or precedence < min_precedence: break
+            token = self.next()
+            if self.peek() is None:
+                raise PluaError(token.loc, "expected one argument after the operator but found nothing.")
+            rhs = self.parse_expression(precedence + 1)
+            lhs = BinOp(token.loc, op, lhs, rhs)
+        return lhs
+
+    def parse_unary(self) -> Expr:
+        token = self.expect_token("an argument")
+        if token.typ == TokenType.LPAREN:
+            if self.peek() is not None and self.peek().typ == TokenType.RPAREN:
+                raise PluaError(token.loc, "expected argument but found nothing")
+            expr = self.parse_expression()
+            closing = self.peek()
+            if closing is None:
+                raise PluaError(token.loc, "parentheses not closed")
+            if closing.typ != TokenType.RPAREN:
+                raise PluaError(closing.loc, f"too many arguments in parentheses, expected `)` but found `{closing.value}`")
+            self.next()
+            return expr
+        elif token.typ in LITERAL_TYPES:
+            return Const(token.loc, token.typ, token.value)
+        elif token.typ == TokenType.WORD:
+            if self.qualify(token.value) in self.functions:
+                return self.parse_call(token)
+            self.check_word(token)
+            return Name(token.loc, self.qualify(token.value))
+        elif token.typ == TokenType.KEYWORD and KEYWORDS_BY_NAME.get(token.value) == OpType.FLOAT:
+            if self.peek() is None:
+                raise PluaError(token.loc, "expected one argument after the operator but found nothing.")
+            return FloatCast(token.loc, self.parse_unary())
+        elif token.typ == TokenType.KEYWORD and KEYWORDS_BY_NAME.get(token.value) in REDUCE_FUNCTIONS:
+            if self.peek() is None:
+                raise PluaError(token.loc, "expected one argument after the operator but found nothing.")
+            return Reduce(token.loc, KEYWORDS_BY_NAME[token.value], self.parse_unary())
+        elif token.typ == TokenType.KEYWORD and KEYWORDS_BY_NAME.get(token.value) == OpType.SPAWN:
+            func = self.expect_token("a function call after `spawn`")
+            if func.typ != TokenType.WORD or self.qualify(func.value) not in self.functions:
+                raise PluaError(func.loc, f"expected a function call after `spawn` but found: `{func.value}`")
+            return Spawn(token.loc, self.parse_call(func))
+        elif token.typ == TokenType.KEYWORD and KEYWORDS_BY_NAME.get(token.value) == OpType.JOIN:
+            if self.peek() is None:
+                raise PluaError(token.loc, "expected one argument after the operator but found nothing.")
+            return Join(token.loc, self.parse_unary())
+        raise PluaError(token.loc, f"expected an argument but found: `{token.value}`")
+
+def parse_program(tokens: Iterable[Token]) -> Program:
+    # Functions are known to the parser from their definition, calls before it are unknown words
+    return Parser(tokens, {}).parse_program()
+
+def fold_expression(expr: Expr) -> Expr:
+    """
+    Evaluates at compile time the parts of the expression that only depend on literals. An operator
+    raising an error, like a division by 0 or any error of python, is kept as it is and only fails if it runs.
+    """
+    if isinstance(expr, BinOp):
+        lhs = fold_expression(expr.lhs)
+        rhs = fold_expression(expr.rhs)
+        if isinstance(lhs, Const) and isinstance(rhs, Const):
+            try:
+                value = binary_op(expr.op, lhs.value, rhs.value, expr.loc)
+            except Exception:
+                pass
+            else:
+                if type(value) is Rope:
+                    # Constants are plain strings in the bytecode and the cache
+                    value = str(value)
+                return Const(expr.loc, VALUE_TYPES[type(value)], value)
+        # Folded operands keep the types found by the type checker
+        return BinOp(expr.loc, expr.op, lhs, rhs, expr.typ)
+    elif isinstance(expr, FloatCast):
+        value = fold_expression(expr.value)
+        if isinstance(value, Const):
+            try:
+                folded = float_cast(value.value, expr.loc)
+            except Exception:
+                pass
+            else:
+                return Const(expr.loc, VALUE_TYPES[type(folded)], folded)
+        return FloatCast(expr.loc, value)
+    elif isinstance(expr, Reduce):
+        value = fold_expression(expr.value)
+        if isinstance(value, Const):
             try:
-                float(value)
+                folded = reduce_array(expr.op, value.value, expr.loc)
+            except Exception:
+                pass
+            else:
+                return Const(expr.loc, VALUE_TYPES[type(folded)], folded)
+        return Reduce(expr.loc, expr.op, value)
+    elif isinstance(expr, Call):
+        return Call(expr.loc, expr.name, [fold_expression(arg) for arg in expr.args])
+    elif isinstance(expr, Spawn):
+        return Spawn(expr.loc, fold_expression(expr.call))
+    elif isinstance(expr, Join):
+        return Join(expr.loc, fold_expression(expr.value))
+    return expr
+
+def fold_constants(program: Program) -> Program:
+    """
+    Folds the expressions of the program into a new program, the nodes of the parsed program
+    are left as they were written so a module can be optimized at each level from the same tree.
+    """
+    folded = []
+    for stmt in program:
+        if isinstance(stmt, Print):
+            folded.append(Print(stmt.loc, fold_expression(stmt.value)))
+        elif isinstance(stmt, Def):
+            folded.append(Def(stmt.loc, stmt.name, stmt.typ, fold_expression(stmt.value)))
+        elif isinstance(stmt, Assign):
+            folded.append(Assign(stmt.loc, stmt.name, fold_expression(stmt.value)))
+        elif isinstance(stmt, Return):
+            folded.append(Return(stmt.loc, fold_expression(stmt.value)))
+        elif isinstance(stmt, Call):
+            folded.append(fold_expression(stmt))
+        elif isinstance(stmt, FuncDef):
+            folded.append(FuncDef(stmt.loc, stmt.name, stmt.params, fold_constants(stmt.body), stmt.pure))
+        elif isinstance(stmt, While):
+            folded.append(While(stmt.loc, fold_expression(stmt.condition), fold_constants(stmt.body)))
+        elif isinstance(stmt, If):
+            # Arms whose condition is a literal are pruned, a true one becomes the `else` of the arms before it
+            arms = []
+            for arm in stmt.arms:
+                condition = fold_expression(arm.condition)
+                body = fold_constants(arm.body)
+                if isinstance(condition, Const) and condition.value is True:
+                    orelse = body
+                    break
+                elif not (isinstance(condition, Const) and condition.value is False):
+                    arms.append(Arm(arm.loc, condition, body))
+            else:
+                orelse = fold_constants(stmt.orelse)
+            folded.append(If(stmt.loc, arms, orelse))
+        elif isinstance(stmt, Import):
+            # Modules are optimized on their own by Module.optimized()
+            folded.append(stmt)
+        else:
+            assert False, f"Unreachable statement in fold_constants(): {stmt}"
+    return folded
+
+def collect_globals(program: Program, global_slots: Dict[str, int]):
+    for stmt in program:
+        if isinstance(stmt, Def):
+            global_slots.setdefault(stmt.name, len(global_slots))
+        elif isinstance(stmt, (FuncDef, While)):
+            collect_globals(stmt.body, global_slots)
+        elif isinstance(stmt, If):
+            for arm in stmt.arms:
+                collect_globals(arm.body, global_slots)
+            collect_globals(stmt.orelse, global_slots)
+
+def check_names(node: Union[Expr, Stmt], global_slots: Dict[str, int], params: List[str]):
+    if isinstance(node, (Name, Assign)):
+        if node.name not in params and node.name not in global_slots:
+            raise PluaError(node.loc, f"unknown word: `{node.name}`")
+    if isinstance(node, BinOp):
+        check_names(node.lhs, global_slots, params)
+        check_names(node.rhs, global_slots, params)
+    elif isinstance(node, (FloatCast, Reduce, Join, Print, Def, Assign, Return)):
+        check_names(node.value, global_slots, params)
+    elif isinstance(node, Call):
+        for arg in node.args:
+            check_names(arg, global_slots, params)
+    elif isinstance(node, Spawn):
+        check_names(node.call, global_slots, params)
+    elif isinstance(node, FuncDef):
+        for stmt in node.body:
+            check_names(stmt, global_slots, node.params)
+    elif isinstance(node, While):
+        check_names(node.condition, global_slots, params)
+        for stmt in node.body:
+            check_names(stmt, global_slots, params)
+    elif isinstance(node, If):
+        for arm in node.arms:
+            check_names(arm.condition, global_slots, params)
+            for stmt in arm.body:
+                check_names(stmt, global_slots, params)
+        for stmt in node.orelse:
+            check_names(stmt, global_slots, params)
+
+def check_pure(node: Union[Expr, Stmt], func: FuncDef, functions: Dict[str, FuncDef]):
+    """
+    A pure function only depends on its arguments: it reads and assigns nothing but its arguments,
+    does not print and only calls pure functions, so its results can be memoized.
+    """
+    if isinstance(node, Print):
+        raise PluaError(node.loc, f"pure function `{func.name}` cannot print")
+    elif isinstance(node, Def):
+        raise PluaError(node.loc, f"pure function `{func.name}` cannot define the global `{node.name}`")
+    elif isinstance(node, (Name, Assign)) and node.name not in func.params:
+        raise PluaError(node.loc, f"pure function `{func.name}` cannot use the global `{node.name}`")
+    elif isinstance(node, Call) and not functions[node.name].pure:
+        raise PluaError(node.loc, f"pure function `{func.name}` cannot call `{node.name}` which is not pure")
+    elif isinstance(node, Spawn):
+        raise PluaError(node.loc, f"pure function `{func.name}` cannot spawn `{node.call.name}`")
+    elif isinstance(node, Join):
+        raise PluaError(node.loc, f"pure function `{func.name}` cannot join a task")
+
+    if isinstance(node, BinOp):
+        check_pure(node.lhs, func, functions)
+        check_pure(node.rhs, func, functions)
+    elif isinstance(node, (FloatCast, Reduce, Assign, Return)):
+        check_pure(node.value, func, functions)
+    elif isinstance(node, Call):
+        for arg in node.args:
+            check_pure(arg, func, functions)
+    elif isinstance(node, While):
+        check_pure(node.condition, func, functions)
+        for stmt in node.body:
+            check_pure(stmt, func, functions)
+    elif isinstance(node, If):
+        for arm in node.arms:
+            check_pure(arm.condition, func, functions)
+            for stmt in arm.body:
+                check_pure(stmt, func, functions)
+        for stmt in node.orelse:
+            check_pure(stmt, func, functions)
+
+def collect_global_types(program: Program) -> Dict[str, Optional[TokenType]]:
+    """
+    Maps every global to the type all its definitions agree on, or None when it is
+    defined with different types. Reassignations keep the type, so a defined global always has it.
+    """
+    types = {}
+    def collect(body: Program):
+        for stmt in body:
+            if isinstance(stmt, Def):
+                types[stmt.name] = stmt.typ if types.get(stmt.name, stmt.typ) == stmt.typ else None
+            elif isinstance(stmt, (FuncDef, While)):
+                collect(stmt.body)
+            elif isinstance(stmt, If):
+                for arm in stmt.arms:
+                    collect(arm.body)
+                collect(stmt.orelse)
+    collect(program)
+    return types
+
+class TypeChecker:
+    """
+    Infers the type of every expression from the literals, the types of the `def`s and the `float`
+    casts, the arguments of a function and the results of calls are of unknown type. Operators whose
+    operand types are proven get their type in `BinOp.typ` so the engines skip their checks, the type
+    errors are all collected so they can be reported before the program runs.
+    """
+    def __init__(self, program: Program):
+        self.global_types = collect_global_types(program)
+        self.functions = visible_functions(program)
+        self.params = []
+        self.errors = []
+
+    def report(self, error: Callable[..., NoReturn], *args):
+        try:
+            error(*args)
+        except PluaError as raised:
+            self.errors.append(raised)
+
+    def expression(self, expr: Expr) -> Optional[TokenType]:
+        if isinstance(expr, Const):
+            return expr.typ
+        elif isinstance(expr, Name):
+            return None if expr.name in self.params else self.global_types.get(expr.name)
+        elif isinstance(expr, BinOp):
+            typ1 = self.expression(expr.lhs)
+            typ2 = self.expression(expr.rhs)
+            expr.typ = None
+            if typ1 is None or typ2 is None:
+                return None
+            elif typ1 == TokenType.ARRAY or typ2 == TokenType.ARRAY:
+                # The type of the elements is only known while running
+                return TokenType.ARRAY
+            elif typ1 != typ2 or PYTHON_VALUE_TYPES[typ1] not in BINARY_OPERAND_TYPES[expr.op]:
+                self.report(binary_type_error, expr.op, typ1, typ2, expr.loc)
+                return None
+            expr.typ = typ1
+            if expr.op == OpType.TRUEDIV:
+                return TokenType.FLOAT
+            elif expr.op in (OpType.PLUS, OpType.SUB, OpType.MUL):
+                return typ1
+            return TokenType.BOOL
+        elif isinstance(expr, FloatCast):
+            typ = self.expression(expr.value)
+            if typ == TokenType.INT:
                 return TokenType.FLOAT
-            except ValueError:
-                return TokenType.WORD
-
-def find_index(line: str, start, space=True, quotes=False):
-    if quotes:
-        while start < len(line) and line[start] != '"':
-            start += 1
-        return start
-    if space:
-        while start < len(line) and line[start].isspace():
-            start += 1
-        return start
-    while start < len(line) and not line[start].isspace():
-        start += 1
-    return start
-
-def lex_line(line: str) -> Tuple[int, TokenType, Union[str, int]]:
-    col = find_index(line, 0)
-    while col < len(line):
-        if line[col] == '(':
-            yield (col, TokenType.LPAREN, '(')
-            col = find_index(line, col + 1)
-        elif line[col] == ')':
-            yield (col, TokenType.RPAREN, ')')
-            col = find_index(line, col + 1)
-        elif line[col] == '"':
-            end_word = find_index(line, col+1, space=False, quotes=True) 
-            if line[end_word] != '"': assert False, "Lexer error ?"
-            yield (col, TokenType.STR, line[col+1:end_word])
-            col = find_index(line, end_word+1)
+            elif typ == TokenType.ARRAY:
+                return TokenType.ARRAY
+            elif typ is not None:
+                self.report(float_cast_error, typ, expr.loc)
+            return None
+        elif isinstance(expr, Reduce):
+            typ = self.expression(expr.value)
+            if typ is not None and typ != TokenType.ARRAY:
+                self.report(reduce_error, expr.op, str(typ), expr.loc)
+            return None
+        elif isinstance(expr, Call):
+            for arg in expr.args:
+                self.expression(arg)
+            return None
+        elif isinstance(expr, Spawn):
+            self.expression(expr.call)
+            if not self.functions[expr.call.name].pure:
+                self.report(spawn_error, expr.call.name, expr.loc)
+            return TokenType.TASK
+        elif isinstance(expr, Join):
+            typ = self.expression(expr.value)
+            if typ is not None and typ != TokenType.TASK:
+                self.report(join_error, typ, expr.loc)
+            return None
+        assert False, f"Unreachable expression in TypeChecker.expression(): {expr}"
+
+    def check(self, program: Program) -> List[PluaError]:
+        for stmt in program:
+            if isinstance(stmt, (Print, Return)):
+                self.expression(stmt.value)
+            elif isinstance(stmt, Def):
+                typ = self.expression(stmt.value)
+                if typ is not None and typ != stmt.typ:
+                    self.errors.append(PluaError(stmt.loc, "mismatched type definition and type of value."))
+            elif isinstance(stmt, Assign):
+                typ = self.expression(stmt.value)
+                current = None if stmt.name in self.params else self.global_types.get(stmt.name)
+                if typ is not None and current is not None and typ != current:
+                    self.errors.append(PluaError(stmt.loc, "variable reassignation cannot change variable type."))
+            elif isinstance(stmt, Call):
+                self.expression(stmt)
+            elif isinstance(stmt, While):
+                typ = self.expression(stmt.condition)
+                if typ is not None and typ != TokenType.BOOL:
+                    self.report(condition_type_error, "while", typ, stmt.loc)
+                self.check(stmt.body)
+            elif isinstance(stmt, If):
+                for arm in stmt.arms:
+                    typ = self.expression(arm.condition)
+                    if typ is not None and typ != TokenType.BOOL:
+                        self.report(condition_type_error, "if", typ, arm.loc)
+                    self.check(arm.body)
+                self.check(stmt.orelse)
+            elif isinstance(stmt, FuncDef):
+                params = self.params
+                self.params = stmt.params
+                self.check(stmt.body)
+                self.params = params
+            elif isinstance(stmt, Import):
+                # Modules are checked when they are loaded
+                pass
+            else:
+                assert False, f"Unreachable statement in TypeChecker.check(): {stmt}"
+        return self.errors
+
+def resolve_names(program: Program, check_types: bool=True) -> Dict[str, int]:
+    """
+    Gives a slot to every variable defined with `def`, they are all globals, while the
+    arguments of a function are its locals. Reports the words that are neither before
+    the program starts, the pure functions that are not and, unless `check_types` is False
+    for a program already checked, the type errors.
+    """
+    global_slots = {}
+    collect_globals(program, global_slots)
+    for stmt in program:
+        check_names(stmt, global_slots, [])
+    functions = visible_functions(program)
+    for func in program_functions(program).values():
+        if func.pure:
+            for stmt in func.body:
+                check_pure(stmt, func, functions)
+    if check_types:
+        errors = TypeChecker(program).check(program)
+        if errors:
+            raise PluaErrors(errors)
+    return global_slots
+
+OPTIMIZATION_LEVELS = [0, 1]
+
+def optimize_program(program: Program, level: int) -> Program:
+    # The modules are optimized at the level of the program importing them
+    program = [Import(stmt.loc, stmt.module, level) if isinstance(stmt, Import) else stmt for stmt in program]
+    # The program is only checked as written: pruning an arm or folding an operator must not hide
+    # its errors, and a folded constant must not turn an error of a running operator into a static one
+    resolve_names(program)
+    if level >= 1:
+        program = fold_constants(program)
+    return program
+
+class Module:
+    """
+    A file imported with `import`, lexed, parsed and checked once per process. Its globals and
+    functions are named `{name}.{word}`: the files importing it call its functions by these names
+    while its globals are only used by the module itself.
+    """
+    __slots__ = ("name", "filepath", "path", "stamp", "program", "functions", "programs", "compiled")
+
+    def __init__(self, name: str, filepath: str, path: str, stamp: Tuple[int, int], program: Program):
+        self.name = name
+        # Path of the file in the locs, `path` is the absolute one
+        self.filepath = filepath
+        self.path = path
+        # Modification time and size of the file it was parsed from
+        self.stamp = stamp
+        self.program = program
+        self.functions = program_functions(program)
+        # Program optimized and compiled at each optimization level
+        self.programs = {}
+        self.compiled = {}
+
+    def optimized(self, level: int) -> Program:
+        program = self.programs.get(level)
+        if program is None:
+            # Constants are folded into new nodes, the parsed program stays as written
+            self.programs[level] = program = optimize_program(self.program, level)
+        return program
+
+    def compile(self, level: int) -> "CompiledProgram":
+        compiled = self.compiled.get(level)
+        if compiled is None:
+            compiled = self.compiled[level] = compile_program(self.optimized(level), f"<{self.name}>")
+        return compiled
+
+# Modules loaded by the process by absolute path, and the ones being loaded to report circular imports
+MODULES: Dict[str, Module] = {}
+LOADING_MODULES: Set[str] = set()
+
+MODULE_NAME = re.compile(r"[^\s.]+")
+
+def module_name(filepath: str) -> str:
+    return os.path.splitext(os.path.basename(filepath))[0]
+
+def file_stamp(path: str) -> Tuple[int, int]:
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+def module_is_current(module: Module) -> bool:
+    # A module parsed before its file or a module it imports changed is parsed again
+    try:
+        if file_stamp(module.path) != module.stamp: return False
+    except OSError:
+        return False
+    return all(MODULES.get(stmt.module.path) is stmt.module and module_is_current(stmt.module)
+               for stmt in module.program if isinstance(stmt, Import))
+
+def load_module(filepath: str, loc: Loc) -> Module:
+    path = os.path.abspath(filepath)
+    module = MODULES.get(path)
+    if module is not None and module_is_current(module):
+        return module
+    if path in LOADING_MODULES:
+        raise PluaError(loc, f"circular import of `{filepath}`")
+    name = module_name(filepath)
+    if not MODULE_NAME.fullmatch(name) or name in KEYWORDS:
+        raise PluaError(loc, f"cannot import `{filepath}`", "the name of a module is the name of its file without extension, a word without `.`")
+    try:
+        stamp = file_stamp(path)
+    except OSError as error:
+        raise PluaError(loc, f"cannot import `{filepath}`: {error.strerror}") from None
+    LOADING_MODULES.add(path)
+    try:
+        program = Parser(lex_stream(filepath), {}, name).parse_program()
+    finally:
+        LOADING_MODULES.discard(path)
+    resolve_names(program)
+    module = MODULES[path] = Module(name, filepath, path, stamp, program)
+    return module
+
+# Every word of a line is matched by one of these alternatives, int and float literals
+# follow the syntax of python's int() and float() and must be followed by a space
+DIGITS = r'\d(?:_?\d)*'
+TOKEN_REGEX = re.compile(r"""
+    (?P<lparen>\()
+  | (?P<rparen>\))
+  | "(?P<str>(?:[^"\\]|\\.)*)"
+  | (?P<unclosed>")
+  | \[(?P<array>[^\[\]"]*)\](?!\S)
+  | (?P<unclosed_array>\[)
+  | (?P<int>[+-]?{digits})(?!\S)
+  | (?P<float>[+-]?(?:(?:(?:{digits})?\.{digits}|{digits}\.?)(?:[eE][+-]?{digits})?|(?i:infinity|inf|nan)))(?!\S)
+  | (?P<word>\S+)
+""".format(digits=DIGITS), re.VERBOSE)
+
+# Repeated literals share one value object, like python already does for small ints.
+# Floats are looked up by their text since 0.0 and -0.0 compare equal
+literal_int = functools.lru_cache(maxsize=4096)(int)
+literal_float = functools.lru_cache(maxsize=4096)(float)
+
+def decode_escapes(value: str) -> Optional[str]:
+    if "\\" not in value: return value
+    try:
+        return value.encode('latin-1', 'backslashreplace').decode('unicode-escape')
+    except UnicodeDecodeError:
+        return None
+
+ARRAY_INT = re.compile(r"(?<!\S)[+-]?{digits}(?!\S)".format(digits=DIGITS))
+
+def lex_array(source: str, loc: Loc) -> Array:
+    """
+    Converts the numbers of an array literal in bulk, all ints or all floats.
+    """
+    items = source.split()
+    if not items:
+        raise PluaError(loc, "array literal cannot be empty")
+    try:
+        return Array('q', map(int, items))
+    except OverflowError:
+        raise PluaError(loc, "array literal has an int out of the range of 64 bit integers") from None
+    except ValueError:
+        pass
+    try:
+        values = Array('d', map(float, items))
+    except ValueError:
+        raise PluaError(loc, "array literal can only contain ints or floats") from None
+    if ARRAY_INT.search(source):
+        raise PluaError(loc, "array literal cannot mix ints and floats, write the ints as floats like `1.0`")
+    return values
+
+def lex_line(line: str, filepath: str="<input>", row: int=0) -> Iterator[Tuple[int, TokenType, Union[str, int, float]]]:
+    for match in TOKEN_REGEX.finditer(line):
+        kind = match.lastgroup
+        if kind == 'word':
+            value = sys.intern(match.group(kind))
+            yield (match.start(), TokenType.KEYWORD if value in KEYWORDS or value in KEYWORDS_SIGNS else TokenType.WORD, value)
+        elif kind == 'int':
+            yield (match.start(), TokenType.INT, literal_int(match.group(kind)))
+        elif kind == 'str':
+            value = decode_escapes(match.group(kind))
+            if value is None:
+                raise PluaError((filepath, row, match.start()), "invalid escape sequence in string literal")
+            yield (match.start(), TokenType.STR, sys.intern(value))
+        elif kind == 'lparen':
+            yield (match.start(), TokenType.LPAREN, '(')
+        elif kind == 'rparen':
+            yield (match.start(), TokenType.RPAREN, ')')
+        elif kind == 'float':
+            yield (match.start(), TokenType.FLOAT, literal_float(match.group(kind)))
+        elif kind == 'array':
+            yield (match.start(), TokenType.ARRAY, lex_array(match.group(kind), (filepath, row, match.start())))
+        elif kind == 'unclosed_array':
+            raise PluaError((filepath, row, match.start()), "array literal is not closed")
         else:
-            end_word = find_index(line, col+1, space=False)
-            value = line[col:end_word]
-            typ = find_token_type(value)
-            if typ == TokenType.INT: value = int(value)
-            elif typ == TokenType.FLOAT: value = float(value)
-            yield (col, typ, value)
-            col = find_index(line, end_word+1)
+            raise PluaError((filepath, row, match.start()), "string literal is not closed")
+
+def lex_stream(filepath: str) -> Iterator[Token]:
+    """
+    Yields the tokens of the file one line at a time, the file is memory mapped
+    so only the line being lexed is ever decoded in memory.
+    """
+    # Every loc of the file shares the same path string
+    filepath = sys.intern(filepath)
+    with open(filepath, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0: return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as source:
+            row = 0
+            start = 0
+            while start < len(source):
+                end = source.find(b'\n', start)
+                end = len(source) if end == -1 else end + 1
+                for (col, typ, value) in lex_line(source[start:end].decode('utf-8'), filepath, row):
+                    yield Token(typ, (filepath, row, col), value)
+                start = end
+                row += 1
 
 def lex_file(filepath: str) -> List[Token]:
-    with open(filepath, "r") as file:
-        tokens_ = [(filepath, row, col, typ, value)
-                for (row, line) in enumerate(file.readlines())
-                for (col, typ, value) in lex_line(line)]
-    return handle_raw_tokens(tokens_)
-
-def handle_raw_tokens(tokens_: list) -> List[Token]:
-    toks = []
-    for token_ in tokens_:
-        (filepath, row, col, typ, value) = token_
-        loc = (filepath, row, col)
-        toks.append(Token(typ, loc, value))
-    return toks
+    return list(lex_stream(filepath))
+
+def lex_source(source: str, filepath: str="<source>") -> Iterator[Token]:
+    filepath = sys.intern(filepath)
+    for row, line in enumerate(source.split("\n")):
+        for (col, typ, value) in lex_line(line, filepath, row):
+            yield Token(typ, (filepath, row, col), value)
+
+# Compiled programs are cached on disk as `<sha256 of the source>-<sha256 of its path>-O<level>.pluac`,
+# the path is the one in the locs so the same source at two paths gets two entries
+CACHE_MAGIC = b"PLUAC\x00"
+
+def cache_directory() -> str:
+    if "PLUA_CACHE_DIR" in os.environ:
+        return os.environ["PLUA_CACHE_DIR"]
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "plua")
+
+@functools.lru_cache(maxsize=None)
+def interpreter_version() -> str:
+    # Any change to the interpreter may change the bytecode, so the interpreter source is the version
+    with open(os.path.abspath(__file__), "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+HASH_CHUNK_SIZE = 1 << 16
+
+def hash_source(filepath: str) -> str:
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as file:
+        # Read in chunks, a large source is never held in memory whole
+        for chunk in iter(functools.partial(file.read, HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class PackedLocs:
+    """
+    Locs of a cached Code, only unpacked into a Loc when an error needs it.
+    """
+    def __init__(self, paths: Tuple[str, ...], path_indexes: bytes, rows: bytes, cols: bytes):
+        self.paths = paths
+        self.path_indexes = array.array('I', path_indexes)
+        self.rows = array.array('I', rows)
+        self.cols = array.array('I', cols)
+        if not len(self.path_indexes) == len(self.rows) == len(self.cols):
+            raise ValueError("corrupted locs")
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, pc: int) -> Loc:
+        return (self.paths[self.path_indexes[pc]], self.rows[pc], self.cols[pc])
+
+def pack_locs(locs: Sequence[Loc]) -> tuple:
+    paths = {}
+    path_indexes = array.array('I', (paths.setdefault(path, len(paths)) for (path, _, _) in locs))
+    rows = array.array('I', (row for (_, row, _) in locs))
+    cols = array.array('I', (col for (_, _, col) in locs))
+    return (tuple(paths), path_indexes.tobytes(), rows.tobytes(), cols.tobytes())
+
+def encode_code(code: Code) -> tuple:
+    args = []
+    for op, arg in code.instructions:
+        if op is OpCode.DEF_GLOBAL:
+            arg = (arg[0], arg[1].value)
+        elif op is OpCode.REDUCE:
+            arg = arg.value
+        elif op is OpCode.BINARY_TYPED:
+            op_type, typ = TYPED_FUNCTION_KEYS[arg]
+            arg = (op_type.value, typ.value)
+        elif op is OpCode.LOAD_CONST and type(arg) is Array:
+            arg = (arg.typecode, arg.tobytes())
+        args.append(arg)
+    opcodes = bytes(op.value for op, _ in code.instructions)
+    return (code.name, code.params, opcodes, tuple(args), pack_locs(code.locs), code.pure)
+
+OPCODES_BY_VALUE = { op.value: op for op in OpCode }
+
+def decode_code(encoded: tuple) -> Code:
+    (name, params, opcodes, args, locs, pure) = encoded
+    if len(opcodes) != len(args):
+        raise ValueError("opcodes and args have different lengths")
+    instructions = [ (OPCODES_BY_VALUE[op], arg) for op, arg in zip(opcodes, args) ]
+    for pc, (op, arg) in enumerate(instructions):
+        if op is OpCode.DEF_GLOBAL:
+            instructions[pc] = (op, (arg[0], TokenType(arg[1])))
+        elif op is OpCode.REDUCE:
+            instructions[pc] = (op, OpType(arg))
+        elif op is OpCode.BINARY_TYPED:
+            instructions[pc] = (op, TYPED_FUNCTIONS[OpType(arg[0]), TokenType(arg[1])])
+        elif op is OpCode.LOAD_CONST and type(arg) is tuple:
+            instructions[pc] = (op, Array(arg[0], arg[1]))
+    locs = PackedLocs(*locs)
+    if len(locs) != len(instructions):
+        raise ValueError("instructions and locs have different lengths")
+    return Code(name, tuple(params), tuple(instructions), locs, bool(pure))
+
+class CachedFunctions(Mapping[str, Code]):
+    """
+    Functions of a module loaded from the cache, each is decoded the first time it is linked, so the
+    functions of a large module that are never called are never decoded.
+    """
+    def __init__(self, encoded: Dict[str, tuple]):
+        self.encoded = encoded
+        self.decoded = {}
+        # The last field of an encoded Code tells if it is pure, memos are created without decoding it
+        self.pure = [name for name, func in encoded.items() if func[-1]]
+
+    def __getitem__(self, name: str) -> Code:
+        code = self.decoded.get(name)
+        if code is None:
+            code = self.decoded[name] = decode_code(self.encoded[name])
+        return code
+
+    def __contains__(self, name: object) -> bool:
+        return name in self.encoded
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.encoded)
+
+    def __len__(self) -> int:
+        return len(self.encoded)
+
+def cache_path(filepath: str, source_hash: str, optimization: int) -> str:
+    path_hash = hashlib.sha256(filepath.encode("utf-8", "surrogateescape")).hexdigest()[:16]
+    return os.path.join(cache_directory(), f"{source_hash}-{path_hash}-O{optimization}.pluac")
+
+def load_cached_program(filepath: str, source_hash: str, optimization: int) -> Optional[CompiledProgram]:
+    try:
+        with open(cache_path(filepath, source_hash, optimization), "rb") as file:
+            if file.read(len(CACHE_MAGIC)) != CACHE_MAGIC: return None
+            (version, cached_hash, cached_filepath, cached_optimization, main, functions, global_names, modules) = marshal.load(file)
+        if version != interpreter_version() or cached_hash != source_hash: return None
+        # Locs of the cached program point to the file it was compiled from
+        if cached_filepath != filepath or cached_optimization != optimization: return None
+        # The program was compiled with the functions of its modules as they were
+        if any(hash_source(path) != module_hash for path, module_hash, *_ in modules): return None
+        functions = { name: decode_code(func) for name, func in functions.items() }
+        modules = { path: CompiledProgram(decode_code(module_main), CachedFunctions(module_functions), tuple(module_globals))
+                    for path, _, module_main, module_functions, module_globals in modules }
+        return CompiledProgram(decode_code(main), functions, tuple(global_names), modules)
+    except (OSError, EOFError, ValueError, TypeError, KeyError):
+        return None
+
+def store_cached_program(filepath: str, source_hash: str, optimization: int, program: CompiledProgram):
+    path = cache_path(filepath, source_hash, optimization)
+    functions = { name: encode_code(func) for name, func in program.functions.items() }
+    try:
+        modules = tuple((module_path, hash_source(module_path), encode_code(module.main),
+                         { name: encode_code(func) for name, func in module.functions.items() }, module.global_names)
+                        for module_path, module in program.modules.items())
+        encoded = (interpreter_version(), source_hash, filepath, optimization,
+                   encode_code(program.main), functions, program.global_names, modules)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            file.write(CACHE_MAGIC)
+            marshal.dump(encoded, file)
+        os.replace(temporary, path)
+    except OSError:
+        # The cache is only an optimization, a read-only cache directory is not an error
+        pass
+
+def compile_file(filepath: str, optimization: int, use_cache: bool=True) -> CompiledProgram:
+    if not use_cache:
+        return compile_program(optimize_program(parse_program(lex_stream(filepath)), optimization))
+    source_hash = hash_source(filepath)
+    compiled = load_cached_program(filepath, source_hash, optimization)
+    if compiled is None:
+        compiled = compile_program(optimize_program(parse_program(lex_stream(filepath)), optimization))
+        store_cached_program(filepath, source_hash, optimization, compiled)
+    return compiled
+
+def module_stamps(program: Union[Program, CompiledProgram]) -> tuple:
+    # Stamps of the files of the modules imported by the program, None for a file that is gone
+    if isinstance(program, CompiledProgram):
+        paths = program.modules
+    else:
+        paths = [module.path for module, _ in program_modules(program)]
+    stamps = []
+    for path in paths:
+        try:
+            stamps.append(file_stamp(path))
+        except OSError:
+            stamps.append(None)
+    return tuple(stamps)
+
+ENGINES = ["vm", "tree", "py"]
+PROGRAMS_CACHE_SIZE = 1024
+
+class Interpreter:
+    """
+    Runs plua programs inside the current python process. Interpreters share no state: every
+    program run gets new variable and function tables, its errors are raised as PluaError
+    and its prints are written to `output` (sys.stdout when None).
+    """
+    def __init__(self, engine: str="vm", optimization: int=1, output: Optional[TextIO]=None,
+                 use_cache: bool=True, profiler: Optional[Profiler]=None, programs: Optional[dict]=None,
+                 memo_size: int=MEMO_SIZE, max_depth: int=MAX_DEPTH, workers: Optional[int]=None):
+        assert engine in ENGINES, f"Unknown engine `{engine}`"
+        assert optimization in OPTIMIZATION_LEVELS, f"Unknown optimization level `{optimization}`"
+        assert profiler is None or engine == "vm", "Only the vm engine can be profiled"
+        self.engine = engine
+        self.optimization = optimization
+        self.output = output
+        self.use_cache = use_cache
+        self.profiler = profiler
+        # Programs compiled by run_file(), kept across runs and interpreters when given
+        self.programs = programs
+        self.memo_size = memo_size
+        self.max_depth = max_depth
+        # Processes running the tasks of a program, one per core when None
+        self.workers = workers
+        # Globals and functions of the last program run, and the hits and misses of its pure functions
+        self.variables: Dict[str, Any] = {}
+        self.functions: Dict[str, Union[FuncDef, Code]] = {}
+        self.memos: Dict[str, Memo] = {}
+
+    def task_pool(self, functions: Dict[str, Union[FuncDef, Code]], output: TextIO) -> ContextManager[TaskPool]:
+        # The workers of a program stop with it
+        return contextlib.closing(TaskPool(functions, self.workers, self.memo_size, self.max_depth, output, self.engine))
+
+    def recursion_limit(self) -> ContextManager:
+        # The parser and simulate() recurse in python for every level of nesting and every call
+        return recursion_limit(max(sys.getrecursionlimit(), stack_depth() + PYTHON_FRAMES_PER_LEVEL * self.max_depth + 1000))
+
+    def run_file(self, filepath: str):
+        with self.recursion_limit():
+            key = None
+            program = None
+            if self.programs is not None:
+                # Locs keep the path as given, so the same file reached through another path is another program
+                stat = os.stat(filepath)
+                key = (os.path.abspath(filepath), filepath, stat.st_mtime_ns, stat.st_size, self.engine, self.optimization)
+                program, stamps = self.programs.get(key, (None, None))
+                if program is not None and module_stamps(program) != stamps:
+                    # A module it imports changed
+                    program = None
+            if program is None:
+                if self.engine == "vm":
+                    program = compile_file(filepath, self.optimization, self.use_cache)
+                else:
+                    program = optimize_program(parse_program(lex_stream(filepath)), self.optimization)
+                if key is not None:
+                    if len(self.programs) >= PROGRAMS_CACHE_SIZE:
+                        # The oldest program goes first
+                        del self.programs[next(iter(self.programs))]
+                    self.programs[key] = (program, module_stamps(program))
+            if self.engine == "vm":
+                self.run_compiled(program)
+            else:
+                self.run_optimized(program, filepath)
+
+    def run_source(self, source: str, filepath: str="<source>"):
+        with self.recursion_limit():
+            self.run_program(parse_program(lex_source(source, filepath)), filepath)
+
+    def run_program(self, program: Program, filepath: str):
+        with self.recursion_limit():
+            self.run_optimized(optimize_program(program, self.optimization), filepath)
+
+    def run_optimized(self, program: Program, filepath: str):
+        # Runs a program from optimize_program() on the tree or the python engine
+        with self.recursion_limit():
+            output = self.output if self.output is not None else sys.stdout
+            if self.engine == "tree":
+                resolve_names(program, check_types=False)
+                program = link_program(program)
+                functions = program_functions(program)
+                self.memos = program_memos(functions, self.memo_size)
+                with self.task_pool(functions, output) as tasks:
+                    context = Context(functions, output, self.memos, self.max_depth, tasks)
+                    self.functions = context.functions
+                    self.variables = context.variables
+                    simulate(program, context)
+            elif self.engine == "py":
+                linked = link_program(program)
+                try:
+                    code = transpile_program(linked, filepath)
+                except TranspileError:
+                    code = None
+                if code is None:
+                    self.run_compiled(compile_program(program))
+                    return
+                self.functions = program_functions(linked)
+                self.memos = program_memos(self.functions, self.memo_size)
+                global_slots = resolve_names(linked, check_types=False)
+                with self.task_pool(self.functions, output) as tasks:
+                    namespace = execute_python(code, output, self.memos, self.max_depth, tasks)
+                self.variables = { name: namespace[f"g{slot}"] for name, slot in global_slots.items()
+                                   if namespace.get(f"g{slot}") is not None }
+            else:
+                self.run_compiled(compile_program(program))
+
+    def run_compiled(self, program: CompiledProgram):
+        output = self.output if self.output is not None else sys.stdout
+        self.functions = compiled_functions(program)
+        self.variables = {}
+        self.memos = compiled_memos(program, self.memo_size)
+        with self.task_pool(self.functions, output) as tasks:
+            if self.profiler is not None:
+                values = execute(profile_program(program), output, self.profiler, self.memos, self.max_depth, tasks)
+            else:
+                values = execute(program, output, memos=self.memos, max_depth=self.max_depth, tasks=tasks)
+        global_names = program.global_names + tuple(name for module in program.modules.values() for name in module.global_names)
+        self.variables = { name: value for name, value in zip(global_names, values) if value is not None }
+
+@dataclass
+class BatchResult:
+    path: str
+    # 0 when the program ran until its end, 1 when it stopped on an error, like the command line
+    status: int
+    output: str
+    seconds: float
+
+# Interpreter of a batch worker process, it keeps the programs it compiled so a file
+# that comes back in the batch is not lexed nor parsed again
+Batch_Interpreter = None
+
+def init_batch_worker(engine: str, optimization: int, use_cache: bool, workers: Optional[int]):
+    global Batch_Interpreter
+    Batch_Interpreter = Interpreter(engine, optimization, None, use_cache, programs={}, workers=workers)
+
+def run_batch_job(path: str) -> BatchResult:
+    start = time.perf_counter()
+    output = io.StringIO()
+    interpreter = Batch_Interpreter
+    interpreter.output = output
+    try:
+        interpreter.run_file(path)
+        status = 0
+    except PluaError as error:
+        output.write(f"{error}\n")
+        status = 1
+    except (OSError, RecursionError) as error:
+        output.write(f"ERROR: {path}: {error}\n")
+        status = 1
+    return BatchResult(path, status, output.getvalue(), time.perf_counter() - start)
+
+def find_batch_files(patterns: List[str]) -> List[str]:
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths += sorted(glob.glob(os.path.join(pattern, "**", "*.plua"), recursive=True))
+        elif os.path.isfile(pattern):
+            paths.append(pattern)
+        else:
+            paths += sorted(glob.glob(pattern, recursive=True))
+    return paths
+
+def run_batch(paths: List[str], jobs: int, stream: bool, engine: str, optimization: int, use_cache: bool,
+              workers: Optional[int]=None) -> List[BatchResult]:
+    """
+    Runs every file in a pool of `jobs` processes and writes the output of each file to stdout after
+    a `==> path <==` header, in the order of `paths` or as soon as a file is done when streaming.
+    A summary with the time and status of every file and the throughput is written to stderr.
+    """
+    start = time.perf_counter()
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(jobs, initializer=init_batch_worker,
+                                                initargs=(engine, optimization, use_cache, workers)) as executor:
+        if stream:
+            futures = [executor.submit(run_batch_job, path) for path in paths]
+            finished = (future.result() for future in concurrent.futures.as_completed(futures))
+        else:
+            # Small jobs are sent in chunks, the workers would otherwise wait on the pipe
+            finished = executor.map(run_batch_job, paths, chunksize=max(1, len(paths) // (jobs * 8)))
+        for result in finished:
+            sys.stdout.write(f"==> {result.path} <==\n{result.output}")
+            results.append(result)
+    elapsed = time.perf_counter() - start
+
+    sys.stdout.flush()
+    width = max([len(result.path) for result in results] + [4])
+    print(f"{'file':<{width}} {'status':>6} {'seconds':>10}", file=sys.stderr)
+    for result in results:
+        print(f"{result.path:<{width}} {result.status:>6} {result.seconds:>10.4f}", file=sys.stderr)
+    failed = sum(result.status != 0 for result in results)
+    print(f"{len(results)} files, {failed} failed, in {elapsed:.3f}s with {jobs} processes: {len(results) / elapsed if elapsed else 0:,.1f} files/s", file=sys.stderr)
+    return results
 
 def usage(program_name: str):
     print(f"USAGE: {program_name} [PROGRAM_PATH] [OPTIONS] [ARGS]")
+    print(f"       {program_name} batch <DIRECTORY|GLOB>... [-j N] [--stream] [OPTIONS]")
+    print(f"       {program_name} serve --socket=<path>")
+    print(f"    PROGRAM_PATH `-` reads the program from stdin")
+    print(f"    SUBCOMMANDS: ")
+    print(f"        batch                  Run every .plua file of the directories or globs in a pool of processes")
+    print(f"            -j <n>             Number of processes (default: the number of cores)")
+    print(f"            --stream           Write the output of each file once it is done instead of in order")
+    print(f"        serve                  Keep the interpreter running and run the programs sent by plua_client.py")
+    print(f"            --socket=<path>    Path of the UNIX socket to listen on")
     print(f"    OPTIONS: ")
-    print(f"        Empty for now")
+    print(f"        --engine=<vm|tree|py>  Execute the program with the bytecode vm (default), with simulate()")
+    print(f"                               or translated to python, falling back to the vm when it cannot be translated")
+    print(f"        -O<level>              Optimization level: 0 executes the program as written, 1 folds constant expressions (default)")
+    print(f"        --no-cache             Do not read nor write the compiled program in the cache directory")
+    print(f"        --profile[=<path>]     Count and time the executed instructions per opcode, function and loc (vm only),")
+    print(f"                               the report is printed to stderr or written as JSON to the path")
+    print(f"        --buffering=<mode>     Flush the output after every `line` (default on a terminal) or every `block` of {OUTPUT_BUFFER_SIZE} bytes")
+    print(f"        --memo-size=<n>        Results kept per pure function, the least recently used go first (default {MEMO_SIZE})")
+    print(f"        --memo-stats           Print the hits and misses of every pure function to stderr")
+    print(f"        --max-depth=<n>        Maximum number of calls in progress, tail calls do not count (default {MAX_DEPTH})")
+    print(f"        --workers=<n>          Processes running the functions given to `spawn` (default: the number of cores)")
+
+
+# Messages between `serve` and its clients are frames of a kind byte, a length and the payload.
+# The client sends its working directory, its arguments, optionally the source read from its stdin,
+# then asks to run. The daemon answers with the stdout and stderr of the run and its exit code.
+SERVE_FRAME = struct.Struct(">cI")
+
+def send_frame(connection: socket.socket, kind: bytes, payload: bytes):
+    connection.sendall(SERVE_FRAME.pack(kind, len(payload)) + payload)
+
+def receive_frame(file: BinaryIO) -> Optional[Tuple[bytes, bytes]]:
+    header = file.read(SERVE_FRAME.size)
+    if len(header) < SERVE_FRAME.size: return None
+    kind, length = SERVE_FRAME.unpack(header)
+    payload = file.read(length)
+    if len(payload) < length: return None
+    return kind, payload
+
+class FrameWriter(io.RawIOBase):
+    """
+    Sends everything written to it as frames of `kind`, buffered by the stream built on top of it.
+    """
+    def __init__(self, connection: socket.socket, kind: bytes):
+        self.connection = connection
+        self.kind = kind
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        send_frame(self.connection, self.kind, bytes(data))
+        return len(data)
+
+def handle_request(connection: socket.socket, programs: dict):
+    cwd = os.getcwd()
+    argv = []
+    source = ""
+    with connection.makefile("rb") as file:
+        while True:
+            frame = receive_frame(file)
+            if frame is None: return
+            kind, payload = frame
+            if kind == b"c":
+                cwd = payload.decode()
+            elif kind == b"a":
+                argv.append(payload.decode())
+            elif kind == b"i":
+                source = payload.decode()
+            elif kind == b"r":
+                break
+
+    stdout = io.TextIOWrapper(io.BufferedWriter(FrameWriter(connection, b"o"), OUTPUT_BUFFER_SIZE), encoding="utf-8")
+    stderr = io.TextIOWrapper(io.BufferedWriter(FrameWriter(connection, b"e"), OUTPUT_BUFFER_SIZE), encoding="utf-8")
+    saved = (sys.stdin, sys.stdout, sys.stderr, os.getcwd())
+    code = 0
+    try:
+        os.chdir(cwd)
+        sys.stdin, sys.stdout, sys.stderr = io.StringIO(source), stdout, stderr
+        if argv and argv[0] == "serve":
+            print("ERROR: serve cannot be run by the daemon")
+            code = 1
+        else:
+            main(["plua.py", *argv], programs)
+    except SystemExit as exit:
+        if isinstance(exit.code, int) or exit.code is None:
+            code = exit.code or 0
+        else:
+            print(exit.code, file=sys.stderr)
+            code = 1
+    except ConnectionError:
+        # The client is gone, nobody reads the rest of the run
+        return
+    except Exception:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdin, sys.stdout, sys.stderr, cwd = saved
+        os.chdir(cwd)
+    try:
+        stdout.flush()
+        stderr.flush()
+        send_frame(connection, b"x", str(code).encode())
+    except ConnectionError:
+        pass
+
+def serve(socket_path: str):
+    """
+    Runs the requests of plua_client.py one after another in this process, every request
+    runs with new program state while compiled programs are kept across requests.
+    """
+    programs = {}
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(socket_path)
+        server.listen(64)
+        print(f"Serving on {socket_path}", file=sys.stderr)
+        while True:
+            connection, _ = server.accept()
+            with connection:
+                handle_request(connection, programs)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+def main(argv: List[str], programs: Optional[dict]=None):
+    program_name, *argv = argv
+    if len(argv) < 1:
+        usage(program_name)
+        print("ERROR: no subcommand provided")
+        exit(1)
+
+    if argv[0] == "serve":
+        socket_path = None
+        args = iter(argv[1:])
+        for arg in args:
+            if arg == "--socket" or arg.startswith("--socket="):
+                socket_path = arg[len("--socket="):] or next(args, None)
+            else:
+                usage(program_name)
+                print(f"ERROR: unknown argument to serve `{arg}`")
+                exit(1)
+        if not socket_path:
+            usage(program_name)
+            print("ERROR: serve needs the path of its socket")
+            exit(1)
+        serve(socket_path)
+        return
+
+    batch = argv[0] == "batch"
+    if batch:
+        argv = argv[1:]
+    batch_patterns = []
+    jobs = os.cpu_count() or 1
+    stream = False
+
+    engine = "vm"
+    optimization = 1
+    use_cache = True
+    program_path = None
+    profile = False
+    profile_path = None
+    memo_size = MEMO_SIZE
+    memo_stats = False
+    max_depth = MAX_DEPTH
+    workers = None
+    buffering = "line" if sys.stdout.isatty() else "block"
+    args = iter(argv)
+    for arg in args:
+        if batch and (arg == "-j" or arg.startswith("-j")):
+            value = arg[len("-j"):] or next(args, "")
+            if not value.isdigit() or int(value) < 1:
+                usage(program_name)
+                print(f"ERROR: -j expects a number of processes but found `{value}`")
+                exit(1)
+            jobs = int(value)
+        elif batch and arg == "--stream":
+            stream = True
+        elif arg.startswith("--engine="):
+            engine = arg[len("--engine="):]
+            if engine not in ENGINES:
+                usage(program_name)
+                print(f"ERROR: unknown engine `{engine}`")
+                exit(1)
+        elif arg == "--no-cache":
+            use_cache = False
+        elif arg.startswith("--buffering="):
+            buffering = arg[len("--buffering="):]
+            if buffering not in BUFFERINGS:
+                usage(program_name)
+                print(f"ERROR: unknown buffering `{buffering}`")
+                exit(1)
+        elif arg.startswith("--memo-size="):
+            value = arg[len("--memo-size="):]
+            if not value.isdigit():
+                usage(program_name)
+                print(f"ERROR: --memo-size expects a number of results but found `{value}`")
+                exit(1)
+            memo_size = int(value)
+        elif arg == "--memo-stats":
+            memo_stats = True
+        elif arg.startswith("--max-depth="):
+            value = arg[len("--max-depth="):]
+            if not value.isdigit():
+                usage(program_name)
+                print(f"ERROR: --max-depth expects a number of calls but found `{value}`")
+                exit(1)
+            max_depth = int(value)
+        elif arg.startswith("--workers="):
+            value = arg[len("--workers="):]
+            if not value.isdigit() or int(value) < 1:
+                usage(program_name)
+                print(f"ERROR: --workers expects a number of processes but found `{value}`")
+                exit(1)
+            workers = int(value)
+        elif arg == "--profile" or arg.startswith("--profile="):
+            profile = True
+            profile_path = arg[len("--profile="):] or None
+        elif arg.startswith("-O"):
+            level = arg[len("-O"):] or "1"
+            if not level.isdigit() or int(level) not in OPTIMIZATION_LEVELS:
+                usage(program_name)
+                print(f"ERROR: unknown optimization level `{level}`")
+                exit(1)
+            optimization = int(level)
+        elif arg.startswith("-") and arg != "-":
+            usage(program_name)
+            print(f"ERROR: unknown option `{arg}`")
+            exit(1)
+        elif batch:
+            batch_patterns.append(arg)
+        elif program_path is None:
+            program_path = arg
+
+    if batch:
+        if not batch_patterns:
+            usage(program_name)
+            print("ERROR: no directory or glob provided to batch")
+            exit(1)
+        if profile:
+            usage(program_name)
+            print("ERROR: --profile is not supported by batch")
+            exit(1)
+        paths = find_batch_files(batch_patterns)
+        if not paths:
+            print("ERROR: no .plua file found")
+            exit(1)
+        sys.stdout = open_output(buffering)
+        results = run_batch(paths, jobs, stream, engine, optimization, use_cache, workers)
+        exit(1 if any(result.status != 0 for result in results) else 0)
+
+    if program_path is None:
+        usage(program_name)
+        print("ERROR: no program provided")
+        exit(1)
 
+    if profile and engine != "vm":
+        usage(program_name)
+        print(f"ERROR: --profile is only supported by the vm engine")
+        exit(1)
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        usage(sys.argv[0])
-        print("ERROR: no subcommand provided")
+    # Program output and error messages go through the same buffered writer so they stay in order
+    sys.stdout.flush()
+    sys.stdout = open_output(buffering)
+    profiler = Profiler() if profile else None
+    interpreter = Interpreter(engine, optimization, sys.stdout, use_cache, profiler, programs, memo_size, max_depth, workers)
+    try:
+        if program_path == "-":
+            interpreter.run_source(sys.stdin.read(), "<stdin>")
+        else:
+            interpreter.run_file(program_path)
+    except PluaError as error:
+        print(error)
         exit(1)
+    finally:
+        if profiler is not None:
+            # Also reported when the program stops on an error
+            profiler.finish()
+            if profile_path is None:
+                sys.stdout.flush()
+                profiler.print_report(sys.stderr)
+            else:
+                with open(profile_path, "w") as file:
+                    json.dump(profiler.report(), file, indent=2)
+        if memo_stats:
+            sys.stdout.flush()
+            print_memo_stats(interpreter.memos, sys.stderr)
+        sys.stdout.flush()
 
-    (program_name, args) = sys.argv
-    if len(args) > 1 and isinstance(args, list):
-        (program_path, options) = args
-        # Parse options flags
-    else:
-        program_path = args
 
-    tokens = lex_file(program_path)
-    program = parse_token_as_op(tokens)
-    simulate(program)
+if __name__ == "__main__":
+    main(sys.argv)
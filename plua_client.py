@@ -0,0 +1,61 @@
+# Thin client of `plua.py serve`: sends a program to the running daemon and writes back its
+# output and exit code, so short scripts skip the start of the interpreter
+#   python plua_client.py --socket=PATH <PROGRAM_PATH|-> [OPTIONS]
+import os
+import socket
+import struct
+import sys
+
+# Same frames as SERVE_FRAME in plua.py: a kind byte, a length and the payload
+FRAME = struct.Struct(">cI")
+
+def send_frame(connection: socket.socket, kind: bytes, payload: bytes):
+    connection.sendall(FRAME.pack(kind, len(payload)) + payload)
+
+def receive_exact(file, size: int) -> bytes:
+    data = file.read(size)
+    if len(data) < size:
+        sys.stderr.write("ERROR: the daemon closed the connection\n")
+        exit(1)
+    return data
+
+def run(socket_path: str, argv: list) -> int:
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(socket_path)
+    with connection:
+        send_frame(connection, b"c", os.getcwd().encode())
+        for arg in argv:
+            send_frame(connection, b"a", arg.encode())
+        if "-" in argv:
+            send_frame(connection, b"i", sys.stdin.buffer.read())
+        send_frame(connection, b"r", b"")
+
+        with connection.makefile("rb") as file:
+            while True:
+                kind, length = FRAME.unpack(receive_exact(file, FRAME.size))
+                payload = receive_exact(file, length)
+                if kind == b"o":
+                    sys.stdout.buffer.write(payload)
+                    sys.stdout.buffer.flush()
+                elif kind == b"e":
+                    sys.stdout.buffer.flush()
+                    sys.stderr.buffer.write(payload)
+                    sys.stderr.buffer.flush()
+                elif kind == b"x":
+                    return int(payload)
+
+if __name__ == "__main__":
+    program_name, *argv = sys.argv
+    socket_path = os.environ.get("PLUA_SOCKET")
+    if argv and argv[0].startswith("--socket="):
+        socket_path = argv[0][len("--socket="):]
+        argv = argv[1:]
+    if not socket_path or not argv:
+        print(f"USAGE: {program_name} --socket=<path> <PROGRAM_PATH|-> [OPTIONS]")
+        print(f"    The socket can also be given by PLUA_SOCKET, the options are the ones of plua.py")
+        exit(1)
+    try:
+        exit(run(socket_path, argv))
+    except (ConnectionRefusedError, FileNotFoundError):
+        print(f"ERROR: no daemon listening on {socket_path}, start one with `plua.py serve --socket={socket_path}`")
+        exit(1)
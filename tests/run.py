@@ -0,0 +1,76 @@
+# Runs every tests/*.plua and tests/errors/*.plua having a .out file next to it on every engine and
+# optimization level, and checks that what it prints, its stdout then its stderr, is the .out file
+#   python tests/run.py [--engines=vm,tree,py] [--update]
+import glob
+import os
+import subprocess
+import sys
+from typing import *
+
+TESTS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIRECTORY = os.path.dirname(TESTS_DIRECTORY)
+sys.path.insert(0, ROOT_DIRECTORY)
+from plua import ENGINES, OPTIMIZATION_LEVELS
+
+# Small enough for the tail calls of tests/recursion.plua to go far beyond it
+MAX_DEPTH = 1000
+
+def find_tests() -> List[str]:
+    # Paths relative to the root of the repository, as they are printed in the errors
+    paths = glob.glob(os.path.join(TESTS_DIRECTORY, "*.plua")) + glob.glob(os.path.join(TESTS_DIRECTORY, "errors", "*.plua"))
+    return sorted(os.path.relpath(path, ROOT_DIRECTORY) for path in paths)
+
+def expected_path(path: str) -> str:
+    return os.path.join(ROOT_DIRECTORY, os.path.splitext(path)[0] + ".out")
+
+def run_test(path: str, engine: str, optimization: int) -> str:
+    command = [sys.executable, "plua.py", f"-O{optimization}", f"--engine={engine}", "--no-cache", f"--max-depth={MAX_DEPTH}", path]
+    result = subprocess.run(command, cwd=ROOT_DIRECTORY, capture_output=True, text=True)
+    return result.stdout + result.stderr
+
+def usage(program_name: str):
+    print(f"USAGE: {program_name} [OPTIONS]")
+    print(f"    OPTIONS: ")
+    print(f"        --engines=<engines>    Comma separated engines to run the tests on: {','.join(ENGINES)}")
+    print(f"        --update               Write the output of the vm at -O0 as the .out file of every test")
+
+if __name__ == "__main__":
+    program_name, *argv = sys.argv
+    engines = list(ENGINES)
+    update = False
+    for arg in argv:
+        if arg.startswith("--engines="):
+            engines = arg[len("--engines="):].split(",")
+        elif arg == "--update":
+            update = True
+        else:
+            usage(program_name)
+            print(f"ERROR: unknown argument `{arg}`")
+            exit(1)
+    for engine in engines:
+        if engine not in ENGINES:
+            usage(program_name)
+            print(f"ERROR: unknown engine `{engine}`")
+            exit(1)
+
+    if update:
+        for path in find_tests():
+            with open(expected_path(path), "w") as file:
+                file.write(run_test(path, "vm", 0))
+        exit(0)
+
+    failures = 0
+    for path in find_tests():
+        if not os.path.exists(expected_path(path)):
+            continue
+        with open(expected_path(path)) as file:
+            expected = file.read()
+        for engine in engines:
+            for optimization in OPTIMIZATION_LEVELS:
+                output = run_test(path, engine, optimization)
+                if output != expected:
+                    failures += 1
+                    print(f"FAILED: {path} --engine={engine} -O{optimization}")
+                    print(output, end="")
+    print(f"{failures} failure(s)")
+    exit(1 if failures else 0)